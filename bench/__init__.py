@@ -0,0 +1 @@
+"Benchmarks of fetching and deploying against local stand-ins for the Paper and Jenkins APIs"
@@ -0,0 +1,233 @@
+"""Time `spec.main.main` end to end against local stand-in servers
+
+    python -m bench [SCENARIO ...] [--latency MS] [--builds N] [--artifact-size SIZE] ...
+
+Every scenario runs in a fresh temporary directory with its own stand-in server,
+and reports the wall time, requests and bytes sent by the server for each step."""
+
+from __future__ import annotations
+
+import argparse
+import contextlib
+import io
+import json
+from pathlib import Path
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+from typing import Any, Sequence
+
+from spec.base import parse_size
+from spec.main import main as spec_main  # imported up front, so the first scenario does not pay for it
+
+from .servers import StandIn
+
+
+SPEC_TEMPLATE = """\
+server: !jar.paper
+  project: paper
+  version_group: "{version_group}"
+  api: {api}
+plugins: {plugins}
+store: !store.default
+  directory: {dir}/store
+http:
+  pool_size: {pool_size}
+folders:
+  server: {dir}/server
+  plugins: {dir}/server/plugins
+  mode: hardlink
+"""
+
+PLUGIN_TEMPLATE = """
+- !jar.jenkins
+  url: {url}
+  job: plugin{i}
+  batch: {batch}
+  restrictions:
+  - !jar.jenkins.r.success
+  - !jar.jenkins.r.artifactregex
+    pattern: "plugin{i}-\\\\d+\\\\.jar"
+"""
+
+
+class Step:
+    "One run of the program; `fresh` removes the store and deployed server first"
+
+    def __init__(self, name: str, argv: Sequence[str], fresh: bool = False):
+        self.name = name
+        self.argv = list(argv)
+        self.fresh = fresh
+
+    name: str
+    argv: list[str]
+    fresh: bool
+
+
+class Scenario:
+    def __init__(self, description: str, steps: Sequence[Step], server: dict[str, Any] = {}, spec: dict[str, Any] = {}):
+        self.description = description
+        self.steps = list(steps)
+        self.server = dict(server)  # StandIn arguments
+        self.spec = dict(spec)  # specification template arguments
+
+    description: str
+    steps: list[Step]
+    server: dict[str, Any]
+    spec: dict[str, Any]
+
+
+COLD_WARM = [Step("cold", ["--dl"]), Step("warm", ["--dl"])]
+
+SCENARIOS = {
+    "paper": Scenario("the Paper server alone", COLD_WARM, spec={"plugins": 0}),
+    "large": Scenario("a large Paper jar, downloaded in segments", [Step("cold", ["--dl"])],
+                      server={"artifact_size": 64 << 20}, spec={"plugins": 0}),
+    "plugins": Scenario("Paper and many Jenkins plugins with restrictions", COLD_WARM),
+    "history": Scenario("Jenkins jobs whose recent builds mostly failed", [Step("cold", ["--dl"])],
+                        server={"builds": 400, "broken_builds": 0.9}, spec={"plugins": 5}),
+    "unbatched": Scenario("as history, requesting every build separately", [Step("cold", ["--dl"])],
+                          server={"builds": 400, "broken_builds": 0.9}, spec={"plugins": 5, "batch": 0}),
+    "flaky": Scenario("downloads which are often cut off halfway", [Step("cold", ["--dl"])],
+                      server={"failure_rate": 0.15}),
+    "locked": Scenario("deploying pinned jars into an empty store", [
+        Step("lock", ["--lock"]),
+        Step("locked", ["--dl", "--locked"], fresh=True),
+    ]),
+}
+
+DEFAULT_SPEC = {"plugins": 20, "batch": 20, "pool_size": 10, "version_group": "1.20"}
+
+
+def write_spec(path: Path, standin: StandIn, plugins: int, batch: int, pool_size: int, version_group: str):
+    entries = "".join(PLUGIN_TEMPLATE.format(url=standin.url, i=i, batch=batch) for i in range(plugins))
+    path.write_text(SPEC_TEMPLATE.format(
+        version_group=version_group,
+        api=standin.paper_api,
+        plugins=entries or "[]",
+        dir=path.parent.as_posix(),
+        pool_size=pool_size,
+    ))
+
+
+def run_main(argv: Sequence[str], verbose: bool) -> tuple[float, str | None]:
+    "Run the program in this process, returning its wall time and an error if it failed"
+    output = io.StringIO()
+    error = None
+    with contextlib.ExitStack() as stack:
+        if not verbose:
+            stack.enter_context(contextlib.redirect_stdout(output))
+            stack.enter_context(contextlib.redirect_stderr(output))
+        start = time.perf_counter()
+        try:
+            spec_main(argv)
+        except SystemExit as e:
+            if e.code not in (None, 0):
+                error = str(e.code)
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}"
+        wall = time.perf_counter() - start
+    if error is not None and not verbose:
+        print(output.getvalue()[-2000:], file=sys.stderr)
+    return wall, error
+
+
+def run_scenario(name: str, scenario: Scenario, server_overrides: dict[str, Any], spec_overrides: dict[str, Any],
+                 jobs: int | None, verbose: bool) -> list[dict[str, Any]]:
+    rows = []
+    with tempfile.TemporaryDirectory(prefix=f"bench-{name}-") as tmp, \
+            StandIn(**{**scenario.server, **server_overrides}) as standin:
+        specfile = Path(tmp) / "spec.yml"
+        write_spec(specfile, standin, **{**DEFAULT_SPEC, **scenario.spec, **spec_overrides})
+        for step in scenario.steps:
+            if step.fresh:
+                shutil.rmtree(Path(tmp) / "store", ignore_errors=True)
+                shutil.rmtree(Path(tmp) / "server", ignore_errors=True)
+            argv = [*step.argv, str(specfile)]
+            if jobs is not None:
+                argv[:0] = ["--jobs", str(jobs)]
+            standin.stats.reset()
+            wall, error = run_main(argv, verbose)
+            rows.append({"scenario": name, "step": step.name, "wall": wall, **standin.stats.as_dict(), "error": error})
+    return rows
+
+
+def print_table(rows: Sequence[dict[str, Any]]):
+    print(f"{'scenario':<10} {'step':<7} {'wall (s)':>9} {'requests':>9} {'api':>6} {'downloads':>10} "
+          f"{'MiB sent':>9} {'cut off':>8}  result")
+    for r in rows:
+        print(f"{r['scenario']:<10} {r['step']:<7} {r['wall']:>9.3f} {r['requests']:>9} {r['api_requests']:>6} "
+              f"{r['downloads']:>10} {r['bytes_sent'] / (1 << 20):>9.1f} {r['failures']:>8}  {r['error'] or 'ok'}")
+
+
+def summarise(rows: Sequence[dict[str, Any]]) -> list[dict[str, Any]]:
+    "Combine repeated runs of each step, taking the median wall time"
+    groups: dict[tuple[str, str], list[dict[str, Any]]] = {}
+    for r in rows:
+        groups.setdefault((r["scenario"], r["step"]), []).append(r)
+    return [
+        {**rs[-1], "wall": statistics.median(r["wall"] for r in rs),
+         "error": next((r["error"] for r in rs if r["error"]), None)}
+        for rs in groups.values()
+    ]
+
+
+def create_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog="python -m bench", description=__doc__.splitlines()[0])
+    parser.add_argument("scenarios", nargs="*", metavar="SCENARIO",
+                        help=f"Scenarios to run (default: all of {', '.join(SCENARIOS)})")
+    parser.add_argument("--list", action="store_true", help="List the scenarios and exit")
+    parser.add_argument("--latency", type=float, metavar="MS", help="Delay every response by MS milliseconds")
+    parser.add_argument("--builds", type=int, metavar="N", help="Length of every build history")
+    parser.add_argument("--broken-builds", type=float, metavar="FRACTION", help="Fraction of Jenkins builds which failed")
+    parser.add_argument("--artifact-size", type=parse_size, metavar="SIZE", help="Size of every jar, eg. 8M")
+    parser.add_argument("--failure-rate", type=float, metavar="FRACTION", help="Fraction of downloads cut off halfway")
+    parser.add_argument("--plugins", type=int, metavar="N", help="Number of Jenkins plugins in the specification")
+    parser.add_argument("--batch", type=int, metavar="N", help="Jenkins builds scanned per request (0 for one at a time)")
+    parser.add_argument("--pool-size", type=int, metavar="N", help="Connections kept open per host")
+    parser.add_argument("-j", "--jobs", type=int, metavar="N", help="Passed on to the program")
+    parser.add_argument("--repeat", type=int, default=1, metavar="N", help="Run every scenario N times, reporting the median")
+    parser.add_argument("--seed", type=int, help="Seed for the generated jars and failures")
+    parser.add_argument("--json", type=Path, metavar="FILE", help="Also write every result to FILE")
+    parser.add_argument("-v", "--verbose", action="store_true", help="Show the program's output")
+    return parser
+
+
+def main(argv: Sequence[str] | None = None):
+    args = create_parser().parse_args(argv)
+    if args.list:
+        for name, scenario in SCENARIOS.items():
+            print(f"{name:<10} {scenario.description}")
+        return
+    unknown = [s for s in args.scenarios if s not in SCENARIOS]
+    if unknown:
+        sys.exit(f"Unknown scenarios: {', '.join(unknown)}")
+
+    server_overrides = {k: v for k, v in {
+        "latency": None if args.latency is None else args.latency / 1000,
+        "builds": args.builds,
+        "broken_builds": args.broken_builds,
+        "artifact_size": args.artifact_size,
+        "failure_rate": args.failure_rate,
+        "seed": args.seed,
+    }.items() if v is not None}
+    spec_overrides = {k: v for k, v in {
+        "plugins": args.plugins, "batch": args.batch, "pool_size": args.pool_size,
+    }.items() if v is not None}
+
+    rows = []
+    for name in args.scenarios or SCENARIOS:
+        for _ in range(args.repeat):
+            rows.extend(run_scenario(name, SCENARIOS[name], server_overrides, spec_overrides, args.jobs, args.verbose))
+
+    print_table(summarise(rows))
+    if args.json is not None:
+        args.json.write_text(json.dumps(rows, indent=2))
+    if any(r["error"] for r in rows):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,368 @@
+"""Local HTTP servers imitating the Paper v2 API and the Jenkins JSON API
+
+One `StandIn` server answers both APIs:
+
+    {url}/api/v2/projects/{project}                              ProjectResponse
+    {url}/api/v2/projects/{project}/version_group/{group}/builds VersionGroupBuildsResponse
+    {url}/api/v2/projects/{project}/versions/{version}/builds/{build}/downloads/{name}
+    {url}/job/{job}/api/json                                     JobData (honouring `tree`)
+    {url}/job/{job}/{number}/api/json                            BuildData
+    {url}/job/{job}/{number}/artifact/{path}
+
+Every response is delayed by `latency`, and a `failure_rate` fraction of artifact
+downloads are cut off halfway, so that resuming is exercised."""
+
+from __future__ import annotations
+
+from datetime import datetime, timedelta, timezone
+import hashlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import random
+import re
+import threading
+import time
+from typing import Any
+from urllib.parse import parse_qs, unquote, urlsplit
+
+
+PROJECT_NAMES = {"paper": "Paper", "waterfall": "Waterfall", "velocity": "Velocity"}
+
+
+class Stats:
+    "Counters of what the server has sent, shared between its handler threads"
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    requests: int
+    api_requests: int
+    downloads: int
+    bytes_sent: int
+    failures: int  # downloads cut off on purpose
+
+    def reset(self):
+        with self._lock:
+            self.requests = 0
+            self.api_requests = 0
+            self.downloads = 0
+            self.bytes_sent = 0
+            self.failures = 0
+
+    def add(self, **counts: int):
+        with self._lock:
+            for name, n in counts.items():
+                setattr(self, name, getattr(self, name) + n)
+
+    def as_dict(self) -> dict[str, int]:
+        with self._lock:
+            return {
+                "requests": self.requests,
+                "api_requests": self.api_requests,
+                "downloads": self.downloads,
+                "bytes_sent": self.bytes_sent,
+                "failures": self.failures,
+            }
+
+
+class Artifact:
+    """A jar of `size` bytes which is never held in memory on its own
+
+    Every artifact is the same random body followed by a suffix made from its name,
+    so they all differ but their hashes only cost hashing the suffix."""
+
+    def __init__(self, name: str, body: bytes, body_hashes: dict[str, Any]):
+        self.name = name
+        self.body = body
+        self.suffix = hashlib.sha256(name.encode()).digest()
+        self.size = len(body) + len(self.suffix)
+        self.etag = '"' + hashlib.sha1(self.suffix).hexdigest() + '"'
+        self._hashes = body_hashes
+
+    name: str
+    body: bytes
+    suffix: bytes
+    size: int
+    etag: str
+
+    def digest(self, algorithm: str) -> str:
+        h = self._hashes[algorithm].copy()
+        h.update(self.suffix)
+        return h.hexdigest()
+
+    def read(self, start: int, end: int) -> bytes:
+        "Bytes `start` to `end` (exclusive)"
+        data = self.body[start:end]
+        if end > len(self.body):
+            data += self.suffix[max(start - len(self.body), 0):end - len(self.body)]
+        return data
+
+
+class StandIn:
+    """A Paper and Jenkins API server on localhost
+
+    `builds` is the length of every build history; in Jenkins, a `broken_builds`
+    fraction of them failed, and only every other build has an artifact. With
+    `unknown_size`, partial responses do not give the size of the whole artifact
+    (`Content-Range: bytes 0-99/*`)."""
+
+    def __init__(
+        self,
+        latency: float = 0.0,
+        builds: int = 50,
+        artifact_size: int = 1 << 20,
+        failure_rate: float = 0.0,
+        broken_builds: float = 0.3,
+        version_groups: tuple[str, ...] = ("1.19", "1.20"),
+        seed: int = 0,
+        unknown_size: bool = False,
+    ):
+        if builds < 1:
+            raise ValueError("There must be at least 1 build")
+        self.latency = latency
+        self.builds = builds
+        self.failure_rate = failure_rate
+        self.broken_builds = broken_builds
+        self.version_groups = list(version_groups)
+        self.seed = seed
+        self.unknown_size = unknown_size
+        self.stats = Stats()
+
+        rng = random.Random(seed)
+        # a cheap body: a random block repeated, which no transfer compresses
+        block = rng.randbytes(min(artifact_size, 1 << 16) or 1)
+        self._body = (block * (artifact_size // len(block) + 1))[:artifact_size]
+        self._body_hashes = {name: hashlib.new(name, self._body) for name in ("sha256", "md5")}
+        self._failures = random.Random(seed + 1)
+        self._failures_lock = threading.Lock()
+        self._artifacts: dict[str, Artifact] = {}
+        self._artifacts_lock = threading.Lock()
+
+        self._server: ThreadingHTTPServer | None = None
+
+    latency: float
+    builds: int
+    failure_rate: float
+    broken_builds: float
+    version_groups: list[str]
+    seed: int
+    unknown_size: bool
+    stats: Stats
+
+    @property
+    def url(self) -> str:
+        assert self._server is not None, "server is not running"
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    @property
+    def paper_api(self) -> str:
+        return self.url + "/api/v2"
+
+    def start(self, port: int = 0) -> StandIn:
+        handler = type("Handler", (_Handler,), {"standin": self})
+        self._server = ThreadingHTTPServer(("127.0.0.1", port), handler)
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, name="standin", daemon=True).start()
+        return self
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    def __enter__(self) -> StandIn:
+        return self.start()
+
+    def __exit__(self, *exc: Any):
+        self.stop()
+
+    def artifact(self, name: str) -> Artifact:
+        with self._artifacts_lock:
+            a = self._artifacts.get(name)
+            if a is None:
+                a = self._artifacts[name] = Artifact(name, self._body, self._body_hashes)
+            return a
+
+    def should_fail(self) -> bool:
+        with self._failures_lock:
+            return self._failures.random() < self.failure_rate
+
+    # Paper
+
+    def _versions(self, group: str) -> list[str]:
+        return [group, f"{group}.1", f"{group}.2"]
+
+    def paper_project(self, project: str) -> dict[str, Any]:
+        return {
+            "project_id": project,
+            "project_name": PROJECT_NAMES.get(project, project.title()),
+            "version_groups": self.version_groups,
+            "versions": [v for g in self.version_groups for v in self._versions(g)],
+        }
+
+    def paper_builds(self, project: str, group: str) -> dict[str, Any] | None:
+        if group not in self.version_groups:
+            return None
+        version = self._versions(group)[-1]
+        start = datetime(2022, 1, 1, tzinfo=timezone.utc)
+        builds = []
+        for n in range(1, self.builds + 1):
+            name = f"{project}-{version}-{n}.jar"
+            builds.append({
+                "build": n,
+                "time": (start + timedelta(hours=n)).strftime("%Y-%m-%dT%H:%M:%S.000Z"),
+                "changes": [],
+                "downloads": {"application": {"name": name, "sha256": self.artifact(name).digest("sha256")}},
+                "version": version,
+            })
+        return {
+            "project_id": project,
+            "project_name": PROJECT_NAMES.get(project, project.title()),
+            "version_group": group,
+            "versions": self._versions(group),
+            "builds": builds,
+        }
+
+    # Jenkins
+
+    def jenkins_build(self, base: str, job: str, number: int) -> dict[str, Any]:
+        broken = random.Random(f"{self.seed}/{job}/{number}").random() < self.broken_builds
+        artifacts = []
+        if number % 2 == 0:
+            name = f"{job}-{number}.jar"
+            artifacts.append({"displayPath": None, "fileName": name, "relativePath": f"target/{name}"})
+        return {
+            "number": number,
+            "url": f"{base}/job/{job}/{number}/",
+            "result": "FAILURE" if broken else "SUCCESS",
+            "timestamp": 1640995200000 + number * 3600000,
+            "artifacts": artifacts,
+            "fingerprint": [{"fileName": a["fileName"], "hash": self.artifact(a["fileName"]).digest("md5")} for a in artifacts],
+        }
+
+    def jenkins_job(self, base: str, job: str, tree: str) -> dict[str, Any]:
+        numbers = list(range(self.builds, 0, -1))  # newest first
+        data: dict[str, Any] = {"name": job, "url": f"{base}/job/{job}/"}
+        m = re.search(r"builds\[([^\]]*)\](?:\{(\d*),(\d*)\})?", tree)
+        if m:
+            start = int(m.group(2) or 0)
+            end = int(m.group(3)) if m.group(3) else len(numbers)
+            builds = [self.jenkins_build(base, job, n) for n in numbers[start:end]]
+            if m.group(1) == "url":
+                builds = [{"url": b["url"]} for b in builds]
+            data["builds"] = builds
+        if "lastStableBuild" in tree:
+            stable = next((n for n in numbers if self.jenkins_build(base, job, n)["result"] == "SUCCESS"), None)
+            data["lastStableBuild"] = None if stable is None else self.jenkins_build(base, job, stable)
+        return data
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    standin: StandIn
+
+    def log_message(self, format: str, *args: Any):
+        pass
+
+    def do_GET(self):
+        s = self.standin
+        s.stats.add(requests=1)
+        if s.latency:
+            time.sleep(s.latency)
+
+        parts = urlsplit(self.path)
+        path = unquote(parts.path)
+        query = parse_qs(parts.query)
+        base = f"http://{self.headers['Host']}"
+
+        m = re.fullmatch(r"/api/v2/projects/([^/]+)", path)
+        if m:
+            return self.send_json(s.paper_project(m.group(1)))
+        m = re.fullmatch(r"/api/v2/projects/([^/]+)/version_group/([^/]+)/builds", path)
+        if m:
+            return self.send_json(s.paper_builds(m.group(1), m.group(2)))
+        m = re.fullmatch(r"/api/v2/projects/[^/]+/versions/[^/]+/builds/\d+/downloads/([^/]+)", path)
+        if m:
+            return self.send_artifact(s.artifact(m.group(1)))
+
+        m = re.fullmatch(r"/job/([^/]+)/api/json", path)
+        if m:
+            return self.send_json(s.jenkins_job(base, m.group(1), query.get("tree", [""])[0]))
+        m = re.fullmatch(r"/job/([^/]+)/(\d+)/api/json", path)
+        if m:
+            return self.send_json(s.jenkins_build(base, m.group(1), int(m.group(2))))
+        m = re.fullmatch(r"/job/[^/]+/\d+/artifact/(?:.*/)?([^/]+)", path)
+        if m:
+            return self.send_artifact(s.artifact(m.group(1)))
+
+        self.send_json(None)
+
+    def send_json(self, data: Any):
+        self.standin.stats.add(api_requests=1)
+        if data is None:
+            self.send_response(404)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        body = json.dumps(data).encode()
+        etag = '"' + hashlib.sha1(body).hexdigest() + '"'
+        if self.headers.get("If-None-Match") == etag:
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("ETag", etag)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+        self.standin.stats.add(bytes_sent=len(body))
+
+    def send_artifact(self, artifact: Artifact):
+        s = self.standin
+        s.stats.add(downloads=1)
+        start, end = 0, artifact.size
+        rng = self.headers.get("Range")
+        partial = False
+        if rng and self.headers.get("If-Range", artifact.etag) == artifact.etag:
+            m = re.fullmatch(r"bytes=(\d+)-(\d*)", rng.strip())
+            if m:
+                start = int(m.group(1))
+                end = min(int(m.group(2)) + 1, artifact.size) if m.group(2) else artifact.size
+                if start >= artifact.size:
+                    self.send_response(416)
+                    self.send_header("Content-Range", f"bytes */{artifact.size}")
+                    self.send_header("Content-Length", "0")
+                    self.end_headers()
+                    return
+                partial = True
+
+        self.send_response(206 if partial else 200)
+        if partial:
+            total = "*" if s.unknown_size else artifact.size
+            self.send_header("Content-Range", f"bytes {start}-{end - 1}/{total}")
+        self.send_header("Content-Type", "application/java-archive")
+        self.send_header("Accept-Ranges", "bytes")
+        self.send_header("ETag", artifact.etag)
+        self.send_header("Content-Length", str(end - start))
+        self.end_headers()
+
+        cut = start + (end - start) // 2 if s.should_fail() else None
+        pos = start
+        while pos < (cut if cut is not None else end):
+            chunk = artifact.read(pos, min(pos + (1 << 16), cut if cut is not None else end))
+            try:
+                self.wfile.write(chunk)
+            except OSError:
+                return
+            s.stats.add(bytes_sent=len(chunk))
+            pos += len(chunk)
+        if cut is not None:
+            s.stats.add(failures=1)
+            self.close_connection = True
+            self.wfile.flush()
@@ -1,5 +1,7 @@
 from __future__ import annotations
 
+import importlib
+import re
 from typing import IO, TYPE_CHECKING, Any, Sequence, Union
 import yaml
 import yaml.constructor
@@ -11,11 +13,28 @@ if TYPE_CHECKING:
     _path_resolver_item = Union[str, int, None]
 
 
-class Loader(yaml.SafeLoader):
+SIZE_UNITS = {"": 1, "k": 1 << 10, "m": 1 << 20, "g": 1 << 30, "t": 1 << 40}
+
+
+def parse_size(size: str | int) -> int:
+    "Parse a size in bytes, optionally suffixed by K, M, G or T (powers of 1024)"
+    if isinstance(size, int):
+        return size
+    m = re.fullmatch(r"\s*(\d+(?:\.\d+)?)\s*([kmgt]?)i?b?\s*", str(size), re.I)
+    if not m:
+        raise ValueError(f"Invalid size: {size}")
+    return int(float(m.group(1)) * SIZE_UNITS[m.group(2).lower()])
+
+
+# the libyaml parser is much faster, if PyYAML was built with it
+class Loader(getattr(yaml, "CSafeLoader", yaml.SafeLoader)):
     pass
 
 
 class YamlObject:
+    # construct the whole mapping before __init__, for classes which look inside their (nested) arguments
+    yaml_deep: bool = False
+
     def __init_subclass__(
         cls,
         yamltag: str | None = None,
@@ -65,7 +84,7 @@ class YamlObject:
         node: yaml.nodes.Node,
     ):
         if isinstance(node, yaml.nodes.MappingNode):
-            value: dict[str, Any] = constructor.construct_mapping(node)
+            value: dict[str, Any] = constructor.construct_mapping(node, deep=cls.yaml_deep)
         else:
             raise yaml.constructor.ConstructorError(
                 None, None,
@@ -98,5 +117,16 @@ class YamlScalar(YamlObject):
         o.__init__(value)
 
 
+def register_lazy(tag: str, module: str, name: str):
+    """Register `tag` for the class `name` in `module`, without importing it yet
+
+    The module is imported when the tag is first loaded; defining the class then
+    registers the tag again, replacing this placeholder."""
+    def constructor(constructor: yaml.constructor.BaseConstructor, node: yaml.nodes.Node):
+        cls: type[YamlObject] = getattr(importlib.import_module(module), name)
+        return cls._constructor(constructor, node)
+    Loader.add_constructor(tag, constructor)
+
+
 def load(stream: str | bytes | IO[str] | IO[bytes]) -> Any:
     return yaml.load(stream, Loader=Loader)
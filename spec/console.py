@@ -0,0 +1,381 @@
+"""Console output of a server, read without ever making the server wait
+
+The server writes into a pipe, which is read as fast as it fills into a ring buffer of
+recent lines, bounded in bytes. The log segments and the terminal each follow the
+buffer in their own thread; one which falls so far behind that its lines are
+overwritten skips them (and says how many), rather than letting the pipe fill up and
+block the server's console thread."""
+
+from __future__ import annotations
+
+from abc import ABC, abstractmethod
+from collections import deque
+from datetime import datetime
+import gzip
+import importlib.util
+from itertools import islice
+import os
+from pathlib import Path
+import re
+import sys
+import threading
+import time
+from typing import IO, Any, BinaryIO
+
+from .base import YamlObject, parse_size
+
+
+COMPRESSIONS = ("gzip", "zstd", "none")
+SUFFIXES = {"gzip": ".log.gz", "zstd": ".log.zst", "none": ".log"}
+
+# a line longer than this is split, so that one runaway line cannot fill the buffer
+MAX_LINE = 1 << 16
+
+
+def _zstd_module() -> Any | None:
+    "The zstd module of the standard library (Python 3.14+) or of the `zstandard` package, whichever is installed"
+    for name in ("compression.zstd", "zstandard"):
+        try:
+            if importlib.util.find_spec(name) is not None:
+                return importlib.import_module(name)
+        except ImportError:
+            continue
+    return None
+
+
+class RingBuffer:
+    "The most recent lines, up to `capacity` bytes, numbered so that readers can follow at their own pace"
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self._lines = deque()
+        self._size = 0
+        self._next = 0
+        self._closed = False
+        self._cond = threading.Condition()
+
+    capacity: int
+    _lines: deque[bytes]
+    _size: int  # bytes in `_lines`
+    _next: int  # number of the next line to be appended
+    _closed: bool
+
+    @property
+    def first(self) -> int:
+        "Number of the oldest line still in the buffer"
+        return self._next - len(self._lines)
+
+    def append(self, line: bytes):
+        with self._cond:
+            self._lines.append(line)
+            self._size += len(line)
+            self._next += 1
+            while self._size > self.capacity and len(self._lines) > 1:
+                self._size -= len(self._lines.popleft())
+            self._cond.notify_all()
+
+    def close(self):
+        "No more lines will be appended; readers end once they have read the rest"
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+
+    def read(self, start: int, timeout: float | None = None) -> tuple[list[bytes], int, int] | None:
+        """Lines from number `start` on, waiting up to `timeout` seconds for any
+
+        Returns the lines, the number of the line after them, and how many lines from
+        `start` on were overwritten before they could be read; or None once closed and read."""
+        with self._cond:
+            if start >= self._next and not self._closed:
+                self._cond.wait(timeout)
+            if start >= self._next and self._closed:
+                return None
+            first = self.first
+            skipped = max(first - start, 0)
+            # taken from the right, so that a reader keeping up copies only the few new lines
+            lines = list(islice(reversed(self._lines), max(self._next - max(start, first), 0)))
+            end = self._next
+        lines.reverse()
+        return lines, end, skipped
+
+    def tail(self, n: int) -> list[bytes]:
+        "The last `n` lines"
+        with self._cond:
+            lines = list(islice(reversed(self._lines), max(n, 0)))
+        lines.reverse()
+        return lines
+
+
+class _Follower(ABC, threading.Thread):
+    "Thread handing every line of a ring buffer to `write`, from the line appended next"
+
+    def __init__(self, ring: RingBuffer, name: str):
+        super().__init__(name=name, daemon=True)
+        self.ring = ring
+        self.position = ring.first
+        self.skipped = 0
+
+    ring: RingBuffer
+    position: int
+    skipped: int  # lines overwritten before they were written
+
+    flush_interval: float = 1.0
+
+    def run(self):
+        unflushed = False
+        flushed = time.monotonic()
+        try:
+            while (batch := self.ring.read(self.position, timeout=self.flush_interval)) is not None:
+                lines, self.position, skipped = batch
+                if skipped:
+                    self.skipped += skipped
+                    self.note(f"[{skipped} lines skipped]\n".encode())
+                if lines:
+                    self.write(lines)
+                unflushed = unflushed or bool(lines or skipped)
+                # flushing costs compression, so not after every batch
+                if unflushed and time.monotonic() - flushed >= self.flush_interval:
+                    self.flush()
+                    unflushed = False
+                    flushed = time.monotonic()
+        finally:
+            self.finish()
+
+    @abstractmethod
+    def write(self, lines: list[bytes]):
+        pass
+
+    def note(self, text: bytes):
+        self.write([text])
+
+    def flush(self):
+        pass
+
+    def finish(self):
+        pass
+
+
+class SegmentWriter(_Follower):
+    "Writes lines to compressed files of about `segment_size` (uncompressed) bytes each, keeping the newest `keep`"
+
+    def __init__(self, ring: RingBuffer, directory: Path, compression: str, segment_size: int, keep: int):
+        super().__init__(ring, name="console log")
+        self.directory = directory
+        self.compression = compression
+        self.segment_size = segment_size
+        self.keep = keep
+        self.file = None
+        self.path = None
+        self.written = 0
+
+    directory: Path
+    compression: str
+    segment_size: int
+    keep: int
+    file: BinaryIO | None
+    path: Path | None  # of the segment being written
+    written: int  # uncompressed bytes in the current segment
+
+    def _open(self, path: Path) -> BinaryIO:
+        if self.compression == "gzip":
+            # console spam compresses well even at a fast level
+            return gzip.open(path, "wb", compresslevel=3)  # type: ignore[return-value]
+        if self.compression == "zstd":
+            zstd = _zstd_module()
+            assert zstd is not None
+            if hasattr(zstd, "ZstdFile"):
+                return zstd.ZstdFile(path, "wb")
+            return zstd.open(path, "wb")
+        return open(path, "wb")
+
+    def rotate(self):
+        "Close the current segment and start a new one, removing the oldest beyond `keep`"
+        if self.file is not None:
+            self.file.close()
+        self.directory.mkdir(parents=True, exist_ok=True)
+        stamp = datetime.now().strftime("%Y%m%d-%H%M%S")
+        suffix = SUFFIXES[self.compression]
+        path = self.directory / f"console-{stamp}{suffix}"
+        n = 1
+        while path.exists():
+            n += 1
+            path = self.directory / f"console-{stamp}-{n}{suffix}"
+        self.path = path
+        self.file = self._open(path)
+        self.written = 0
+
+        segments = sorted(self.directory.glob("console-*.log*"), key=lambda p: (p.stat().st_mtime_ns, p.name))
+        for old in segments[:-self.keep]:
+            if old != path:
+                old.unlink(missing_ok=True)
+
+    def write(self, lines: list[bytes]):
+        i = 0
+        while i < len(lines):
+            if self.file is None or self.written >= self.segment_size:
+                self.rotate()
+            assert self.file is not None
+            # as many lines as fit in the segment, in one write
+            chunk = []
+            size = 0
+            while i < len(lines) and self.written + size < self.segment_size:
+                chunk.append(lines[i])
+                size += len(lines[i])
+                i += 1
+            self.file.write(b"".join(chunk))
+            self.written += size
+
+    def flush(self):
+        # a sync flush, so that the segment being written can be read (with zcat or zstdcat) as it grows
+        if self.file is not None:
+            self.file.flush()
+
+    def finish(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+
+class Echo(_Follower):
+    "Copies lines to the terminal, optionally only those matching `include` and not `exclude`"
+
+    def __init__(self, ring: RingBuffer, out: IO[bytes], prefix: str = "",
+                 include: re.Pattern[str] | None = None, exclude: re.Pattern[str] | None = None):
+        super().__init__(ring, name="console echo")
+        self.out = out
+        self.prefix = prefix.encode()
+        self.include = include
+        self.exclude = exclude
+
+    out: IO[bytes]
+    prefix: bytes
+    include: re.Pattern[str] | None
+    exclude: re.Pattern[str] | None
+
+    def _shown(self, line: bytes) -> bool:
+        if self.include is None and self.exclude is None:
+            return True
+        text = line.decode(errors="replace")
+        if self.include is not None and not self.include.search(text):
+            return False
+        return self.exclude is None or not self.exclude.search(text)
+
+    def write(self, lines: list[bytes]):
+        shown = [self.prefix + line for line in lines if self._shown(line)]
+        if shown:
+            try:
+                self.out.write(b"".join(shown))
+                self.out.flush()
+            except (BrokenPipeError, ValueError):
+                pass  # the terminal went away; keep logging
+
+    def note(self, text: bytes):
+        try:
+            self.out.write(self.prefix + b"(terminal too slow) " + text)
+        except (BrokenPipeError, ValueError):
+            pass
+
+
+class Console:
+    "The output of a server (and of its restarts), logged and echoed by background threads"
+
+    def __init__(self, settings: ConsoleLog, directory: Path, prefix: str = ""):
+        self.ring = RingBuffer(settings.buffer)
+        self.writer = SegmentWriter(self.ring, directory, settings.compression, settings.segment_size, settings.keep)
+        self.echo = None
+        if settings.echo:
+            out = getattr(sys.stdout, "buffer", sys.stdout)
+            self.echo = Echo(self.ring, out, prefix, settings.echo_include, settings.echo_exclude)
+        self.readers = []
+        self.writer.start()
+        if self.echo is not None:
+            self.echo.start()
+
+    ring: RingBuffer
+    writer: SegmentWriter
+    echo: Echo | None
+    readers: list[threading.Thread]
+
+    def attach(self, stream: IO[bytes]) -> threading.Thread:
+        "Read `stream` (a server's stdout) into the buffer until it ends, in a thread of its own"
+        reader = threading.Thread(target=self._pump, args=(stream,), name="console reader", daemon=True)
+        reader.start()
+        self.readers.append(reader)
+        return reader
+
+    def _pump(self, stream: IO[bytes]):
+        fd = stream.fileno()
+        partial = b""
+        while chunk := os.read(fd, 1 << 16):
+            lines = (partial + chunk).split(b"\n")
+            partial = lines.pop()
+            for line in lines:
+                self.ring.append(line + b"\n")
+            while len(partial) > MAX_LINE:
+                self.ring.append(partial[:MAX_LINE] + b"\n")
+                partial = partial[MAX_LINE:]
+        if partial:
+            self.ring.append(partial + b"\n")
+        stream.close()
+
+    def close(self, timeout: float = 10):
+        "Wait for the output to end, and for it to be written to the log"
+        for reader in self.readers:
+            reader.join(timeout)
+        self.ring.close()
+        self.writer.join(timeout)
+        if self.echo is not None:
+            # a stuck terminal is not waited for
+            self.echo.join(min(timeout, 1))
+
+
+class ConsoleLog(YamlObject, yamltag="!console", path_resolvers=[["console"], ["members", None, "console"]]):
+    """How a server's console output is logged
+
+    The output is kept in rotated, compressed segments (gzip, or zstd if the
+    `zstandard` package or Python 3.14 is available) and echoed to the terminal,
+    optionally filtered by regular expressions."""
+
+    directory: Path | None
+    compression: str
+    segment_size: int
+    keep: int
+    buffer: int
+    echo: bool
+    echo_include: re.Pattern[str] | None
+    echo_exclude: re.Pattern[str] | None
+
+    def __init__(
+        self,
+        directory: str | Path | None = None,
+        compression: str = "gzip",
+        segment_size: str | int = "64M",
+        keep: int = 20,
+        buffer: str | int = "16M",
+        echo: bool = True,
+        echo_include: str | None = None,
+        echo_exclude: str | None = None,
+        **kw: Any,
+    ):
+        self.directory = Path(directory) if directory is not None else None
+        self.compression = str(compression).lower()
+        if self.compression not in COMPRESSIONS:
+            raise ValueError(f"Invalid compression: {compression} (choose from {', '.join(COMPRESSIONS)})")
+        if self.compression == "zstd" and _zstd_module() is None:
+            raise ValueError("zstd compression needs the zstandard package (or Python 3.14)")
+        self.segment_size = parse_size(segment_size)
+        self.buffer = parse_size(buffer)
+        if self.segment_size < 1 or self.buffer < 1:
+            raise ValueError("Segment and buffer sizes must be at least 1 byte")
+        if keep < 1:
+            raise ValueError("Must keep at least 1 segment")
+        self.keep = int(keep)
+        self.echo = bool(echo)
+        self.echo_include = re.compile(echo_include) if echo_include else None
+        self.echo_exclude = re.compile(echo_exclude) if echo_exclude else None
+        if kw:
+            print("Console given extra keys:", kw)
+
+    def open(self, server_folder: Path, prefix: str = "") -> Console:
+        "Start logging, by default into `logs/console` in the server folder"
+        return Console(self, self.directory or server_folder / "logs" / "console", prefix)
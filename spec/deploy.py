@@ -0,0 +1,106 @@
+from __future__ import annotations
+
+from enum import Enum
+import errno
+import os
+from pathlib import Path
+import shutil
+import sys
+import threading
+from typing import Iterable
+
+try:
+    import fcntl
+except ImportError:  # not on Windows
+    fcntl = None
+
+
+FICLONE = 0x40049409  # _IOW(0x94, 9, int) from linux/fs.h
+
+
+class DeployMode(Enum):
+    Copy = "copy"
+    Hardlink = "hardlink"
+    Reflink = "reflink"
+    Symlink = "symlink"
+
+
+def _tmp_name(path: Path) -> Path:
+    return path.with_name(f".{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+
+
+def is_current(src: Path, dest: Path, mode: DeployMode) -> bool:
+    "Check whether `dest` already holds `src` in the way `mode` would put it there"
+    try:
+        if mode == DeployMode.Symlink:
+            return dest.is_symlink() and os.readlink(dest) == os.path.abspath(src)
+        if dest.is_symlink():
+            return False
+        if mode == DeployMode.Hardlink:
+            return dest.samefile(src)
+        # copies (and reflinks) are compared like `rsync`: size and modification time
+        if dest.samefile(src):
+            return False
+        s, d = src.stat(), dest.stat()
+        return s.st_size == d.st_size and s.st_mtime_ns == d.st_mtime_ns
+    except OSError:
+        return False
+
+
+def _reflink(src: Path, dest: Path):
+    if fcntl is None:
+        raise OSError(errno.EOPNOTSUPP, "reflinks are not supported on this platform")
+    with open(src, "rb") as s, open(dest, "wb") as d:
+        fcntl.ioctl(d.fileno(), FICLONE, s.fileno())
+    shutil.copystat(src, dest)
+
+
+def _create(src: Path, dest: Path, mode: DeployMode):
+    if mode == DeployMode.Symlink:
+        os.symlink(os.path.abspath(src), dest)
+        return
+    if mode == DeployMode.Hardlink:
+        try:
+            os.link(src, dest)
+            return
+        except OSError as e:
+            print(f"Cannot hardlink {src} to {dest} ({e}); copying instead", file=sys.stderr)
+    elif mode == DeployMode.Reflink:
+        try:
+            _reflink(src, dest)
+            return
+        except OSError:
+            dest.unlink(missing_ok=True)  # filesystem without reflinks; fall back to a copy
+    shutil.copy2(src, dest)
+
+
+def place(src: Path, dest: Path, mode: DeployMode = DeployMode.Copy) -> bool:
+    """Put `src` at `dest` using `mode`, unless it is already there
+
+    The new file is created beside `dest` and renamed over it, so `dest` is never
+    half-written. Returns whether anything changed."""
+    if is_current(src, dest, mode):
+        return False
+    tmp = _tmp_name(dest)
+    tmp.unlink(missing_ok=True)
+    try:
+        _create(src, tmp, mode)
+        os.replace(tmp, dest)
+    except BaseException:
+        tmp.unlink(missing_ok=True)
+        raise
+    return True
+
+
+def stale_files(folder: Path, keep: Iterable[str], pattern: str = "*.jar") -> list[Path]:
+    "Files matching `pattern` in `folder` that are not named in `keep`"
+    keep = set(keep)
+    return sorted(f for f in folder.glob(pattern) if f.name not in keep)
+
+
+def prune(folder: Path, keep: Iterable[str], pattern: str = "*.jar") -> list[Path]:
+    "Delete files matching `pattern` in `folder` that are not named in `keep`"
+    removed = stale_files(folder, keep, pattern)
+    for f in removed:
+        f.unlink()
+    return removed
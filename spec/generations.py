@@ -0,0 +1,182 @@
+from __future__ import annotations
+
+from datetime import datetime, timezone
+import json
+import os
+from pathlib import Path
+import shutil
+from typing import TYPE_CHECKING, Any, Iterable, Mapping
+
+from .deploy import DeployMode, place, prune
+
+if TYPE_CHECKING:
+    from .spec import FolderSpecification
+
+
+CURRENT = "current"
+MANIFEST = "manifest.json"
+FOLDERS = ("server", "plugins")
+
+
+class Generation:
+    "An immutable set of deployed jars, with a manifest describing them"
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self.id = int(self.path.name)
+        self._manifest: dict[str, Any] | None = None
+
+    path: Path
+    id: int
+
+    def __repr__(self) -> str:
+        return f"Generation({self.id})"
+
+    @property
+    def manifest(self) -> dict[str, Any]:
+        if self._manifest is None:
+            with open(self.path / MANIFEST) as f:
+                self._manifest = json.load(f)
+        return self._manifest
+
+    @property
+    def jars(self) -> list[dict[str, Any]]:
+        return self.manifest["jars"]
+
+    @property
+    def server(self) -> str:
+        "Filename of the server jar"
+        return self.manifest["server"]
+
+    def file(self, jar: Mapping[str, Any]) -> Path:
+        return self.path / jar["folder"] / jar["name"]
+
+
+class GenerationStore:
+    """Directory of numbered generations and a `current` symlink to the live one
+
+    Replacing the symlink is atomic, but in most deploy modes it only moves the pointer:
+    the server folders are synced from a generation file by file (see `activate`), so it
+    is only switched once they have been. In symlink mode the jars link through
+    `current`, and switching it switches them all at once."""
+
+    directory: Path
+
+    def __init__(self, directory: str | Path):
+        self.directory = Path(directory)
+
+    def list(self) -> list[Generation]:
+        if not self.directory.is_dir():
+            return []
+        return sorted(
+            (Generation(p) for p in self.directory.iterdir()
+             if p.name.isdigit() and (p / MANIFEST).exists()),
+            key=lambda g: g.id,
+        )
+
+    def get(self, id: int) -> Generation:
+        path = self.directory / str(id)
+        if not (path / MANIFEST).exists():
+            raise ValueError(f"No such generation: {id}")
+        return Generation(path)
+
+    def current(self) -> Generation | None:
+        link = self.directory / CURRENT
+        try:
+            return Generation(self.directory / os.readlink(link))
+        except (OSError, ValueError):
+            return None
+
+    def previous(self, before: Generation | None = None) -> Generation | None:
+        "The newest generation older than `before` (by default, the current generation)"
+        if before is None:
+            before = self.current()
+        older = [g for g in self.list() if before is None or g.id < before.id]
+        return older[-1] if older else None
+
+    def stage(self) -> Path:
+        "Create an empty directory to build the next generation in"
+        self.directory.mkdir(parents=True, exist_ok=True)
+        ids = [g.id for g in self.list()]
+        path = self.directory / f"{max(ids, default=0) + 1}.tmp"
+        if path.exists():
+            shutil.rmtree(path)
+        for folder in FOLDERS:
+            (path / folder).mkdir(parents=True)
+        return path
+
+    def commit(self, staging: Path, server: str, jars: Iterable[Mapping[str, Any]], **extra: Any) -> Generation:
+        "Write the manifest of a staged generation and make it visible (but not live)"
+        manifest = {
+            "id": int(staging.name.split(".")[0]),
+            "created": datetime.now(timezone.utc).isoformat(),
+            "server": server,
+            "jars": [dict(j) for j in jars],
+            **extra,
+        }
+        with open(staging / MANIFEST, "w") as f:
+            json.dump(manifest, f, indent=2)
+        final = staging.with_name(str(manifest["id"]))
+        os.rename(staging, final)
+        return Generation(final)
+
+    def discard(self, staging: Path):
+        shutil.rmtree(staging, ignore_errors=True)
+
+    def switch(self, generation: Generation):
+        "Atomically make `generation` the current one"
+        link = self.directory / CURRENT
+        tmp = link.with_name(f".{CURRENT}.{os.getpid()}.tmp")
+        tmp.unlink(missing_ok=True)
+        os.symlink(generation.path.name, tmp)
+        os.replace(tmp, link)
+
+    def cleanup(self, keep: int) -> list[Generation]:
+        "Delete all but the newest `keep` generations, never deleting the current one"
+        current = self.current()
+        gens = self.list()
+        removed = [g for g in gens[:max(len(gens) - keep, 0)] if current is None or g.id != current.id]
+        for g in removed:
+            shutil.rmtree(g.path)
+        return removed
+
+
+def same_jars(generation: Generation | None, jars: Iterable[Mapping[str, Any]]) -> bool:
+    "Check whether `generation` contains exactly these jars"
+    if generation is None:
+        return False
+
+    def key(j: Mapping[str, Any]):
+        return (j["folder"], j["name"], j.get("sha256"))
+    return sorted(map(key, generation.jars)) == sorted(map(key, jars))
+
+
+def activate(
+    generation: Generation,
+    folders: FolderSpecification,
+    mode: DeployMode = DeployMode.Copy,
+) -> tuple[list[Path], list[Path]]:
+    """Make the server folders contain exactly the jars of `generation`
+
+    Only files which differ are replaced, each by an atomic rename, so the folders
+    are not switched as a whole. In symlink mode the links point through the
+    `current` link of the generations (whichever generation it names), so jars whose
+    names are unchanged are left alone and switch with `current`; new names dangle
+    until it is switched. Returns the lists of updated and removed files."""
+    targets = {"server": folders.server, "plugins": folders.plugins}
+    current = generation.path.parent / CURRENT
+    changed: list[Path] = []
+    keep: dict[Path, set[str]] = {t: set() for t in targets.values()}
+    for jar in generation.jars:
+        dest = targets[jar["folder"]] / jar["name"]
+        dest.parent.mkdir(parents=True, exist_ok=True)
+        src = current / jar["folder"] / jar["name"] if mode == DeployMode.Symlink else generation.file(jar)
+        if place(src, dest, mode):
+            changed.append(dest)
+        keep[dest.parent].add(dest.name)
+
+    removed: list[Path] = []
+    for folder, names in keep.items():
+        if folder.is_dir():
+            removed.extend(prune(folder, names))
+    return changed, removed
@@ -0,0 +1,803 @@
+from __future__ import annotations
+
+import contextlib
+import hashlib
+from hashlib import sha256
+import json
+import os
+from pathlib import Path
+import sys
+import threading
+import time
+from typing import TYPE_CHECKING, Any, Awaitable, Iterator, Mapping, TypeVar
+from urllib.parse import urlsplit
+import weakref
+from . import trace
+from .base import YamlObject, parse_size
+
+try:
+    import fcntl
+except ImportError:  # not on Windows
+    fcntl = None
+
+# requests, aiohttp and asyncio are slow to import, and not needed just to run a server,
+# so they are only imported when the first request is made
+if TYPE_CHECKING:
+    import asyncio
+    import aiohttp
+    import requests
+    from .store import BaseStore
+
+
+T = TypeVar("T")
+
+
+DEFAULT_HEADERS = {"User-Agent": "mc-server-wrapper"}
+
+
+class CachedResponse:
+    def __init__(self, meta: dict[str, Any], body: bytes):
+        self.meta = meta
+        self.body = body
+
+    meta: dict[str, Any]
+    body: bytes
+
+    @property
+    def age(self) -> float:
+        "Seconds since this response was last fetched or revalidated"
+        return time.time() - float(self.meta.get("fetched", 0))
+
+    def conditional_headers(self) -> dict[str, str]:
+        headers: dict[str, str] = {}
+        if self.meta.get("etag"):
+            headers["If-None-Match"] = self.meta["etag"]
+        if self.meta.get("last_modified"):
+            headers["If-Modified-Since"] = self.meta["last_modified"]
+        return headers
+
+    def json(self) -> Any:
+        return json.loads(self.body)
+
+
+class ResponseCache:
+    "On-disk cache of API responses, revalidated with ETag/Last-Modified"
+
+    directory: Path
+
+    def __init__(self, directory: str | Path):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+
+    def _get_path(self, url: str, params: Mapping[str, Any] | None) -> Path:
+        k = json.dumps([url, sorted((params or {}).items())], separators=(",", ":"))
+        h = sha256(k.encode()).hexdigest()
+        return self.directory / h[:2] / h[2:]
+
+    def load(self, url: str, params: Mapping[str, Any] | None = None) -> CachedResponse | None:
+        path = self._get_path(url, params)
+        try:
+            with open(path.with_suffix(".json"), "rb") as f:
+                meta = json.load(f)
+            with open(path.with_suffix(".body"), "rb") as f:
+                body = f.read()
+        except (OSError, ValueError):
+            return None
+        return CachedResponse(meta, body)
+
+    def save(self, url: str, params: Mapping[str, Any] | None, meta: dict[str, Any], body: bytes | None = None):
+        "Save a response; if `body` is None, only the metadata is updated (after a revalidation)"
+        path = self._get_path(url, params)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        if body is not None:
+            _write_atomic(path.with_suffix(".body"), body)
+        _write_atomic(path.with_suffix(".json"), json.dumps(meta).encode())
+
+
+def _write_atomic(path: Path, data: bytes):
+    tmp = path.with_name(f"{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+    with open(tmp, "wb") as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+
+class HttpSessions(YamlObject, yamltag="!http", path_resolver=["http"]):
+    "Keep-alive connection pools, one per host, shared between all jars"
+
+    pool_size: int
+    timeout: tuple[float, float]
+    headers: dict[str, str]
+    segments: int  # connections per download
+    segment_size: int  # smallest byte range worth its own connection
+
+    def __init__(
+        self,
+        pool_size: int = 10,
+        connect_timeout: float = 10,
+        read_timeout: float = 60,
+        headers: Mapping[str, str] = {},
+        segments: int = 4,
+        segment_size: str | int = "4M",
+    ):
+        if pool_size < 1:
+            raise ValueError("Pool size must be at least 1")
+        if segments < 1:
+            raise ValueError("Segments must be at least 1")
+        self.pool_size = int(pool_size)
+        self.segments = min(int(segments), self.pool_size)
+        self.segment_size = parse_size(segment_size)
+        if self.segment_size < 1:
+            raise ValueError("Segment size must be at least 1 byte")
+        self.timeout = (float(connect_timeout), float(read_timeout))
+        self.headers = {**DEFAULT_HEADERS, **headers}
+
+        self._sessions: dict[str, requests.Session] = {}
+        self._async_sessions: weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, aiohttp.ClientSession] = weakref.WeakKeyDictionary()
+        self._lock = threading.Lock()
+
+    def __getstate__(self) -> dict[str, Any]:
+        # connections cannot be pickled (for the compiled specification cache); new ones are made when needed
+        return {k: v for k, v in self.__dict__.items() if k not in ("_sessions", "_async_sessions", "_lock")}
+
+    def __setstate__(self, state: dict[str, Any]):
+        self.__dict__.update(state)
+        self._sessions = {}
+        self._async_sessions = weakref.WeakKeyDictionary()
+        self._lock = threading.Lock()
+
+    def session(self, url: str) -> requests.Session:
+        "Get the session for the host of `url`, creating it if needed"
+        import requests
+        import requests.adapters
+        parts = urlsplit(url)
+        host = f"{parts.scheme}://{parts.netloc}"
+        with self._lock:
+            s = self._sessions.get(host)
+            if s is None:
+                s = requests.Session()
+                s.headers.update(self.headers)
+                adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size)
+                s.mount(host, adapter)
+                self._sessions[host] = s
+            return s
+
+    def get(self, url: str, **kwargs: Any) -> requests.Response:
+        kwargs.setdefault("timeout", self.timeout)
+        trace.count("http requests")
+        return self.session(url).get(url, **kwargs)
+
+    def async_session(self) -> aiohttp.ClientSession:
+        "Get the aiohttp session of the running event loop, creating it if needed"
+        import asyncio
+        import aiohttp
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            s = self._async_sessions.get(loop)
+            if s is None or s.closed:
+                s = aiohttp.ClientSession(
+                    headers=self.headers,
+                    timeout=aiohttp.ClientTimeout(sock_connect=self.timeout[0], sock_read=self.timeout[1]),
+                    connector=aiohttp.TCPConnector(limit_per_host=self.pool_size),
+                    raise_for_status=False,
+                )
+                self._async_sessions[loop] = s
+            return s
+
+    def client(self, cache: ResponseCache | None = None, ttl: float | None = None) -> HttpClient:
+        return HttpClient(self, cache=cache, ttl=ttl)
+
+    def close(self):
+        with self._lock:
+            for s in self._sessions.values():
+                s.close()
+            self._sessions.clear()
+
+    async def aclose(self):
+        "Close the aiohttp session of the running event loop, if any"
+        import asyncio
+        with self._lock:
+            s = self._async_sessions.pop(asyncio.get_running_loop(), None)
+        if s is not None:
+            await s.close()
+
+
+class HttpClient:
+    "View of `HttpSessions` with the response cache and TTL of one source"
+
+    def __init__(self, sessions: HttpSessions, cache: ResponseCache | None = None, ttl: float | None = None):
+        self.sessions = sessions
+        self.cache = cache
+        self.ttl = ttl
+
+    sessions: HttpSessions
+    cache: ResponseCache | None
+    ttl: float | None
+
+    def get(self, url: str, **kwargs: Any) -> requests.Response:
+        return self.sessions.get(url, **kwargs)
+
+    def get_json(self, url: str, params: Mapping[str, Any] | None = None) -> Any:
+        """GET a JSON document, using the cache if there is one
+
+        A cached response younger than `ttl` seconds is returned without any request;
+        an older one is revalidated with a conditional request and reused on 304."""
+        params = _clean_params(params)
+        cache = self.cache
+        with trace.span("GET", "http", url=url) as info:
+            if cache is None:
+                info["cache"] = "uncached"
+                r = self.get(url, params=params)
+                r.raise_for_status()
+                trace.count("http bytes", len(r.content))
+                return r.json()
+
+            cached = self._load_fresh(url, params)
+            if isinstance(cached, _Fresh):
+                info["cache"] = "fresh"
+                return cached.value
+
+            headers = cached.conditional_headers() if cached is not None else {}
+            r = self.get(url, params=params, headers=headers)
+            if r.status_code == 304 and cached is not None:
+                info["cache"] = "revalidated"
+                cached.meta["fetched"] = time.time()
+                cache.save(url, params, cached.meta)
+                return cached.json()
+            r.raise_for_status()
+
+            info["cache"] = "missed"
+            trace.count("http bytes", len(r.content))
+            cache.save(url, params, _response_meta(url, r.headers), r.content)
+            return r.json()
+
+    async def get_json_async(self, url: str, params: Mapping[str, Any] | None = None) -> Any:
+        "`get_json` for asyncio; it uses aiohttp if that is installed, and otherwise a thread"
+        if not _have_aiohttp():
+            import asyncio
+            return await asyncio.to_thread(self.get_json, url, params)
+
+        params = _clean_params(params)
+        cache = self.cache
+        with trace.span("GET", "http", url=url) as info:
+            cached = self._load_fresh(url, params) if cache is not None else None
+            if isinstance(cached, _Fresh):
+                info["cache"] = "fresh"
+                return cached.value
+
+            headers = cached.conditional_headers() if cached is not None else {}
+            trace.count("http requests")
+            async with self.sessions.async_session().get(url, params=params, headers=headers) as r:
+                if r.status == 304 and cached is not None:
+                    info["cache"] = "revalidated"
+                    cached.meta["fetched"] = time.time()
+                    cache.save(url, params, cached.meta)
+                    return cached.json()
+                r.raise_for_status()
+                body = await r.read()
+                info["cache"] = "missed" if cache is not None else "uncached"
+                trace.count("http bytes", len(body))
+                if cache is not None:
+                    cache.save(url, params, _response_meta(url, r.headers), body)
+            return json.loads(body)
+
+    def _load_fresh(self, url: str, params: Mapping[str, Any] | None) -> CachedResponse | _Fresh | None:
+        "Load the cached response, wrapped in `_Fresh` if it is young enough to use without revalidating"
+        assert self.cache is not None
+        cached = self.cache.load(url, params)
+        if cached is not None and self.ttl is not None and cached.age < self.ttl:
+            return _Fresh(cached.json())
+        return cached
+
+
+def _have_aiohttp() -> bool:
+    try:
+        import aiohttp  # noqa: F401
+    except ImportError:  # optional; without it, blocking requests are made from threads
+        return False
+    return True
+
+
+class _Fresh:
+    def __init__(self, value: Any):
+        self.value = value
+
+
+def _clean_params(params: Mapping[str, Any] | None) -> dict[str, Any] | None:
+    if params is None:
+        return None
+    return {k: v for k, v in params.items() if v is not None}
+
+
+def _response_meta(url: str, headers: Mapping[str, str]) -> dict[str, Any]:
+    return {
+        "url": url,
+        "etag": headers.get("ETag"),
+        "last_modified": headers.get("Last-Modified"),
+        "fetched": time.time(),
+    }
+
+
+class ChecksumError(ValueError):
+    pass
+
+
+class IncompleteDownload(IOError):
+    pass
+
+
+def resumable_errors() -> tuple[type[BaseException], ...]:
+    "Errors after which a download is resumed rather than abandoned"
+    import requests
+    return (
+        requests.ConnectionError,
+        requests.Timeout,
+        requests.exceptions.ChunkedEncodingError,
+        IncompleteDownload,
+    )
+
+
+_dest_locks: dict[str, threading.Lock] = {}
+_dest_locks_lock = threading.Lock()
+_held = threading.local()
+
+
+@contextlib.contextmanager
+def download_lock(dest: Path) -> Iterator[None]:
+    """Keep other downloads to `dest`, in this process or another, waiting until the block ends
+
+    Threads wait on a lock per destination, and processes on a lock of `<dest>.part.lock`
+    (which is left in place, as removing it would let a third download lock a new file).
+    A thread already holding the lock takes it again without waiting."""
+    path = os.path.abspath(dest)
+    held: set[str] = _held.__dict__.setdefault("paths", set())
+    if path in held:
+        yield
+        return
+    with _dest_locks_lock:
+        lock = _dest_locks.setdefault(path, threading.Lock())
+    with lock:
+        fd = os.open(path + ".part.lock", os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            if fcntl is not None:
+                fcntl.flock(fd, fcntl.LOCK_EX)
+            held.add(path)
+            try:
+                yield
+            finally:
+                held.discard(path)
+        finally:
+            os.close(fd)  # which releases the file lock
+
+
+class PartialDownload:
+    """A download in progress: the data so far in `<dest>.part`, and a journal in `<dest>.part.json`
+
+    The journal records the URL and validators of the response the data came from,
+    and how much of each byte range has been written, so that a later attempt can
+    ask for just the rest of that same response."""
+
+    def __init__(self, dest: Path):
+        self.dest = dest
+        self.path = dest.with_name(dest.name + ".part")
+        self.journal = dest.with_name(dest.name + ".part.json")
+
+    dest: Path
+    path: Path
+    journal: Path
+
+    def load(self, url: str) -> dict[str, Any] | None:
+        "Get the journal, if it is for `url` and its data can be resumed"
+        try:
+            with open(self.journal) as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if meta.get("url") != url or not meta.get("segments") or not _if_range(meta) or not self.path.exists():
+            return None
+        return meta
+
+    def start(self, meta: Mapping[str, Any]) -> int:
+        "Begin a new download, returning a file descriptor to write it through"
+        self.discard()
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT | getattr(os, "O_BINARY", 0), 0o644)
+        size = meta.get("size")
+        if size:
+            _preallocate(fd, size)
+        self.save(meta)
+        return fd
+
+    def open(self) -> int:
+        "Reopen the data of a download being resumed"
+        return os.open(self.path, os.O_RDWR | getattr(os, "O_BINARY", 0))
+
+    def save(self, meta: Mapping[str, Any]):
+        _write_atomic(self.journal, json.dumps(meta).encode())
+
+    def commit(self):
+        "Move the completed data into place"
+        os.replace(self.path, self.dest)
+        self.journal.unlink(missing_ok=True)
+
+    def discard(self):
+        self.path.unlink(missing_ok=True)
+        self.journal.unlink(missing_ok=True)
+
+
+def _preallocate(fd: int, size: int):
+    try:
+        os.posix_fallocate(fd, 0, size)
+    except (AttributeError, OSError):  # not on Windows or macOS, nor every filesystem
+        os.ftruncate(fd, size)
+
+
+if hasattr(os, "pwrite"):
+    _pwrite = os.pwrite
+    _pread = os.pread
+else:  # Windows
+    _seek_lock = threading.Lock()
+
+    def _pwrite(fd: int, data: bytes | memoryview, offset: int) -> int:
+        with _seek_lock:
+            os.lseek(fd, offset, os.SEEK_SET)
+            return os.write(fd, data)
+
+    def _pread(fd: int, n: int, offset: int) -> bytes:
+        with _seek_lock:
+            os.lseek(fd, offset, os.SEEK_SET)
+            return os.read(fd, n)
+
+
+def _write_at(fd: int, data: bytes, offset: int):
+    view = memoryview(data)
+    while view:
+        n = _pwrite(fd, view, offset)
+        view = view[n:]
+        offset += n
+
+
+def _if_range(meta: Mapping[str, Any]) -> str | None:
+    "Validator for an If-Range header; weak ETags cannot be used"
+    etag = meta.get("etag")
+    if etag and not etag.startswith("W/"):
+        return etag
+    return meta.get("last_modified")
+
+
+def _range_start(response: requests.Response) -> int | None:
+    "First byte of a 206 response, from its Content-Range header"
+    value = response.headers.get("Content-Range", "")
+    try:
+        unit, rest = value.split(" ", 1)
+        return int(rest.split("-", 1)[0]) if unit == "bytes" else None
+    except ValueError:
+        return None
+
+
+def _total_size(response: requests.Response) -> int | None:
+    if response.status_code == 206:
+        total = response.headers.get("Content-Range", "").rpartition("/")[2]
+        return int(total) if total.isdigit() else None
+    length = response.headers.get("Content-Length")
+    return int(length) if length and length.isdigit() else None
+
+
+def _plan_segments(first: int, size: int, segments: int, min_size: int) -> list[list[Any]]:
+    """Split `size` bytes into byte ranges, as [start, end, bytes written]
+
+    The first range is the `first` bytes already requested; the rest is shared
+    between up to `segments - 1` more ranges of at least `min_size` bytes."""
+    plan: list[list[Any]] = [[0, min(first, size), 0]]
+    rest = size - first
+    if rest <= 0:
+        return plan
+    n = max(1, min(segments - 1, rest // min_size))
+    bounds = [first + rest * i // n for i in range(n + 1)]
+    plan.extend([a, b, 0] for a, b in zip(bounds, bounds[1:]))
+    return plan
+
+
+class _RestartDownload(Exception):
+    "The partial data cannot be resumed, because the file on the server has changed"
+
+
+class _Transfer:
+    "Byte ranges of one download being written in parallel into the same file"
+
+    def __init__(self, http: HttpClient | HttpSessions, url: str, partial: PartialDownload, meta: dict[str, Any], fd: int, chunk_size: int):
+        self.http = http
+        self.url = url
+        self.partial = partial
+        self.meta = meta
+        self.fd = fd
+        self.chunk_size = chunk_size
+        self.stopped = threading.Event()
+        self._lock = threading.Lock()
+        self._saved = time.monotonic()
+
+    @property
+    def segments(self) -> list[list[Any]]:
+        return self.meta["segments"]
+
+    def checkpoint(self, force: bool = False):
+        "Save the progress to the journal, at most once a second unless forced"
+        with self._lock:
+            if force or time.monotonic() - self._saved >= 1:
+                self.partial.save(self.meta)
+                self._saved = time.monotonic()
+
+    def fetch(self, index: int, response: requests.Response | None = None):
+        "Download the rest of one byte range, using `response` if it has already been requested"
+        seg = self.segments[index]
+        start, end = seg[0], seg[1]
+        if end is not None and start + seg[2] >= end:
+            return
+        requested = response is None
+        if requested:
+            headers = {"Range": f"bytes={start + seg[2]}-{'' if end is None else end - 1}"}
+            validator = _if_range(self.meta)
+            if validator:
+                headers["If-Range"] = validator
+            response = self.http.get(self.url, stream=True, headers=headers)
+
+        with response as r:
+            if r.status_code == 416:
+                raise _RestartDownload()
+            r.raise_for_status()
+            if requested and (r.status_code != 206 or _range_start(r) != start + seg[2]):
+                raise _RestartDownload()
+            received = seg[2]
+            try:
+                for chunk in r.iter_content(chunk_size=self.chunk_size):
+                    if self.stopped.is_set():
+                        return
+                    if end is not None:
+                        chunk = chunk[:end - start - seg[2]]
+                    _write_at(self.fd, chunk, start + seg[2])
+                    seg[2] += len(chunk)
+                    if end is not None and start + seg[2] >= end:
+                        break
+                    self.checkpoint()
+            finally:
+                trace.count("http bytes", seg[2] - received)
+
+        if end is not None and start + seg[2] < end:
+            raise IncompleteDownload(f"Download of {self.url} stopped at byte {start + seg[2]} of {start}-{end}")
+
+    def hash_segment(self, index: int, hashes: Mapping[str, Any]):
+        "Feed one completed byte range into `hashes`, reading it back from the file (normally from the page cache)"
+        start, end, done = self.segments[index]
+        remaining = done if end is None else end - start
+        pos = start
+        while remaining > 0:
+            chunk = _pread(self.fd, min(self.chunk_size, remaining), pos)
+            if not chunk:
+                raise IncompleteDownload(f"{self.partial.path} is shorter than expected")
+            for h in hashes.values():
+                h.update(chunk)
+            pos += len(chunk)
+            remaining -= len(chunk)
+
+    def run(self, first: requests.Response | None, jobs: int, hashes: Mapping[str, Any]):
+        """Fetch every byte range on up to `jobs` connections, hashing them in order as they complete
+
+        `first` is an already open response for the first range, if any."""
+        if len(self.segments) == 1:
+            self.fetch(0, first)
+            self.hash_segment(0, hashes)
+            return
+
+        from concurrent.futures import ThreadPoolExecutor
+        with ThreadPoolExecutor(max_workers=min(jobs, len(self.segments))) as executor:
+            futures = [executor.submit(self.fetch, i, first if i == 0 else None) for i in range(len(self.segments))]
+            try:
+                for i, fut in enumerate(futures):
+                    fut.result()
+                    self.hash_segment(i, hashes)
+            except BaseException:
+                self.stopped.set()
+                for fut in futures:
+                    fut.cancel()
+                raise
+
+
+def _start_transfer(
+    http: HttpClient | HttpSessions,
+    url: str,
+    partial: PartialDownload,
+    chunk_size: int,
+    segments: int,
+    segment_size: int,
+) -> tuple[_Transfer, requests.Response]:
+    """Request the start of `url` and plan the rest of the download
+
+    If there may be more than one segment, only the first `segment_size` bytes are requested,
+    which also tells us whether the server supports ranges at all."""
+    headers = {"Range": f"bytes=0-{segment_size - 1}"} if segments > 1 else {}
+    r = http.get(url, stream=True, headers=headers)
+    if r.status_code == 416:  # an empty file
+        r.close()
+        r = http.get(url, stream=True)
+    elif r.status_code == 206 and (_range_start(r) != 0 or _total_size(r) is None):
+        # a range of unknown size cannot be planned around, nor streamed as the whole file
+        r.close()
+        r = http.get(url, stream=True)
+    try:
+        r.raise_for_status()
+        size = _total_size(r)
+        if r.status_code == 206 and _range_start(r) == 0 and size is not None:
+            plan = _plan_segments(segment_size, size, segments, segment_size)
+        else:
+            # no range support, so one stream of the whole file
+            plan = [[0, size, 0]]
+        meta = {
+            "url": url,
+            "etag": r.headers.get("ETag"),
+            "last_modified": r.headers.get("Last-Modified"),
+            "size": size,
+            "segments": plan,
+        }
+        fd = partial.start(meta)
+    except BaseException:
+        r.close()
+        raise
+    return _Transfer(http, url, partial, meta, fd, chunk_size), r
+
+
+def _download_once(
+    http: HttpClient | HttpSessions,
+    url: str,
+    partial: PartialDownload,
+    chunk_size: int,
+    expected: Mapping[str, str],
+    segments: int,
+    segment_size: int,
+) -> dict[str, str]:
+    hashes = {name: hashlib.new(name) for name in {"sha256", *expected}}
+    meta = partial.load(url)
+    resumed = meta is not None and any(done for _, _, done in meta["segments"])
+    if meta is not None:
+        transfer, first = _Transfer(http, url, partial, meta, partial.open(), chunk_size), None
+    else:
+        transfer, first = _start_transfer(http, url, partial, chunk_size, segments, segment_size)
+
+    try:
+        transfer.run(first, segments, hashes)
+    except _RestartDownload:
+        os.close(transfer.fd)
+        partial.discard()
+        # if the ranges of a fresh download did not line up, the server is not to be trusted with them
+        return _download_once(http, url, partial, chunk_size, expected, segments if meta is not None else 1, segment_size)
+    except BaseException:
+        transfer.checkpoint(force=True)
+        os.close(transfer.fd)
+        raise
+    os.close(transfer.fd)
+
+    digests = {name: h.hexdigest() for name, h in hashes.items()}
+    for name, value in expected.items():
+        if digests[name] != value.lower():
+            partial.discard()
+            if resumed:
+                # the data we resumed from may be at fault; try once more from the start
+                print(f"{name} mismatch for resumed download of {url}; downloading again", file=sys.stderr)
+                return _download_once(http, url, partial, chunk_size, expected, segments, segment_size)
+            raise ChecksumError(f"{name} mismatch for {url}: expected {value}, got {digests[name]}")
+
+    partial.commit()
+    return digests
+
+
+def download_file(
+    http: HttpClient | HttpSessions,
+    url: str,
+    dest: Path,
+    chunk_size: int = 65536,
+    expected: Mapping[str, str] = {},
+    attempts: int = 3,
+    segments: int | None = None,
+    segment_size: int | None = None,
+) -> dict[str, str]:
+    """Download `url` to `dest`, hashing it on the way
+
+    Large files are split into byte ranges of at least `segment_size` bytes, which are
+    fetched on up to `segments` connections at once and written into place in a
+    preallocated file; servers without range support get a single stream. Both default
+    to the settings of the `HttpSessions`.
+
+    The data is written to `<dest>.part` and only renamed to `dest` once complete
+    and verified, so `dest` is never truncated. An interrupted transfer is resumed
+    with Range requests, both straight away (up to `attempts` times in all) and
+    by later calls for the same `dest`.
+
+    Returns the hex digests of the data (always including sha256, and every
+    algorithm in `expected`). If any digest in `expected` does not match,
+    the data is removed and `ChecksumError` is raised."""
+    sessions = http.sessions if isinstance(http, HttpClient) else http
+    if segments is None:
+        segments = sessions.segments
+    if segment_size is None:
+        segment_size = sessions.segment_size
+
+    partial = PartialDownload(dest)
+    with download_lock(dest), trace.span("download", "http", url=url) as info:
+        for attempt in range(1, attempts + 1):
+            info["attempts"] = attempt
+            try:
+                digests = _download_once(http, url, partial, chunk_size, expected, segments, segment_size)
+            except resumable_errors() as e:
+                if attempt >= attempts:
+                    raise
+                print(f"Download of {url} interrupted ({e}); resuming", file=sys.stderr)
+                continue
+            info["size"] = dest.stat().st_size
+            return digests
+    raise AssertionError("unreachable")
+
+
+def download_to_store(
+    http: HttpClient | HttpSessions,
+    store: BaseStore,
+    key: Any,
+    url: str,
+    expected: Mapping[str, str] = {},
+    **info: Any,
+) -> tuple[Path, dict[str, str]]:
+    """Download `url` into the store under `key` and record it (with `url` and `info`, see `BaseStore.record`)
+
+    Downloads of the same key wait for each other, and one which finds the file in the
+    store once it is its turn uses that instead. Returns the stored file and its digests."""
+    dest = store.get_name(key)
+    with download_lock(dest):
+        found = store.lookup(key, expected, url=url, **info)
+        if found is not None:
+            return found, {**expected, **store.get_digests(key)}
+        digests = download_file(http, url, dest, expected=expected)
+        store.record(key, digests, url=url, **info)
+        return dest, digests
+
+
+async def download_file_async(http: HttpClient | HttpSessions, url: str, dest: Path, **kwargs: Any) -> dict[str, str]:
+    "`download_file` for asyncio; downloads are bandwidth-bound, so they run in a thread"
+    import asyncio
+    return await asyncio.to_thread(download_file, http, url, dest, **kwargs)
+
+
+async def download_to_store_async(
+    http: HttpClient | HttpSessions,
+    store: BaseStore,
+    key: Any,
+    url: str,
+    expected: Mapping[str, str] = {},
+    **info: Any,
+) -> tuple[Path, dict[str, str]]:
+    "`download_to_store` for asyncio"
+    import asyncio
+    return await asyncio.to_thread(download_to_store, http, store, key, url, expected, **info)
+
+
+def run_sync(coro: Awaitable[T], http: HttpSessions | None = None) -> T:
+    """Run `coro` in a new event loop, for callers without one
+
+    Any aiohttp session it opened on `http` (by default, the default sessions) is closed afterwards."""
+    sessions = http or get_default_sessions()
+
+    async def main() -> T:
+        try:
+            return await coro
+        finally:
+            await sessions.aclose()
+    import asyncio
+    return asyncio.run(main())
+
+
+_default_sessions: HttpSessions | None = None
+_default_lock = threading.Lock()
+
+
+def get_default_sessions() -> HttpSessions:
+    "Sessions used when a jar is fetched without any being given"
+    global _default_sessions
+    with _default_lock:
+        if _default_sessions is None:
+            _default_sessions = HttpSessions()
+        return _default_sessions
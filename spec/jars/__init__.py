@@ -5,6 +5,45 @@ __all__ = [
     "FileJar", "GlobJar", "JenkinsBuildJar", "PaperJar",
 ]
 
-from .base import BaseJar, FileJar, GlobJar, BaseLaunchableJar
-from .jenkins import JenkinsBuildJar
-from .paper import PaperJar
+import importlib
+from typing import TYPE_CHECKING, Any
+from ..base import register_lazy
+
+if TYPE_CHECKING:
+    from .base import BaseJar, FileJar, GlobJar, BaseLaunchableJar
+    from .jenkins import JenkinsBuildJar
+    from .paper import PaperJar
+
+
+# the backends are only imported once used, so that running a server does not import networking code
+_EXPORTS = {
+    "BaseJar": ".base",
+    "BaseLaunchableJar": ".base",
+    "FileJar": ".base",
+    "GlobJar": ".base",
+    "JenkinsBuildJar": ".jenkins",
+    "PaperJar": ".paper",
+}
+
+_TAGS = {
+    "!jar.file": (".base", "FileJar"),
+    "!jar.glob": (".base", "GlobJar"),
+    "!jar.paper": (".paper", "PaperJar"),
+    "!jar.jenkins": (".jenkins", "JenkinsBuildJar"),
+    "!jar.jenkins.r.artifactglob": (".jenkins", "ArtifactGlobRestriction"),
+    "!jar.jenkins.r.artifactregex": (".jenkins", "ArtifactFilenameRegexRestriction"),
+    "!jar.jenkins.r.success": (".jenkins", "SuccessRestriction"),
+    "!jar.jenkins.r.artifactcount": (".jenkins", "ArtifactCountRestriction"),
+}
+
+for _tag, (_module, _name) in _TAGS.items():
+    register_lazy(_tag, __name__ + _module, _name)
+
+
+def __getattr__(name: str) -> Any:
+    module = _EXPORTS.get(name)
+    if module is None:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(importlib.import_module(module, __name__), name)
+    globals()[name] = value
+    return value
@@ -2,19 +2,37 @@ from __future__ import annotations
 
 from abc import ABC, abstractmethod
 from pathlib import Path
-import shutil
-from typing import TYPE_CHECKING, Any, Sequence
+import pickle
+import subprocess
+from typing import TYPE_CHECKING, Any, Mapping, Sequence
+from .. import trace
 from ..base import YamlObject
+from ..http import run_sync
 
 if TYPE_CHECKING:
+    from ..console import Console
+    from ..http import HttpSessions
     from ..store import BaseStore
 
 
 class JarInfo:
-    def __init__(self, storekey: Any, path: Path, name: str):
+    def __init__(
+        self,
+        storekey: Any,
+        path: Path,
+        name: str,
+        url: str | None = None,
+        build: str | int | None = None,
+        build_time: float | None = None,
+        digests: Mapping[str, str] = {},
+    ):
         self.storekey = storekey
         self.name = str(name)
         self.path = Path(path)
+        self.url = url
+        self.build = build
+        self.build_time = build_time
+        self.digests = dict(digests)
 
     def __repr__(self) -> str:
         return f"JarInfo({self.path}, {self.name})"
@@ -22,21 +40,49 @@ class JarInfo:
     storekey: Any
     path: Path
     name: str
+    # where the jar was resolved to, so that it can be fetched again without resolving (see `spec.lock`)
+    url: str | None
+    build: str | int | None
+    build_time: float | None  # unix seconds
+    digests: dict[str, str]
 
 
 class BaseJar(ABC, YamlObject):
     "Represents an accessor for a Jar file"
 
     @abstractmethod
-    def fetch(self, store: BaseStore, dry: bool = False) -> Sequence[JarInfo]:
+    async def fetch_async(self, store: BaseStore, dry: bool = False, http: HttpSessions | None = None) -> Sequence[JarInfo]:
         pass
 
+    def fetch(self, store: BaseStore, dry: bool = False, http: HttpSessions | None = None) -> Sequence[JarInfo]:
+        "Blocking wrapper around `fetch_async`, for callers without an event loop"
+        with trace.span(f"fetch {type(self).__name__}", "jar"):
+            return run_sync(self.fetch_async(store, dry=dry, http=http), http)
+
+    def fetch_identity(self) -> Any:
+        """Jars with the same identity resolve to the same files, so they are only fetched once
+
+        By default the whole configuration; jars with settings which do not affect what
+        they resolve to (such as how a server is launched) leave those out."""
+        return pickle.dumps(self, protocol=pickle.HIGHEST_PROTOCOL)
+
 
 class BaseLaunchableJar(BaseJar):
     "Represents an accessor for a Jar file which can be executed"
 
+    # console command which shuts the server down cleanly
+    stop_command: str = "stop"
+
     @abstractmethod
-    def run(self, path: Path, cwd: Path, dry: bool = False):
+    def run(self, path: Path, cwd: Path, dry: bool = False, store: BaseStore | None = None, console: Console | None = None):
+        "Run the server until it stops, with its output going to `console` if given, or else straight to stdout"
+        pass
+
+    @abstractmethod
+    def start(self, path: Path, cwd: Path, store: BaseStore | None = None, **popen_options: Any) -> subprocess.Popen[bytes]:
+        """Start the server without waiting for it, passing `popen_options` on to `subprocess.Popen`
+
+        `store` keeps anything which speeds up later launches, such as class data sharing archives."""
         pass
 
 
@@ -48,23 +94,29 @@ class FileJar(BaseJar, yamltag="!jar.file"):
     def __init__(self, path: str):
         self.path = Path(path)
 
+    def __repr__(self) -> str:
+        return f"FileJar({self.path})"
+
     def _get_key(self):
         return (type(self).__name__, self.path)
 
     def _get_path(self, store: BaseStore) -> Path:
         return store.get_name(self._get_key())
 
-    def fetch(self, store: BaseStore, dry: bool = False) -> tuple[JarInfo]:
+    async def fetch_async(self, store: BaseStore, dry: bool = False, http: HttpSessions | None = None) -> tuple[JarInfo]:
+        import asyncio
         if dry:
             return (JarInfo(
                 storekey=self._get_key(),
                 path=self._get_path(store),
                 name=self.path.name,
+                url=self.path.absolute().as_uri(),
             ),)
         return (JarInfo(
             storekey=self._get_key(),
-            path=shutil.copy2(self.path, self._get_path(store)),
+            path=await asyncio.to_thread(store.put_file, self._get_key(), self.path),
             name=self.path.name,
+            url=self.path.absolute().as_uri(),
         ),)
 
 
@@ -80,6 +132,9 @@ class GlobJar(BaseJar, yamltag="!jar.glob"):
         self.glob = str(path)
         self.limit = limit
 
+    def __repr__(self) -> str:
+        return f"GlobJar({self.glob})"
+
     def _get_key(self, filename: str) -> tuple[str, str, str]:
         return (type(self).__name__, self.glob, filename)
 
@@ -93,18 +148,25 @@ class GlobJar(BaseJar, yamltag="!jar.glob"):
                 storekey=key,
                 path=store.get_name(key),
                 name=src.name,
+                url=src.absolute().as_uri(),
             )
         return JarInfo(
             storekey=key,
-            path=Path(shutil.copy2(src, store.get_name(key))),
+            path=store.put_file(key, src),
             name=src.name,
+            url=src.absolute().as_uri(),
         )
 
-    def fetch(self, store: BaseStore, dry: bool = False) -> list[JarInfo]:
+    async def fetch_async(self, store: BaseStore, dry: bool = False, http: HttpSessions | None = None) -> list[JarInfo]:
+        import asyncio
+        paths = await asyncio.to_thread(self._match, dry)
+        return list(await asyncio.gather(*(asyncio.to_thread(self._copy, store, path, dry) for path in paths)))
+
+    def _match(self, dry: bool = False) -> list[Path]:
         gl = Path(".").glob(self.glob)
 
         if self.limit is None:
-            return [self._copy(store, path, dry=dry) for path in gl]
+            return list(gl)
 
         try:
             paths = [next(gl) for _ in range(self.limit)]
@@ -117,7 +179,7 @@ class GlobJar(BaseJar, yamltag="!jar.glob"):
         try:
             next(gl)
         except StopIteration:
-            return [self._copy(store, path, dry=dry) for path in paths]
+            return paths
         else:
             if dry:
                 print(f"Not enough files match the glob {self.glob!r}")
@@ -0,0 +1,168 @@
+"""Class data sharing (AppCDS) archives, which let the JVM start without loading and verifying every class
+
+A launch without an archive is the training run: the JVM is asked to dump the classes
+it loaded when it exits (`-XX:ArchiveClassesAtExit`, JDK 13+), and the next launch moves
+the dump into the store, keyed by the jar's content, the Java version and the flags,
+and maps it with `-XX:SharedArchiveFile`. A JVM silently ignores an archive which does
+not match it, so each archive is checked in the background once it is used, and one
+which fails the check is marked stale, to be replaced by the next launch.
+
+The check runs the launch's own command (the same flags, `-jar` path and working
+directory, as the JVM validates the classpath recorded in the archive), with
+`-Xshare:on`, which makes an archive that cannot be mapped fatal, and
+`-XX:+PrintSharedArchiveAndExit`, which exits once it has been, before the server starts."""
+
+from __future__ import annotations
+
+import functools
+import hashlib
+from pathlib import Path
+import re
+import subprocess
+import sys
+import threading
+from typing import TYPE_CHECKING, Sequence
+
+if TYPE_CHECKING:
+    from ..store import BaseStore
+
+
+# dynamic archives were added in JDK 13
+MIN_JAVA = 13
+
+# flags which do not affect whether an archive can be mapped, but make the check slow
+_IGNORED_FLAGS = re.compile(r"-Xms|-XX:[+-]AlwaysPreTouch|-XX:(?:SharedArchiveFile|ArchiveClassesAtExit)=")
+
+_checked: set[Path] = set()
+_lock = threading.Lock()
+
+
+@functools.lru_cache(maxsize=None)
+def java_version(java: str) -> str | None:
+    "The output of `java -version`, which names the exact build, or None if it cannot be run"
+    try:
+        out = subprocess.run([java, "-version"], capture_output=True, text=True, timeout=60)
+    except (OSError, subprocess.SubprocessError):
+        return None
+    return (out.stderr or out.stdout).strip() if out.returncode == 0 else None
+
+
+def feature_version(version: str) -> int | None:
+    "The feature release (17 for 17.0.2, 8 for 1.8.0) named in `java -version` output"
+    m = re.search(r'version "(?:1\.)?(\d+)', version)
+    return int(m.group(1)) if m else None
+
+
+@functools.lru_cache(maxsize=64)
+def _jar_sha256(path: Path, size: int, mtime: int) -> str:
+    from ..store import hash_file
+    return hash_file(path)["sha256"]
+
+
+class Archive:
+    "The archive for one jar, Java build and set of flags"
+
+    def __init__(self, store: BaseStore, java: str, version: str, options: Sequence[str], jar: Path, cwd: Path | None = None):
+        self.store = store
+        self.java = java
+        self.options = [o for o in options if not _IGNORED_FLAGS.match(o)]
+        self.jar = jar
+        self.cwd = cwd or Path()
+        path = (self.cwd / jar).absolute()
+        st = path.stat()
+        # the JVM also checks the classpath, and the jar's size and modification time
+        flags = hashlib.sha256("\0".join([str(path), str(st.st_mtime_ns), *self.options]).encode()).hexdigest()
+        self.key = ("AppCDS", _jar_sha256(path, st.st_size, st.st_mtime_ns), version, flags)
+        slot = store.get_name(self.key)
+        self.training = slot.with_name(slot.name + ".training.jsa")
+        self.stale_marker = slot.with_name(slot.name + ".stale")
+
+    store: BaseStore
+    java: str
+    options: list[str]  # JVM flags which affect the archive
+    jar: Path  # as given to `-jar`, relative to `cwd`
+    cwd: Path  # the server folder the jar is launched in
+    key: tuple[str, str, str, str]
+    training: Path  # where the training run dumps the archive
+    stale_marker: Path
+
+    @classmethod
+    def for_launch(cls, store: BaseStore, java: str, options: Sequence[str], jar: Path, cwd: Path | None = None) -> Archive | None:
+        "The archive to use or train for this launch, or None if the JVM cannot use one"
+        version = java_version(java)
+        if version is None or (feature_version(version) or 0) < MIN_JAVA:
+            return None
+        try:
+            return cls(store, java, version, options, jar, cwd)
+        except OSError:
+            return None
+
+    def path(self) -> Path | None:
+        "The stored archive, adopting a finished training run first; None if there is none or it is stale"
+        if self.training.exists() and self.training.stat().st_size > 0:
+            path = self.store.put_file(self.key, self.training)
+            self.training.unlink(missing_ok=True)
+            self.stale_marker.unlink(missing_ok=True)
+            print(f"Stored class data sharing archive {path}")
+            return path
+        if self.stale_marker.exists():
+            return None
+        return self.store.fetch(self.key)
+
+    def train_options(self) -> list[str]:
+        "Flags which make this launch dump a new archive when the JVM exits"
+        self.training.unlink(missing_ok=True)
+        return [f"-XX:ArchiveClassesAtExit={self.training}"]
+
+    def check_command(self, path: Path) -> list[str]:
+        "The launch command, made to map the archive at `path` or fail, and then exit"
+        return [
+            self.java, *self.options, "-Xshare:on", f"-XX:SharedArchiveFile={path}",
+            "-XX:+PrintSharedArchiveAndExit", "-jar", str(self.jar),
+        ]
+
+    def check(self, path: Path) -> bool:
+        "Whether the JVM can map the archive at `path` when launching the jar as the server does"
+        try:
+            out = subprocess.run(self.check_command(path), cwd=self.cwd, capture_output=True, timeout=300)
+        except (OSError, subprocess.SubprocessError):
+            return True  # not the archive's fault
+        return out.returncode == 0
+
+    def check_in_background(self, path: Path):
+        "Check the archive once per process, marking it stale if the JVM cannot use it"
+        with _lock:
+            if path in _checked:
+                return
+            _checked.add(path)
+
+        def run():
+            if not self.check(path):
+                print(f"Class data sharing archive {path} does not match {self.jar}; "
+                      "it will be rebuilt by the next launch", file=sys.stderr)
+                self.stale_marker.touch()
+
+        threading.Thread(target=run, name="cds check", daemon=True).start()
+
+
+def launch_options(
+    store: BaseStore,
+    java: str,
+    options: Sequence[str],
+    jar: Path,
+    cwd: Path | None = None,
+    check: bool = True,
+) -> list[str]:
+    """Flags to use or train the archive of `jar` when launching it with `java`, `options` and `-jar jar` in `cwd`
+
+    Empty if the JVM is too old for dynamic archives. With `check`, an archive being used
+    is checked in the background (see `Archive.check_in_background`)."""
+    archive = Archive.for_launch(store, java, options, jar, cwd)
+    if archive is None:
+        return []
+    path = archive.path()
+    if path is None:
+        return archive.train_options()
+    if check:
+        archive.check_in_background(path)
+    return [f"-XX:SharedArchiveFile={path}"]
@@ -4,26 +4,37 @@ from abc import ABC, abstractmethod
 import os
 from pathlib import Path
 import re
-import requests
 import time
-from typing import TYPE_CHECKING, Any, Sequence, Tuple, cast
+from typing import TYPE_CHECKING, Any, AsyncIterator, Mapping, Sequence, Tuple, cast
 from .typing import Artifact, BuildData, JobData
 from ..base import BaseJar, JarInfo
 from ...base import YamlObject, YamlScalar
+from ...http import HttpClient, HttpSessions, download_file_async, download_to_store_async, get_default_sessions
 
 if TYPE_CHECKING:
+    from ...http import ResponseCache
     from ...store import BaseStore
 
 
+# fields of a build that restrictions and downloads need; fetched for many builds in one request
+BUILD_TREE = "number,url,result,timestamp,artifacts[fileName,relativePath],fingerprint[fileName,hash]"
+
+
 class _ReturnArtifact:
-    def __init__(self, baseurl: str, artifact: Artifact):
+    def __init__(self, baseurl: str, artifact: Artifact, md5: str | None = None):
         self.artifact = artifact
         self.url = str(baseurl).rstrip("/") + "/artifact/" + artifact["relativePath"]
         self.filename = str(artifact["fileName"])
+        self.md5 = md5
 
     artifact: Artifact
     url: str
     filename: str
+    md5: str | None
+
+    @property
+    def digests(self) -> dict[str, str]:
+        return {"md5": self.md5} if self.md5 else {}
 
 
 class Restriction(ABC, YamlObject):
@@ -98,8 +109,17 @@ class ArtifactCountRestriction(Restriction, yamltag="!jar.jenkins.r.artifactcoun
 class JenkinsBuildJar(BaseJar, yamltag="!jar.jenkins"):
     baseurl: str
     restrictions: list[Restriction]
-
-    def __init__(self, url: str, job: str | None = None, restrictions: Sequence[Restriction] = []):
+    batch: int | None
+    cache_ttl: float | None
+
+    def __init__(
+        self,
+        url: str,
+        job: str | None = None,
+        restrictions: Sequence[Restriction] = [],
+        batch: int | None = 20,
+        cache_ttl: float | None = None,
+    ):
         # url can be the CI server with job argument, or the direct job
         self.baseurl = str(url).rstrip("/")
         if job is not None:
@@ -107,25 +127,63 @@ class JenkinsBuildJar(BaseJar, yamltag="!jar.jenkins"):
 
         self.restrictions = list(restrictions)
 
-    def _api_get(self, url: str, tree: str | None = None) -> dict[str, Any]:
-        r = requests.get(url.rstrip("/") + "/api/json", params={"tree": tree})
-        r.raise_for_status()
-        return r.json()
+        # number of builds to scan per request; None (or 0) fetches every build separately
+        if batch is not None and batch < 0:
+            raise ValueError("Batch size must be at least 1, or None or 0 to fetch every build separately")
+        self.batch = batch or None
+
+        # minutes for which a previous API response is trusted without revalidation
+        self.cache_ttl = None if cache_ttl is None else float(cache_ttl) * 60
+
+    def __repr__(self) -> str:
+        return f"JenkinsBuildJar({self.baseurl})"
+
+    def _client(self, http: HttpSessions | None = None, cache: ResponseCache | None = None) -> HttpClient:
+        return (http or get_default_sessions()).client(cache=cache, ttl=self.cache_ttl)
 
-    def fetch_builds_url(self) -> list[str]:
-        data = cast(JobData, self._api_get(self.baseurl, tree="builds[url]"))
+    async def _api_get(self, url: str, tree: str | None = None, http: HttpClient | None = None) -> dict[str, Any]:
+        if http is None:
+            http = self._client()
+        return await http.get_json_async(url.rstrip("/") + "/api/json", params={"tree": tree})
+
+    async def fetch_builds_url(self, http: HttpClient | None = None) -> list[str]:
+        data = cast(JobData, await self._api_get(self.baseurl, tree="builds[url]", http=http))
         return [str(build["url"]) for build in data["builds"]]
 
-    def fetch_stable_url(self) -> str:
-        return str(self._api_get(self.baseurl, tree="lastStableBuild[url]")["lastStableBuild"]["url"])
+    async def fetch_stable_url(self, http: HttpClient | None = None) -> str:
+        return str((await self._api_get(self.baseurl, tree="lastStableBuild[url]", http=http))["lastStableBuild"]["url"])
+
+    async def fetch_builds_page(self, start: int, count: int, http: HttpClient | None = None) -> list[BuildData]:
+        "Fetch the restriction-relevant data of builds `start` to `start + count` (newest first)"
+        tree = f"builds[{BUILD_TREE}]{{{start},{start + count}}}"
+        data = await self._api_get(self.baseurl, tree=tree, http=http)
+        return cast("list[BuildData]", data["builds"])
+
+    async def iter_builds(self, http: HttpClient | None = None) -> AsyncIterator[BuildData]:
+        "Yield builds newest first, only requesting the next page once the previous one is used up"
+        assert self.batch is not None
+        start = 0
+        while True:
+            page = await self.fetch_builds_page(start, self.batch, http=http)
+            for data in page:
+                yield data
+            if len(page) < self.batch:
+                return
+            start += self.batch
+
+    def check_restrictions(self, data: BuildData) -> bool:
+        return all(res.check(data) for res in self.restrictions)
+
+    async def fetch_latest_filtered_build(self, http: HttpClient | None = None) -> BuildData:
+        if self.batch is not None:
+            return await self._fetch_latest_filtered_build_batched(http=http)
 
-    def fetch_latest_filtered_build(self) -> BuildData:
         if not self.restrictions:
-            buildurl = self.fetch_stable_url()
-            data = cast(BuildData, self._api_get(buildurl))
+            buildurl = await self.fetch_stable_url(http=http)
+            data = cast(BuildData, await self._api_get(buildurl, http=http))
         else:
-            for buildurl in self.fetch_builds_url():
-                data = cast(BuildData, self._api_get(buildurl))
+            for buildurl in await self.fetch_builds_url(http=http):
+                data = cast(BuildData, await self._api_get(buildurl, http=http))
                 for res in self.restrictions:
                     if not res.check(data):
                         break  # escape restrictions, avoiding else clause (continue to next `buildurl`)
@@ -136,22 +194,48 @@ class JenkinsBuildJar(BaseJar, yamltag="!jar.jenkins"):
                 raise ValueError("No builds match the required restrictions")
         return data  # data["url"] is buildurl; doesn't need to be returned separately
 
-    def extract_artifact(self, data: BuildData) -> list[_ReturnArtifact]:
-        return [_ReturnArtifact(data["url"], artifact) for artifact in data["artifacts"]]
-
-    def download(self, url: str, dest: Path):
-        r = requests.get(url, stream=True)
-        r.raise_for_status()
+    async def _fetch_latest_filtered_build_batched(self, http: HttpClient | None = None) -> BuildData:
+        if not self.restrictions:
+            data = await self._api_get(self.baseurl, tree=f"lastStableBuild[{BUILD_TREE}]", http=http)
+            if data.get("lastStableBuild") is None:
+                raise ValueError("Job has no stable builds")
+            return cast(BuildData, data["lastStableBuild"])
+
+        builds = self.iter_builds(http=http)
+        try:
+            async for data in builds:
+                if self.check_restrictions(data):
+                    return data
+        finally:
+            await builds.aclose()
+        raise ValueError("No builds match the required restrictions")
 
-        with open(dest, "wb") as fd:
-            for chunk in r.iter_content(chunk_size=4096):
-                fd.write(chunk)
+    def extract_artifact(self, data: BuildData) -> list[_ReturnArtifact]:
+        # fingerprints are only present if the job records them, and are matched by filename
+        fingerprints = {fp["fileName"]: fp["hash"] for fp in data.get("fingerprint") or []}
+        return [
+            _ReturnArtifact(data["url"], artifact, md5=fingerprints.get(artifact["fileName"]))
+            for artifact in data["artifacts"]
+        ]
+
+    async def download(
+        self,
+        url: str,
+        dest: Path,
+        http: HttpClient | None = None,
+        expected: Mapping[str, str] = {},
+    ) -> dict[str, str]:
+        if http is None:
+            http = self._client()
+        return await download_file_async(http, url, dest, expected=expected)
 
     def _store_key(self, url: str) -> Tuple[str, str]:
         return (type(self).__name__, url)
 
-    def fetch(self, store: BaseStore, dry: bool = False) -> list[JarInfo]:
-        data = self.fetch_latest_filtered_build()
+    async def fetch_async(self, store: BaseStore, dry: bool = False, http: HttpSessions | None = None) -> list[JarInfo]:
+        import asyncio
+        client = self._client(http, cache=store.response_cache)
+        data = await self.fetch_latest_filtered_build(http=client)
         artifacts = self.extract_artifact(data)
 
         ret: list[JarInfo] = []
@@ -162,21 +246,29 @@ class JenkinsBuildJar(BaseJar, yamltag="!jar.jenkins"):
                     storekey=key,
                     path=store.get_name(key),
                     name=art.filename,
+                    url=art.url,
+                    build=data["number"],
+                    build_time=data["timestamp"] / 1000,
+                    digests=art.digests,
                 ))
                 continue
 
-            c = store.fetch(key)
+            info = dict(url=art.url, name=art.filename, build_time=data["timestamp"] / 1000)
+            c = await asyncio.to_thread(store.lookup, key, art.digests, **info)
             if c is not None:
                 ret.append(JarInfo(
                     storekey=key,
                     path=c,
                     name=art.filename,
+                    url=art.url,
+                    build=data["number"],
+                    build_time=data["timestamp"] / 1000,
+                    digests=art.digests,
                 ))
                 continue
 
-            dest = store.get_name(key)
-
-            self.download(art.url, dest)
+            dest, digests = await download_to_store_async(
+                client, store, key, art.url, art.digests, name=art.filename, build_time=data["timestamp"] / 1000)
 
             try:
                 # set access time to now and set modification time to timestamp (convert ms -> ns)
@@ -188,6 +280,10 @@ class JenkinsBuildJar(BaseJar, yamltag="!jar.jenkins"):
                 storekey=key,
                 path=dest,
                 name=art.filename,
+                url=art.url,
+                build=data["number"],
+                build_time=data["timestamp"] / 1000,
+                digests=digests,
             ))
 
         return ret
@@ -12,6 +12,11 @@ class Artifact(TypedDict):
     relativePath: str
 
 
+class Fingerprint(TypedDict):
+    fileName: str
+    hash: str  # md5
+
+
 class BuildData(TypedDict):
     actions: list[dict[str, Any]]
     artifacts: list[Artifact]
@@ -21,6 +26,7 @@ class BuildData(TypedDict):
     duration: int | None
     estimatedDuration: int | None
     executor: Any | None
+    fingerprint: list[Fingerprint]
     fullDisplayName: str
     id: str
     keepLog: bool
@@ -4,80 +4,106 @@ from datetime import datetime
 import os
 from pathlib import Path
 import time
-from typing import TYPE_CHECKING, Sequence, cast
-import requests
+from typing import TYPE_CHECKING, Any, Mapping, Sequence, cast
 import signal
 import subprocess
 import sys
+from .. import cds
 from ..base import BaseLaunchableJar, JarInfo
-from . import paperflags
-from .typing import BuildResponse, ProjectId, ProjectResponse, VersionGroup, VersionGroupBuild, VersionGroupBuildsResponse
+from ...http import HttpClient, HttpSessions, download_file_async, download_to_store_async, get_default_sessions
+from . import paperclip, paperflags
+from .typing import BuildId, BuildResponse, ProjectId, ProjectResponse, VersionGroup, VersionGroupBuild, VersionGroupBuildsResponse
 
 if TYPE_CHECKING:
     from typing import Literal
+    from ...console import Console
     from ...store import BaseStore
 
 
 API_ROOT = "https://papermc.io/api/v2"
 
+# projects which are proxies rather than servers, and are shut down with `end`
+PROXIES = ("waterfall", "velocity", "travertine")
+
 
 class BuildInfo:
-    def __init__(self, response: BuildResponse):
+    def __init__(self, response: BuildResponse, api: str = API_ROOT):
         self.response = response
+        self.api = api
 
     @classmethod
-    def from_versiongroup(cls, buildsdata: VersionGroupBuildsResponse, build: VersionGroupBuild) -> BuildInfo:
+    def from_versiongroup(cls, buildsdata: VersionGroupBuildsResponse, build: VersionGroupBuild, api: str = API_ROOT) -> BuildInfo:
         br = BuildResponse(project_id=buildsdata["project_id"], project_name=buildsdata["project_name"], **build)
-        return cls(br)
+        return cls(br, api=api)
 
     response: BuildResponse
+    api: str
 
     @property
     def filename(self) -> str:
         return self.response["downloads"]["application"]["name"]
 
+    @property
+    def sha256(self) -> str | None:
+        return self.response["downloads"]["application"].get("sha256")
+
+    @property
+    def digests(self) -> dict[str, str]:
+        return {"sha256": self.sha256} if self.sha256 else {}
+
+    @property
+    def number(self) -> BuildId:
+        return self.response["build"]
+
     @property
     def url(self) -> str:
         project = self.response["project_id"]
         version = self.response["version"]
         build = self.response["build"]
-        return f"{API_ROOT}/projects/{project}/versions/{version}/builds/{build}/downloads/{self.filename}"
+        return f"{self.api}/projects/{project}/versions/{version}/builds/{build}/downloads/{self.filename}"
 
     @property
     def timestamp(self) -> datetime:
         return datetime.fromisoformat(str(self.response["time"]).replace("Z", "+00:00"))
 
 
-def fetch_version_groups(project: ProjectId) -> list[VersionGroup]:
-    r = requests.get(f"{API_ROOT}/projects/{project}")
-    r.raise_for_status()
-    projdata = cast(ProjectResponse, r.json())
-    return projdata.get("version_groups", [])
+def _client(http: HttpClient | None) -> HttpClient:
+    return http if http is not None else get_default_sessions().client()
 
 
-def fetch_build_by_version_group(project: ProjectId, version_group: VersionGroup) -> BuildInfo:
-    r = requests.get(f"{API_ROOT}/projects/{project}/version_group/{version_group}/builds")
-    r.raise_for_status()
-    buildsdata = cast(VersionGroupBuildsResponse, r.json())
-    return BuildInfo.from_versiongroup(buildsdata, buildsdata["builds"][-1])
+async def fetch_version_groups(project: ProjectId, http: HttpClient | None = None, api: str = API_ROOT) -> list[VersionGroup]:
+    projdata = cast(ProjectResponse, await _client(http).get_json_async(f"{api}/projects/{project}"))
+    return projdata.get("version_groups", [])
 
 
-def get_latest_version_in_group(project: ProjectId, version_group: VersionGroup) -> BuildInfo:
-    version_groups = fetch_version_groups(project)
+async def fetch_build_by_version_group(
+    project: ProjectId,
+    version_group: VersionGroup,
+    http: HttpClient | None = None,
+    api: str = API_ROOT,
+) -> BuildInfo:
+    buildsdata = cast(VersionGroupBuildsResponse, await _client(http).get_json_async(
+        f"{api}/projects/{project}/version_group/{version_group}/builds"))
+    return BuildInfo.from_versiongroup(buildsdata, buildsdata["builds"][-1], api=api)
+
+
+async def get_latest_version_in_group(
+    project: ProjectId,
+    version_group: VersionGroup,
+    http: HttpClient | None = None,
+    api: str = API_ROOT,
+) -> BuildInfo:
+    version_groups = await fetch_version_groups(project, http=http, api=api)
     if version_group not in version_groups:
         raise ValueError(f"ERROR: cannot find version group {version_group}")
     elif version_group != version_groups[-1]:
         print(f"WARNING: more recent version group found: {version_groups[-1]}", file=sys.stderr)
 
-    return fetch_build_by_version_group(project, version_group)
+    return await fetch_build_by_version_group(project, version_group, http=http, api=api)
 
 
-def download(url: str, dest: Path):
-    with requests.get(url, stream=True) as r:
-        r.raise_for_status()
-        with open(dest, "wb") as f:
-            for chunk in r.iter_content(chunk_size=8192):
-                f.write(chunk)
+async def download(url: str, dest: Path, http: HttpClient | None = None, expected: Mapping[str, str] = {}) -> dict[str, str]:
+    return await download_file_async(_client(http), url, dest, expected=expected)
 
 
 class PaperJar(BaseLaunchableJar, yamltag="!jar.paper"):
@@ -85,7 +111,13 @@ class PaperJar(BaseLaunchableJar, yamltag="!jar.paper"):
     version_group: VersionGroup
     java_bin: str
     java_options: list[str]
+    flags: dict[str, Any]
+    cds: bool
+    paperclip_cache: bool
     jar_options: list[str]
+    cache_ttl: float | None
+    api: str
+    stop_command: str
 
     def __init__(
         self,
@@ -95,8 +127,14 @@ class PaperJar(BaseLaunchableJar, yamltag="!jar.paper"):
         memory: str | None | Literal[False] = False,
         initial_memory: str | None | Literal[False] = False,
         aikar_flags: bool = True,
+        gc: str = "g1",
+        cds: bool = False,
+        paperclip_cache: bool = True,
         java_options: Sequence[str] = [],
         options: Sequence[str] | None = None,
+        cache_ttl: float | None = None,
+        api: str = API_ROOT,
+        stop_command: str | None = None,
     ):
         self.project = ProjectId(project)
         # Cast to str first in case yaml interprets as float
@@ -104,9 +142,14 @@ class PaperJar(BaseLaunchableJar, yamltag="!jar.paper"):
 
         self.java_bin = java
         self.java_options = list(java_options)
-        if aikar_flags:
-            fl = paperflags.get_flags(memory=memory, init_memory=initial_memory, include_aikar=aikar_flags)
-            self.java_options.extend(fl)
+        if memory not in (None, False, paperflags.AUTO):
+            paperflags.check_memory_flag(memory)
+        # `memory: auto` is sized when the server is started, on the host it runs on, not when the spec is loaded
+        self.flags = dict(memory=memory, init_memory=initial_memory, include_aikar=aikar_flags, gc=paperflags.check_gc(gc))
+        # launches train and then use a class data sharing archive, kept in the store
+        self.cds = bool(cds)
+        # the patched server and libraries are kept in the store, and linked into new server folders
+        self.paperclip_cache = bool(paperclip_cache)
         if options is None:
             if self.project == "paper":
                 options = ["nogui"]
@@ -114,11 +157,30 @@ class PaperJar(BaseLaunchableJar, yamltag="!jar.paper"):
                 options = []
         self.jar_options = list(options)
 
+        # minutes for which a previous API response is trusted without revalidation
+        self.cache_ttl = None if cache_ttl is None else float(cache_ttl) * 60
+
+        # root of the v2 API, for mirrors (or local stand-ins)
+        self.api = str(api).rstrip("/")
+
+        if stop_command is None:
+            stop_command = "end" if self.project in PROXIES else "stop"
+        self.stop_command = str(stop_command)
+
+    def __repr__(self) -> str:
+        return f"PaperJar({self.project} {self.version_group})"
+
+    def fetch_identity(self) -> Any:
+        # servers launched with different flags still run the same jar
+        return (type(self).__name__, self.project, self.version_group, self.api, self.cache_ttl)
+
     def _get_key(self, url: str) -> tuple[str, str]:
         return (type(self).__name__, url)
 
-    def fetch(self, store: BaseStore, dry: bool = False) -> tuple[JarInfo]:
-        build = get_latest_version_in_group(self.project, self.version_group)
+    async def fetch_async(self, store: BaseStore, dry: bool = False, http: HttpSessions | None = None) -> tuple[JarInfo]:
+        import asyncio
+        client = (http or get_default_sessions()).client(cache=store.response_cache, ttl=self.cache_ttl)
+        build = await get_latest_version_in_group(self.project, self.version_group, http=client, api=self.api)
         key = self._get_key(build.url)
 
         if dry:
@@ -126,19 +188,27 @@ class PaperJar(BaseLaunchableJar, yamltag="!jar.paper"):
                 storekey=key,
                 path=store.get_name(key),
                 name=build.filename,
+                url=build.url,
+                build=build.number,
+                build_time=build.timestamp.timestamp(),
+                digests=build.digests,
             ),)
 
-        p = store.fetch(key)
+        info = dict(url=build.url, name=build.filename, build_time=build.timestamp.timestamp())
+        p = await asyncio.to_thread(store.lookup, key, build.digests, **info)
         if p is not None:
             return (JarInfo(
                 storekey=key,
                 path=p,
                 name=build.filename,
+                url=build.url,
+                build=build.number,
+                build_time=build.timestamp.timestamp(),
+                digests=build.digests,
             ),)
 
-        dest = store.get_name(key)
-
-        download(build.url, dest)
+        dest, digests = await download_to_store_async(
+            client, store, key, build.url, build.digests, name=build.filename, build_time=build.timestamp.timestamp())
         try:
             # set access time to now and set modification time to timestamp (seconds)
             os.utime(dest, (time.time(), build.timestamp.timestamp()))
@@ -148,30 +218,42 @@ class PaperJar(BaseLaunchableJar, yamltag="!jar.paper"):
             storekey=key,
             path=dest,
             name=build.filename,
+            url=build.url,
+            build=build.number,
+            build_time=build.timestamp.timestamp(),
+            digests=digests,
         ),)
 
-    def build_command(self, jarpath: Path) -> Sequence[str]:
+    def build_command(self, jarpath: Path, cwd: Path | None = None, store: BaseStore | None = None) -> Sequence[str]:
+        "Command to run the server jar at `jarpath` (relative to `cwd`), with a class data sharing archive from `store`"
+        options = [*self.java_options, *paperflags.get_flags(**self.flags)]
+        if self.cds and store is not None:
+            options.extend(cds.launch_options(store, self.java_bin, options, jarpath, cwd))
         return [
             self.java_bin,
-            *self.java_options,
+            *options,
             "-jar",
             str(jarpath),
             *self.jar_options,
         ]
 
-    def run(self, path: Path, cwd: Path, dry: bool = False):
-        cmd = self.build_command(jarpath=path.relative_to(cwd))
+    def start(self, path: Path, cwd: Path, store: BaseStore | None = None, **popen_options: Any) -> subprocess.Popen[bytes]:
+        if store is not None and self.paperclip_cache:
+            paperclip.prepare(store, self.java_bin, path, cwd)
+        return subprocess.Popen(self.build_command(path.relative_to(cwd), cwd=cwd, store=store), cwd=cwd, **popen_options)
+
+    def run(self, path: Path, cwd: Path, dry: bool = False, store: BaseStore | None = None, console: Console | None = None):
         if dry:
-            print(cmd)
+            # without the store, so that nothing is adopted into it
+            print(self.build_command(path.relative_to(cwd), cwd=cwd))
             return
 
-        process = subprocess.Popen(
-            cmd,
-            stdin=sys.stdin,
-            stdout=sys.stdout,
-            stderr=sys.stderr,
-            cwd=cwd,
-        )
+        if console is None:
+            process = self.start(path, cwd, store=store, stdin=sys.stdin, stdout=sys.stdout, stderr=sys.stderr)
+        else:
+            process = self.start(path, cwd, store=store, stdin=sys.stdin, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+            assert process.stdout is not None
+            console.attach(process.stdout)
         try:
             while process.poll() is None:
                 try:
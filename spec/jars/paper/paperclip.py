@@ -0,0 +1,121 @@
+"""Files which a Paperclip launcher writes into the server folder, kept in the store
+
+A Paper jar is a Paperclip launcher: on its first start in a folder it downloads the
+vanilla server into `cache/`, patches it into `versions/` and extracts the libraries
+into `libraries/`. The launcher lists every one of those files and its sha256, so they
+can be kept in the store once and linked into every other server folder running the
+same build, which then starts without the network and without patching."""
+
+from __future__ import annotations
+
+from pathlib import Path
+import subprocess
+import sys
+from typing import TYPE_CHECKING, NamedTuple
+import zipfile
+
+from ...deploy import DeployMode, place
+from ...store import hash_file
+
+if TYPE_CHECKING:
+    from ...store import BaseStore
+
+
+# listing in the launcher -> folder its paths are relative to
+LISTS = {
+    "META-INF/download-context": "cache",
+    "META-INF/versions.list": "versions",
+    "META-INF/libraries.list": "libraries",
+}
+
+
+class PatchedFile(NamedTuple):
+    path: str  # relative to the server folder
+    sha256: str
+
+    @property
+    def storekey(self) -> tuple[str, str]:
+        return ("Paperclip", self.path)
+
+
+def list_files(jar: Path) -> list[PatchedFile]:
+    "Files the launcher `jar` writes when it starts, or none if it is not a Paperclip (or bundler) jar"
+    files = []
+    try:
+        with zipfile.ZipFile(jar) as z:
+            names = set(z.namelist())
+            for listing, folder in LISTS.items():
+                if listing not in names:
+                    continue
+                for line in z.read(listing).decode().splitlines():
+                    # "sha256<TAB>id or url<TAB>path"
+                    parts = line.split("\t")
+                    if len(parts) == 3:
+                        files.append(PatchedFile(f"{folder}/{parts[2]}", parts[0].lower()))
+    except (OSError, zipfile.BadZipFile, UnicodeDecodeError):
+        return []
+    return files
+
+
+def seed(store: BaseStore, files: list[PatchedFile], cwd: Path) -> tuple[int, list[PatchedFile]]:
+    """Link the stored copies of `files` which are missing from the server folder `cwd`
+
+    Returns how many were linked, and the files which are not in the store."""
+    linked = 0
+    unstored = []
+    for f in files:
+        src = store.lookup(f.storekey, {"sha256": f.sha256})
+        if src is None:
+            unstored.append(f)
+            continue
+        dest = cwd / f.path
+        if not dest.exists():
+            dest.parent.mkdir(parents=True, exist_ok=True)
+            place(src, dest, DeployMode.Hardlink)
+            linked += 1
+    return linked, unstored
+
+
+def capture(store: BaseStore, files: list[PatchedFile], cwd: Path) -> int:
+    "Keep those of `files` in the server folder `cwd` which match their listing in the store, returning how many were added"
+    added = 0
+    for f in files:
+        src = cwd / f.path
+        if not src.is_file():
+            continue
+        if hash_file(src)["sha256"] != f.sha256:
+            continue  # not fully written, or replaced by hand
+        store.put_file(f.storekey, src)
+        added += 1
+    return added
+
+
+def patch(java: str, jar: Path, cwd: Path) -> bool:
+    "Have the launcher download and patch everything without starting the server"
+    print(f"Patching {jar.name} in {cwd}")
+    sys.stdout.flush()
+    try:
+        return subprocess.run([java, "-Dpaperclip.patchonly=true", "-jar", str(jar)], cwd=cwd).returncode == 0
+    except OSError as e:
+        print(f"Cannot patch {jar.name}: {e}", file=sys.stderr)
+        return False
+
+
+def prepare(store: BaseStore, java: str, jar: Path, cwd: Path):
+    """Make sure the server folder `cwd` has everything the launcher `jar` needs, from the store if it can be
+
+    Anything the store does not have is made by the launcher (in patch-only mode) and kept in the store."""
+    files = list_files(jar)
+    if not files:
+        return
+    linked, unstored = seed(store, files, cwd)
+    if linked:
+        print(f"Linked {linked} Paperclip files from the store into {cwd}")
+    # only Paperclip has a patch-only mode; a plain bundler (such as Mojang's server jar) would start the server
+    paperclip = any(f.path.startswith(LISTS["META-INF/download-context"] + "/") for f in files)
+    if paperclip and any(not (cwd / f.path).exists() for f in unstored):
+        patch(java, jar, cwd)
+    added = capture(store, unstored, cwd)
+    if added:
+        print(f"Stored {added} Paperclip files from {cwd}")
+
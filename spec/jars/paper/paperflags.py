@@ -1,19 +1,144 @@
 from __future__ import annotations
 
+import os
+from pathlib import Path
 import re
 from typing import TYPE_CHECKING, Any, Mapping, Sequence
 
+from ...base import parse_size
+
 if TYPE_CHECKING:
     from typing import Literal
 
 
+AUTO = "auto"
+GC_PROFILES = ("g1", "zgc", "shenandoah")
+
+MiB = 1 << 20
+GiB = 1 << 30
+
+
 def check_memory_flag(memory: str) -> str:
     if not re.match(r"\d+[kmgt]", memory, re.I):
         raise ValueError(f"Invalid memory value: {memory}")
     return memory
 
 
-def get_aikar_flags() -> Sequence[str]:
+def check_gc(gc: str) -> str:
+    gc = str(gc).lower()
+    if gc not in GC_PROFILES:
+        raise ValueError(f"Invalid garbage collector: {gc} (choose from {', '.join(GC_PROFILES)})")
+    return gc
+
+
+def _read(path: Path) -> str | None:
+    try:
+        return path.read_text().strip()
+    except OSError:
+        return None
+
+
+def _cgroups(proc: Path = Path("/proc"), root: Path = Path("/sys/fs/cgroup")) -> list[Path]:
+    """Folders of the cgroups this process is in, innermost first, for both cgroup v1 and v2
+
+    The hierarchy is walked up to the root, as a limit on any ancestor applies too."""
+    folders = []
+    for line in (_read(proc / "self" / "cgroup") or "").splitlines():
+        _, controllers, path = line.split(":", 2)
+        # v1 mounts joined controllers (cpu,cpuacct) together, usually with a link for each
+        bases = [root] if not controllers else [root / controllers, *(root / c for c in controllers.split(","))]
+        for base in bases:
+            # inside a container the cgroup namespace's root is mounted at `base` itself
+            for rel in (Path(path.lstrip("/")), Path()):
+                folder = base / rel
+                while True:
+                    if folder not in folders:
+                        folders.append(folder)
+                    if folder == base:
+                        break
+                    folder = folder.parent
+    return folders
+
+
+class HostResources:
+    "Memory and CPUs available to the server, as limited by the machine and any cgroup (container) it runs in"
+
+    def __init__(self, memory: int, cpus: float):
+        self.memory = memory
+        self.cpus = cpus
+
+    def __repr__(self) -> str:
+        return f"HostResources({self.memory / GiB:.1f} GiB, {self.cpus:g} CPUs)"
+
+    memory: int  # bytes
+    cpus: float
+
+    @classmethod
+    def detect(cls, proc: Path = Path("/proc"), sysfs: Path = Path("/sys")) -> HostResources:
+        "Read the limits from where procfs and sysfs are mounted"
+        memory = cls._meminfo_total(proc)
+        cpus = float(len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else os.cpu_count() or 1)
+        for folder in _cgroups(proc, sysfs / "fs" / "cgroup"):
+            # v2: memory.max and cpu.max ("max" when unlimited)
+            limit = _read(folder / "memory.max")
+            if limit is None:
+                # v1: an unlimited limit is a huge number, beyond the machine's memory
+                limit = _read(folder / "memory.limit_in_bytes")
+            if limit is not None and limit.isdigit():
+                memory = min(memory, int(limit))
+
+            quota = _read(folder / "cpu.max")
+            if quota is not None:
+                q, _, period = quota.partition(" ")
+            else:
+                q, period = _read(folder / "cpu.cfs_quota_us") or "", _read(folder / "cpu.cfs_period_us") or ""
+            if q.isdigit() and period.isdigit() and int(period) > 0:
+                cpus = min(cpus, max(int(q) / int(period), 1))
+        return cls(memory, cpus)
+
+    @staticmethod
+    def _meminfo_total(proc: Path = Path("/proc")) -> int:
+        for line in (_read(proc / "meminfo") or "").splitlines():
+            if line.startswith("MemTotal:"):
+                return int(line.split()[1]) * 1024
+        return 4 * GiB  # not Linux; only used when the memory is to be detected
+
+
+def auto_heap(host: HostResources) -> int:
+    """Heap size in bytes for a server which has `host` to itself
+
+    The JVM needs memory beyond the heap (metaspace, thread stacks, direct buffers for
+    networking, the JIT) and so does the OS, more so with more memory; a fifth of it,
+    between 1 GiB and 4 GiB, is left for those. The heap is at least 512 MiB, but on a
+    smaller host no more than three quarters of its memory, as a heap reaching the limit
+    of a container gets the server killed as soon as it is touched (AlwaysPreTouch)."""
+    reserve = min(max(host.memory // 5, GiB), 4 * GiB)
+    heap = max(host.memory - reserve, min(512 * MiB, host.memory * 3 // 4))
+    return heap // MiB * MiB
+
+
+def g1_region_size(heap: int) -> int:
+    "G1 region size for `heap` bytes: about 2048 regions, as a power of two between 4 and 32 MiB"
+    region = 4 * MiB
+    while region < 32 * MiB and heap // (region * 2) >= 2048:
+        region *= 2
+    return region
+
+
+def gc_threads(cpus: float) -> tuple[int, int]:
+    "Parallel (stop the world) and concurrent GC threads for `cpus`, as the JVM would pick outside a container"
+    n = max(int(cpus), 1)
+    parallel = n if n <= 8 else 8 + (n - 8) * 5 // 8
+    return parallel, max((parallel + 2) // 4, 1)
+
+
+def get_aikar_flags(heap: int | None = None) -> Sequence[str]:
+    """Aikar's G1 flags, tuned for a `heap` of that many bytes if it is given
+
+    Above 12 GiB the young generation is made larger and the reserve smaller, as Aikar
+    advises, and the region size grows with the heap instead of being fixed at 8M."""
+    large = heap is not None and heap >= 12 * GiB
+    region = "8M" if heap is None else f"{g1_region_size(heap) // MiB}M"
     return [
         "-XX:+UseG1GC",
         "-XX:+ParallelRefProcEnabled",
@@ -21,13 +146,13 @@ def get_aikar_flags() -> Sequence[str]:
         "-XX:+UnlockExperimentalVMOptions",
         "-XX:+DisableExplicitGC",
         "-XX:+AlwaysPreTouch",
-        "-XX:G1NewSizePercent=30",
-        "-XX:G1MaxNewSizePercent=40",
-        "-XX:G1HeapRegionSize=8M",
-        "-XX:G1ReservePercent=20",
+        f"-XX:G1NewSizePercent={40 if large else 30}",
+        f"-XX:G1MaxNewSizePercent={50 if large else 40}",
+        f"-XX:G1HeapRegionSize={region}",
+        f"-XX:G1ReservePercent={15 if large else 20}",
         "-XX:G1HeapWastePercent=5",
         "-XX:G1MixedGCCountTarget=4",
-        "-XX:InitiatingHeapOccupancyPercent=15",
+        f"-XX:InitiatingHeapOccupancyPercent={20 if large else 15}",
         "-XX:G1MixedGCLiveThresholdPercent=90",
         "-XX:G1RSetUpdatingPauseTimePercent=5",
         "-XX:SurvivorRatio=32",
@@ -38,16 +163,65 @@ def get_aikar_flags() -> Sequence[str]:
     ]
 
 
+def get_zgc_flags(heap: int | None = None) -> Sequence[str]:
+    "Flags for ZGC, whose pauses stay short however large the heap"
+    flags = [
+        "-XX:+UseZGC",
+        "-XX:+DisableExplicitGC",
+        "-XX:+AlwaysPreTouch",
+        "-XX:+PerfDisableSharedMem",
+    ]
+    if heap is not None:
+        # collect before the heap fills, so that allocation does not stall waiting for the collector
+        flags.append(f"-XX:SoftMaxHeapSize={heap * 9 // 10 // MiB}M")
+    return flags
+
+
+def get_shenandoah_flags(heap: int | None = None) -> Sequence[str]:
+    "Flags for Shenandoah, a concurrent collector available in most OpenJDK builds (but not Oracle's)"
+    return [
+        "-XX:+UseShenandoahGC",
+        "-XX:+DisableExplicitGC",
+        "-XX:+AlwaysPreTouch",
+        "-XX:+PerfDisableSharedMem",
+    ]
+
+
+GC_FLAGS = {"g1": get_aikar_flags, "zgc": get_zgc_flags, "shenandoah": get_shenandoah_flags}
+
+
 def get_flags(
     memory: str | None | Literal[False],
     init_memory: str | None | Literal[False] = False,
     include_aikar: bool = True,
+    gc: str = "g1",
+    host: HostResources | None = None,
 ) -> Sequence[str]:
+    """JVM flags for the heap size and the garbage collector
+
+    With `memory` "auto", the heap is sized from the memory of the host (or of the
+    container the server runs in, see `HostResources.detect`), and the GC threads are
+    sized for it. `include_aikar` adds the flags of the `gc` profile, tuned for the heap
+    (whether sized automatically or given)."""
     args: list[str] = []
 
+    heap = None
+    threads: list[str] = []
+    if memory == AUTO:
+        host = host or HostResources.detect()
+        heap = auto_heap(host)
+        memory = f"{heap // MiB}M"
+        if init_memory is False:
+            # the whole heap is touched at startup anyway (AlwaysPreTouch)
+            init_memory = None
+        parallel, concurrent = gc_threads(host.cpus)
+        threads = [f"-XX:ParallelGCThreads={parallel}", f"-XX:ConcGCThreads={concurrent}"]
+
     if memory is not None and memory is not False:
         memory = check_memory_flag(memory)
         args.append("-Xmx" + memory)
+        if heap is None:
+            heap = parse_size(memory)
         if init_memory is None:
             init_memory = memory
 
@@ -56,7 +230,8 @@ def get_flags(
         args.append("-Xms" + init_memory)
 
     if include_aikar:
-        args.extend(get_aikar_flags())
+        args.extend(GC_FLAGS[check_gc(gc)](heap))
+    args.extend(threads)
 
     return args
 
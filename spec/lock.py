@@ -0,0 +1,147 @@
+from __future__ import annotations
+
+from datetime import datetime, timezone
+import json
+from pathlib import Path
+from typing import TYPE_CHECKING, Any, Mapping, Sequence
+from urllib.parse import urlsplit
+from .http import ChecksumError, HttpSessions, download_to_store_async, get_default_sessions
+from .jars import BaseJar
+from .jars.base import JarInfo
+from .store import hash_file
+from .storeindex import encode_key
+
+if TYPE_CHECKING:
+    from .main.pipeline import FetchResult
+    from .store import BaseStore
+
+
+LOCK_VERSION = 1
+
+
+def default_lockfile(specification: str | Path) -> Path:
+    "The lockfile beside a specification file: `server.yml` is locked by `server.lock`"
+    return Path(specification).with_suffix(".lock")
+
+
+def _file_path(url: str) -> Path | None:
+    parts = urlsplit(url)
+    if parts.scheme != "file":
+        return None
+    from urllib.request import url2pathname  # imports ssl, so only when needed
+    return Path(url2pathname(parts.path))
+
+
+class LockedJar(BaseJar):
+    "The files a jar was resolved to when the lockfile was written, fetched without resolving it again"
+
+    def __init__(self, label: str, files: Sequence[Mapping[str, Any]]):
+        self.label = label
+        self.files = [dict(f) for f in files]
+
+    label: str
+    files: list[dict[str, Any]]
+
+    def __str__(self) -> str:
+        return self.label
+
+    async def _fetch_file(self, store: BaseStore, file: Mapping[str, Any], dry: bool, http: HttpSessions | None) -> JarInfo:
+        import asyncio
+        key = file["storekey"]
+        digests = file.get("digests", {})
+        info = dict(url=file["url"], name=file["name"], build_time=file.get("build_time"))
+        ji = JarInfo(
+            storekey=key,
+            path=store.get_name(key),
+            name=file["name"],
+            url=file["url"],
+            build=file.get("build"),
+            build_time=file.get("build_time"),
+            digests=digests,
+        )
+        if dry:
+            return ji
+
+        found = await asyncio.to_thread(store.lookup, key, digests, **info)
+        if found is not None:
+            ji.path = found
+            return ji
+
+        local = _file_path(file["url"])
+        if local is not None:
+            # checked before storing, so that a changed file does not replace what the key holds
+            actual = await asyncio.to_thread(hash_file, local, {"sha256", *digests})
+            for algorithm, digest in digests.items():
+                if actual[algorithm] != digest.lower():
+                    raise ChecksumError(f"{local} has changed since it was locked ({algorithm} {actual[algorithm]}, locked {digest})")
+            ji.path = await asyncio.to_thread(store.put_file, key, local)
+            return ji
+
+        client = (http or get_default_sessions()).client()
+        ji.path, ji.digests = await download_to_store_async(
+            client, store, key, file["url"], digests, name=file["name"], build_time=file.get("build_time"))
+        return ji
+
+    async def fetch_async(self, store: BaseStore, dry: bool = False, http: HttpSessions | None = None) -> list[JarInfo]:
+        import asyncio
+        return list(await asyncio.gather(*(self._fetch_file(store, f, dry, http) for f in self.files)))
+
+
+def lock_file_entry(ji: JarInfo, store: BaseStore) -> dict[str, Any]:
+    if ji.url is None:
+        raise ValueError(f"Cannot lock {ji.name}: its source did not say where it came from")
+    return {
+        "name": ji.name,
+        "url": ji.url,
+        "build": ji.build,
+        "build_time": ji.build_time,
+        "storekey": json.loads(encode_key(ji.storekey)),  # encodes to the same key when read back
+        "digests": {**ji.digests, **store.get_digests(ji.storekey)},
+    }
+
+
+def write_lock(path: Path, results: Sequence[FetchResult], store: BaseStore):
+    "Write the jars that `results` resolved to as a lockfile"
+    lock = {
+        "version": LOCK_VERSION,
+        "created": datetime.now(timezone.utc).isoformat(),
+        "jars": [
+            {
+                "folder": res.task.folder.name,
+                "source": res.task.label,
+                "files": [lock_file_entry(ji, store) for ji in res.infos],
+            }
+            for res in results
+        ],
+    }
+    tmp = path.with_name(f".{path.name}.tmp")
+    try:
+        with open(tmp, "w") as f:
+            json.dump(lock, f, indent=2)
+            f.write("\n")
+        tmp.replace(path)
+    except BaseException:
+        tmp.unlink(missing_ok=True)
+        raise
+
+
+def read_lock(path: Path) -> list[tuple[str, LockedJar]]:
+    "Read a lockfile as the folder (`server` or `plugins`) and locked jar of each entry, server first"
+    try:
+        with open(path) as f:
+            lock = json.load(f)
+    except FileNotFoundError:
+        raise ValueError(f"No lockfile at {path}; create one with --lock")
+    if lock.get("version") != LOCK_VERSION:
+        raise ValueError(f"Unsupported lockfile version {lock.get('version')!r} in {path}")
+    jars = [(j["folder"], LockedJar(j["source"], j["files"])) for j in lock["jars"]]
+    if not jars or jars[0][0] != "server":
+        raise ValueError(f"Lockfile {path} does not start with the server jar")
+    return jars
+
+
+def locked_digests(path: Path) -> list[str]:
+    "The sha256 of every jar pinned in a lockfile, if there is one"
+    if not path.exists():
+        return []
+    return [f["digests"]["sha256"] for _, jar in read_lock(path) for f in jar.files if "sha256" in f.get("digests", {})]
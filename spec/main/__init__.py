@@ -1,76 +1,347 @@
 from __future__ import annotations
 
 import argparse
+from datetime import datetime
 from enum import Enum
 from pathlib import Path
-from shutil import copy2
 import sys
 from typing import Any, Sequence, TextIO
 
 from .parser import DownloadAction, parse_args
-from .. import jars  # noqa: F401
-from ..spec import Specification
-
-
-def copy_file(src: Path, dest: Path):
-    return copy2(src, dest)
+from .pipeline import FetchResult, FetchTask, fetch_all
+from .. import trace
+from ..deploy import DeployMode, is_current, place, stale_files
+from ..generations import Generation, GenerationStore, activate, same_jars
+from ..lock import default_lockfile, locked_digests, read_lock, write_lock
+from ..spec import Network, Specification
 
 
 def copy_dry(src: Path, dest: Path):
     print(f"Copying {src} to {dest}")
 
 
-def clear_dir(dir: Path):
-    for f in dir.glob("*.jar"):
-        f.unlink()
-        print(f"Deleted old {f}")
+def deploy_dry(results: Sequence[FetchResult], spec: Specification, mode: DeployMode):
+    "Show which files a deploy of `results` would change"
+    targets = {"server": spec.folders.server, "plugins": spec.folders.plugins}
+    keep: dict[Path, set[str]] = {t: set() for t in targets.values()}
+    for res in results:
+        for src, dest in res.copies:
+            dest = targets[res.task.folder.name] / dest.name
+            if not is_current(src, dest, mode):
+                copy_dry(src, dest)
+            keep[dest.parent].add(dest.name)
+    for folder, names in keep.items():
+        for f in stale_files(folder, names):
+            print(f"Deleting old {f}")
+
+
+def fetch_tasks(spec: Specification, folder: Path, args: Any) -> list[FetchTask]:
+    """The server and all plugins, to be placed in `folder`/server and `folder`/plugins
+
+    With `--locked`, these are the jars pinned in the lockfile rather than those of the specification.
+    Raises ValueError if the lockfile cannot be read."""
+    if args.locked:
+        return [FetchTask(jar.label, jar, folder / name) for name, jar in read_lock(args.lockfile)]
+    tasks = [FetchTask(f"server {spec.server}", spec.server, folder / "server")]
+    tasks.extend(FetchTask(f"plugin {pl}", pl, folder / "plugins") for pl in spec.plugins)
+    return tasks
+
+
+def place_jar(src: Path, dest: Path):
+    # generations are always built from links into the store
+    place(src, dest, DeployMode.Hardlink)
+
+
+def fetch_jars(spec: Specification, folder: Path, args: Any, place_jars: bool, dry: bool) -> list[FetchResult]:
+    """Fetch the server and all plugins, placing them in `folder`/server and `folder`/plugins
+
+    Exits if any jar cannot be fetched."""
+    try:
+        tasks = fetch_tasks(spec, folder, args)
+    except ValueError as e:
+        sys.exit(str(e))
+
+    # a dry fetch (also that of --gc) only resolves the jars
+    verb, action, done = ("Resolving", "resolve", "Resolved") if dry else ("Downloading", "download", "Downloaded")
+    print(f"{verb} {len(tasks)} jars with up to {args.jobs} jobs")
+    with trace.span("fetch", "phase", jars=len(tasks)):
+        results = fetch_all(
+            tasks, spec.store, dry=dry, jobs=args.jobs,
+            place=place_jar if place_jars else None,
+            http=spec.http,
+        )
+
+    failed = False
+    for res in results:
+        if not res.ok:
+            failed = True
+            print(f"Failed to {action} {res.task.label}: {res.error}", file=sys.stderr)
+            print(res.trace, file=sys.stderr)
+            continue
+        print(f"{done} {res.task.label}")
+    if failed:
+        # leave the live generation in place rather than deploying a partial set
+        sys.exit(1)
+    if not results[0].copies:
+        sys.exit(f"No jar found for server {spec.server}")
+    return results
+
+
+def generation_jars(spec: Specification, results: Sequence[FetchResult]) -> list[dict[str, Any]]:
+    "Manifest entries of the fetched jars"
+    return [
+        {
+            "folder": res.task.folder.name,
+            "name": ji.name,
+            "sha256": spec.store.get_digests(ji.storekey).get("sha256"),
+            "source": res.task.label,
+        }
+        for res in results for ji in res.infos
+    ]
+
+
+@trace.traced("build generation", "phase")
+def build_generation(
+    spec: Specification,
+    generations: GenerationStore,
+    staging: Path,
+    results: Sequence[FetchResult],
+    out: TextIO | None = None,
+) -> Generation:
+    "Commit the staged jars as a new generation, or reuse the current one if nothing changed; messages go to `out` (stdout)"
+    jars = generation_jars(spec, results)
+    current = generations.current()
+    if current is not None and same_jars(current, jars):
+        generations.discard(staging)
+        print(f"Jars are unchanged from generation {current.id}", file=out)
+        return current
+
+    gen = generations.commit(staging, server=results[0].infos[-1].name, jars=jars)
+    print(f"Created generation {gen.id}", file=out)
+    return gen
+
+
+@trace.traced("deploy", "phase")
+def make_live(spec: Specification, generations: GenerationStore, gen: Generation, mode: DeployMode, out: TextIO | None = None):
+    # the folders first: if syncing them fails partway, `current` still names what they were synced from last
+    changed, removed = activate(gen, spec.folders, mode)
+    generations.switch(gen)
+    for f in changed:
+        print(f"Updated {f}", file=out)
+    for f in removed:
+        print(f"Deleted old {f}", file=out)
+    print(f"Generation {gen.id} is live", file=out)
+
+    for old in generations.cleanup(spec.folders.keep_generations):
+        print(f"Removed old generation {old.id}", file=out)
+
+
+@trace.traced("collect garbage", "phase")
+def collect_garbage(
+    spec: Specification | Network,
+    generations: GenerationStore | Sequence[GenerationStore],
+    results: Sequence[FetchResult],
+    lockfile: Path | None,
+    dry: bool = False,
+):
+    "Evict unused jars from the store, keeping every jar in `results`, in a generation (of any of `generations`) or in the lockfile"
+    if isinstance(generations, GenerationStore):
+        generations = [generations]
+    paths = [ji.path for res in results for ji in res.infos]
+    digests = [j["sha256"] for gs in generations for g in gs.list() for j in g.jars if j.get("sha256")]
+    if lockfile is not None:
+        digests.extend(locked_digests(lockfile))
+    gc = spec.store.collect_garbage(protect_paths=paths, protect_digests=digests, dry=dry)
+    verb = "Would remove" if dry else "Removed"
+    for path in gc.removed:
+        print(f"{verb} {path}")
+    print(f"{verb} {len(gc.removed)} store files, freeing {gc.freed} bytes ({gc.kept} bytes remain)")
+
+
+def format_size(size: int | None) -> str:
+    if size is None:
+        return "-"
+    for unit in ("B", "KiB", "MiB"):
+        if size < 1024:
+            return f"{size:.0f} {unit}"
+        size /= 1024
+    return f"{size:.1f} GiB"
+
 
+def list_store(spec: Specification | Network, *generations: GenerationStore):
+    "Print every jar in the store, marking those in a live generation with *"
+    live = set()
+    for gs in generations:
+        current = gs.current()
+        if current is not None:
+            live.update(j.get("sha256") for j in current.jars)
 
-def clear_dry(dir: Path):
-    print(f"Clearing {dir}/*.jar")
+    def date(t: float | None) -> str:
+        return datetime.fromtimestamp(t).strftime("%Y-%m-%d %H:%M") if t else "-"
+
+    for e in spec.store.entries():
+        mark = "*" if e.sha256 in live else " "
+        print(f"{mark} {e.source or '-':<16} {e.name or '-':<40} {format_size(e.size):>10}"
+              f"  built {date(e.build_time)}  used {date(e.last_used)}")
+
+
+def write_trace(tracer: trace.Tracer, path: Path):
+    try:
+        tracer.write(path)
+    except OSError as e:
+        print(f"Cannot write trace to {path}: {e}", file=sys.stderr)
+    else:
+        print(f"Wrote trace to {path}")
+    print(tracer.summary())
 
 
 def main(argv: Sequence[str] | None = None):
     args = parse_args(argv)
 
-    with args.specification as f:
-        spec = Specification.from_yaml(f)
+    # the trace covers everything up to running the server, which may not return for weeks
+    tracer = trace.enable() if args.trace is not None else None
+    try:
+        spec = load_specification(args)
+        if isinstance(spec, Network):
+            from .network import prepare_network, run_network  # only needed for networks
+            servers = prepare_network(spec, args)
+        else:
+            serverdest = prepare(spec, args)
+    finally:
+        if tracer is not None:
+            trace.disable()
+            write_trace(tracer, args.trace)
 
-    DRY = args.dry
+    if isinstance(spec, Network):
+        if args.run:
+            run_network(servers, dry=args.dry)
+        return
 
-    serverdest = None
-    if args.download:
-        copy = copy_dry if DRY else copy_file
-        clear = clear_dry if DRY else clear_dir
+    if args.watch:
+        from .watch import Watcher  # only needed when watching
+        Watcher(
+            spec, args, args.deploy_mode or spec.folders.mode,
+            report=args.report or spec.folders.generations / "pending.json",
+            interval=args.interval * 60, max_interval=args.max_interval * 60, windows=args.windows,
+        ).run()
 
-        copyops: list[tuple[Path, Path]] = []
-
-        print(f"Downloading server {spec.server}")
-        for ji in spec.server.fetch(spec.store, dry=DRY):
-            serverdest = spec.folders.server / ji.name
-            copyops.append((ji.path, serverdest))
+    elif args.supervise and not args.dry:
         assert serverdest is not None
+        from .supervisor import Supervisor  # only needed when supervising
+        supervisor = Supervisor(
+            spec, args, args.deploy_mode or spec.folders.mode,
+            prefetch=args.prefetch * 60, update_at=args.update_at, stop_timeout=args.stop_timeout,
+        )
+        code = supervisor.run(serverdest)
+        if code:
+            sys.exit(code)
 
-        for pl in spec.plugins:
-            print(f"Downloading plugin {pl}")
-            for ji in pl.fetch(spec.store, dry=DRY):
-                copyops.append((ji.path, spec.folders.plugins / ji.name))
-
-        if args.download != DownloadAction.DownloadOnly:
-            if not DRY:
-                spec.folders.server.mkdir(parents=True, exist_ok=True)
-                spec.folders.plugins.mkdir(parents=True, exist_ok=True)
-            clear(spec.folders.server)
-            clear(spec.folders.plugins)
-            print("Copying files to destination")
-            for src, dest in copyops:
-                copy(src, dest)
-
-    if args.run:
+    elif args.run or args.supervise:
         assert serverdest is not None
         print(f"Running server {serverdest}")
 
         sys.stdout.flush()  # ready to pass over to subprocess
         sys.stderr.flush()
 
-        spec.server.run(serverdest, cwd=spec.folders.server, dry=DRY)
+        console = spec.console.open(spec.folders.server) if spec.console is not None and not args.dry else None
+        try:
+            spec.server.run(serverdest, cwd=spec.folders.server, dry=args.dry, store=spec.store, console=console)
+        finally:
+            if console is not None:
+                console.close()
+
+
+@trace.traced("load specification", "phase")
+def load_specification(args: Any) -> Specification | Network:
+    with args.specification as f:
+        if f is sys.stdin:
+            return Specification.from_yaml(f)
+        return Specification.from_file(f.name, use_cache=not args.force)
+
+
+def prepare(spec: Specification, args: Any) -> Path | None:
+    "Do everything asked for except running the server, returning the server jar to run"
+    DRY = args.dry
+    if args.lockfile is None:
+        args.lockfile = default_lockfile(args.specification.name)
+    if args.lock and args.locked:
+        sys.exit("--locked cannot be used with --lock")
+    if args.watch and (args.locked or args.run or args.supervise or args.dry):
+        sys.exit("--watch cannot be used with --locked, --run, --supervise or --dry")
+    mode = args.deploy_mode or spec.folders.mode
+    generations = GenerationStore(spec.folders.generations)
+
+    if args.list:
+        list_store(spec, generations)
+
+    serverdest = None
+    if args.download:
+        deploy = args.download != DownloadAction.DownloadOnly
+
+        if not deploy or DRY:
+            results = fetch_jars(spec, Path(), args, place_jars=False, dry=DRY)
+            if deploy:
+                print("Would create a new generation from:")
+                deploy_dry(results, spec, mode)
+            serverdest = spec.folders.server / results[0].infos[-1].name
+        else:
+            staging = generations.stage()
+            try:
+                results = fetch_jars(spec, staging, args, place_jars=True, dry=False)
+                gen = build_generation(spec, generations, staging, results)
+            except BaseException:
+                generations.discard(staging)
+                raise
+            make_live(spec, generations, gen, mode)
+            serverdest = spec.folders.server / gen.server
+
+        if spec.store.auto_gc and not DRY:
+            collect_garbage(spec, generations, results, args.lockfile)
+
+    elif args.gc:
+        # the jars the specification currently resolves to must be kept, so resolve it without downloading
+        results = fetch_jars(spec, Path(), args, place_jars=False, dry=True)
+        collect_garbage(spec, generations, results, args.lockfile, dry=DRY)
+
+    elif args.lock:
+        results = fetch_jars(spec, Path(), args, place_jars=False, dry=DRY)
+        for res in results:
+            for ji in res.infos:
+                build = f" (build {ji.build})" if ji.build is not None else ""
+                print(f"Locking {res.task.folder.name}/{ji.name}{build}")
+        if DRY:
+            print(f"Would write {args.lockfile}")
+        else:
+            write_lock(args.lockfile, results, spec.store)
+            print(f"Wrote {args.lockfile}")
+        serverdest = spec.folders.server / results[0].infos[-1].name
+
+    elif args.rollback:
+        current = generations.current()
+        if args.generation is None:
+            target = generations.previous(current)
+            if target is None:
+                sys.exit("No previous generation to roll back to")
+        else:
+            try:
+                target = generations.get(args.generation)
+            except ValueError as e:
+                sys.exit(str(e))
+        print(f"Rolling back from generation {current.id if current else None} to {target.id}")
+        if DRY:
+            for jar in target.jars:
+                print(f"Would deploy {jar['folder']}/{jar['name']}")
+        else:
+            make_live(spec, generations, target, mode)
+        serverdest = spec.folders.server / target.server
+
+    elif args.run or args.supervise:
+        # start from the last deployed generation, without resolving anything
+        current = generations.current()
+        if current is None:
+            sys.exit(f"No deployed generation in {generations.directory}; run with --dl first")
+        serverdest = spec.folders.server / current.server
+        if not serverdest.exists() and not DRY:
+            make_live(spec, generations, current, mode)
+
+    return serverdest
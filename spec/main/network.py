@@ -0,0 +1,283 @@
+from __future__ import annotations
+
+from concurrent.futures import ThreadPoolExecutor
+import io
+from pathlib import Path
+import subprocess
+import sys
+import threading
+from typing import Any, Mapping, TextIO, cast
+
+from . import build_generation, collect_garbage, deploy_dry, fetch_tasks, list_store, make_live, place_jar
+from .parser import DownloadAction
+from .pipeline import FetchResult, fetch_all, jar_identity
+from .. import trace
+from ..generations import GenerationStore
+from ..spec import Network, Specification
+
+
+UNSUPPORTED = {
+    "lock": "--lock", "locked": "--locked", "rollback": "--rollback", "supervise": "--supervise", "watch": "--watch",
+}
+
+
+class _MemberOutput(io.TextIOBase):
+    """Text stream which starts each line with a member's name, shared by all members through `lock`
+
+    Only whole lines are written (until flushed), so that members' lines are not mixed up."""
+
+    def __init__(self, name: str, out: TextIO, lock: threading.Lock):
+        self.prefix = f"[{name}] "
+        self.out = out
+        self.lock = lock
+        self.partial = ""
+        self.fresh = True
+
+    prefix: str
+    out: TextIO
+    lock: threading.Lock
+    partial: str  # the start of a line not written yet
+    fresh: bool  # whether the next text written starts a line
+
+    def write(self, text: str) -> int:
+        lines = (self.partial + text).splitlines(keepends=True)
+        self.partial = lines.pop() if lines and not lines[-1].endswith("\n") else ""
+        if lines:
+            self._write(lines)
+        return len(text)
+
+    def _write(self, lines: list[str]):
+        parts = []
+        for line in lines:
+            if self.fresh:
+                parts.append(self.prefix)
+            parts.append(line)
+            self.fresh = line.endswith("\n")
+        with self.lock:
+            self.out.write("".join(parts))
+
+    def flush(self):
+        if self.partial:
+            self._write([self.partial])
+            self.partial = ""
+        with self.lock:
+            self.out.flush()
+
+
+def for_each_member(members: Mapping[str, Specification], func: Any) -> dict[str, Any]:
+    """Call `func(name, member, out)` for every member at once, returning the results by name
+
+    `out` is the member's own stdout, which prefixes its lines with the member's name."""
+    lock = threading.Lock()
+
+    def call(name: str) -> Any:
+        out = _MemberOutput(name, sys.stdout, lock)
+        try:
+            with trace.lane(name):
+                return func(name, members[name], cast(TextIO, out))
+        finally:
+            out.flush()
+
+    with ThreadPoolExecutor(max_workers=max(len(members), 1)) as executor:
+        return dict(zip(members, executor.map(call, members)))
+
+
+def fetch_network(network: Network, folders: Mapping[str, Path], args: Any, place_jars: bool, dry: bool) -> dict[str, list[FetchResult]]:
+    """Fetch the jars of every member in one pass, placing them in the member's folder in `folders`
+
+    A jar used by several members is only resolved and downloaded once. Exits if any jar cannot be fetched."""
+    tasks = []
+    ranges = {}
+    for name, member in network.members.items():
+        member_tasks = fetch_tasks(member, folders[name], args)
+        for task in member_tasks:
+            task.label = f"{name}: {task.label}"
+        ranges[name] = (len(tasks), len(tasks) + len(member_tasks))
+        tasks.extend(member_tasks)
+
+    unique = len({jar_identity(task.jar) for task in tasks})
+    # a dry fetch (also that of --gc) only resolves the jars
+    verb, action, done = ("Resolving", "resolve", "Resolved") if dry else ("Downloading", "download", "Downloaded")
+    print(f"{verb} {unique} jars for {len(network.members)} servers with up to {args.jobs} jobs")
+    with trace.span("fetch", "phase", jars=unique):
+        results = fetch_all(
+            tasks, network.store, dry=dry, jobs=args.jobs,
+            place=place_jar if place_jars else None,
+            http=network.http,
+        )
+
+    failed = False
+    for res in results:
+        if not res.ok:
+            failed = True
+            print(f"Failed to {action} {res.task.label}: {res.error}", file=sys.stderr)
+            print(res.trace, file=sys.stderr)
+            continue
+        print(f"{done} {res.task.label}")
+    if failed:
+        # leave every live generation in place rather than deploying a partial network
+        sys.exit(1)
+
+    by_member = {name: results[a:b] for name, (a, b) in ranges.items()}
+    for name, member_results in by_member.items():
+        if not member_results[0].copies:
+            sys.exit(f"No jar found for server {network.members[name].server} of {name}")
+    return by_member
+
+
+def prepare_network(network: Network, args: Any) -> dict[str, tuple[Specification, Path]]:
+    "Do everything asked for except running the servers, returning each member and its server jar to run"
+    for attr, flag in UNSUPPORTED.items():
+        if getattr(args, attr):
+            sys.exit(f"{flag} cannot be used with a network")
+    DRY = args.dry
+    members = network.members
+    generations = {name: GenerationStore(m.folders.generations) for name, m in members.items()}
+
+    def mode(member: Specification):
+        return args.deploy_mode or member.folders.mode
+
+    if args.list:
+        list_store(network, *generations.values())
+
+    servers: dict[str, tuple[Specification, Path]] = {}
+    if args.download:
+        deploy = args.download != DownloadAction.DownloadOnly
+
+        if not deploy or DRY:
+            results = fetch_network(network, {name: Path() for name in members}, args, place_jars=False, dry=DRY)
+            for name, member in members.items():
+                if deploy:
+                    print(f"Would create a new generation of {name} from:")
+                    deploy_dry(results[name], member, mode(member))
+                servers[name] = (member, member.folders.server / results[name][0].infos[-1].name)
+        else:
+            staging = {name: gs.stage() for name, gs in generations.items()}
+            try:
+                results = fetch_network(network, staging, args, place_jars=True, dry=False)
+
+                def deploy_member(name: str, member: Specification, out: TextIO) -> Path:
+                    gen = build_generation(member, generations[name], staging[name], results[name], out=out)
+                    make_live(member, generations[name], gen, mode(member), out=out)
+                    return member.folders.server / gen.server
+
+                with trace.span("deploy network", "phase"):
+                    for name, serverdest in for_each_member(members, deploy_member).items():
+                        servers[name] = (members[name], serverdest)
+            except BaseException:
+                for name, path in staging.items():
+                    generations[name].discard(path)
+                raise
+
+        if network.store.auto_gc and not DRY:
+            collect_garbage(network, list(generations.values()), [r for rs in results.values() for r in rs], None)
+
+    elif args.gc:
+        results = fetch_network(network, {name: Path() for name in members}, args, place_jars=False, dry=True)
+        collect_garbage(network, list(generations.values()), [r for rs in results.values() for r in rs], None, dry=DRY)
+
+    elif args.run:
+        # start each member from its last deployed generation, without resolving anything
+        for name, member in members.items():
+            current = generations[name].current()
+            if current is None:
+                sys.exit(f"No deployed generation of {name} in {generations[name].directory}; run with --dl first")
+            serverdest = member.folders.server / current.server
+            if not serverdest.exists() and not DRY:
+                make_live(member, generations[name], current, mode(member))
+            servers[name] = (member, serverdest)
+
+    return servers
+
+
+def run_network(servers: Mapping[str, tuple[Specification, Path]], dry: bool = False):
+    """Run every member's server at once, until they have all stopped
+
+    Their output is prefixed with the member's name. A console line `NAME: COMMAND` is
+    sent to that member, and `*: COMMAND` to all of them."""
+    if dry:
+        for name, (member, serverdest) in servers.items():
+            print(f"[{name}]", end=" ")
+            member.server.run(serverdest, cwd=member.folders.server, dry=True)
+        return
+
+    processes: dict[str, subprocess.Popen[bytes]] = {}
+    consoles = {
+        name: member.console.open(member.folders.server, prefix=f"[{name}] ")
+        for name, (member, _) in servers.items() if member.console is not None
+    }
+    lock = threading.Lock()
+
+    def send(name: str, line: str):
+        p = processes[name]
+        assert p.stdin is not None
+        with lock:
+            try:
+                p.stdin.write(line.encode() + b"\n")
+                p.stdin.flush()
+            except (BrokenPipeError, ValueError):
+                pass  # already stopped
+
+    def echo(name: str, p: subprocess.Popen[bytes]):
+        assert p.stdout is not None
+        for raw in p.stdout:
+            line = raw.decode(errors="replace").rstrip("\r\n")
+            with lock:
+                print(f"[{name}] {line}", flush=True)
+
+    def read_console():
+        for line in sys.stdin:
+            target, sep, command = line.partition(":")
+            target = target.strip()
+            if sep and (target == "*" or target in processes):
+                for name in processes if target == "*" else [target]:
+                    send(name, command.strip())
+            else:
+                print(f"Start commands with the server to send them to, or * for all: {', '.join(processes)}")
+
+    def launch(name: str, member: Specification, out: TextIO):
+        # a launch may first patch the server, so they run at once
+        serverdest = servers[name][1]
+        print(f"Running server {serverdest}", file=out, flush=True)
+        p = member.server.start(
+            serverdest, cwd=member.folders.server, store=member.store,
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+        )
+        with lock:
+            processes[name] = p
+        # read from the start, so that a server stopped below cannot block on a full pipe
+        if name in consoles:
+            assert p.stdout is not None
+            consoles[name].attach(p.stdout)
+        else:
+            threading.Thread(target=echo, args=(name, p), name=f"echo {name}", daemon=True).start()
+
+    try:
+        for_each_member({name: member for name, (member, _) in servers.items()}, launch)
+    except BaseException:
+        # stop the servers which did start, rather than leave them running unattended
+        if processes:
+            print(f"Stopping {', '.join(processes)}", file=sys.stderr)
+        for name in list(processes):
+            send(name, servers[name][0].server.stop_command)
+        for p in processes.values():
+            p.wait()
+        for console in consoles.values():
+            console.close()
+        raise
+    threading.Thread(target=read_console, name="console", daemon=True).start()
+
+    try:
+        for p in processes.values():
+            p.wait()
+    except KeyboardInterrupt:
+        print("Stopping servers")
+        for name, (member, _) in servers.items():
+            send(name, member.server.stop_command)
+        for p in processes.values():
+            p.wait()
+    for console in consoles.values():
+        console.close()
+    codes = {name: p.returncode for name, p in processes.items() if p.returncode}
+    if codes:
+        sys.exit("Servers exited with errors: " + ", ".join(f"{name} ({code})" for name, code in codes.items()))
@@ -1,9 +1,14 @@
 from __future__ import annotations
 
 import argparse
+from datetime import datetime, time
 from enum import Enum
+from pathlib import Path
 from typing import Sequence, TextIO
 
+from .pipeline import DEFAULT_JOBS
+from ..deploy import DeployMode
+
 
 class BoolEnum(Enum):
     def __bool__(self):
@@ -16,11 +21,32 @@ class DownloadAction(BoolEnum):
     DownloadOnly = 2
 
 
+def positive_int(value: str) -> int:
+    i = int(value)
+    if i < 1:
+        raise argparse.ArgumentTypeError(f"must be at least 1, not {i}")
+    return i
+
+
+def clock_time(value: str) -> time:
+    try:
+        return datetime.strptime(value, "%H:%M").time()
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"must be a time of day as HH:MM, not {value!r}")
+
+
+def clock_window(value: str) -> tuple[time, time]:
+    start, sep, end = value.partition("-")
+    if not sep:
+        raise argparse.ArgumentTypeError(f"must be times of day as HH:MM-HH:MM, not {value!r}")
+    return clock_time(start.strip()), clock_time(end.strip())
+
+
 def create_parser() -> argparse.ArgumentParser:
     parser = argparse.ArgumentParser()
 
     parser.add_argument("-l", "--list", dest="list", action="store_true",
-                        help="List all plugins")
+                        help="List the jars in the store (* marks those in the live generation)")
 
     dlpars = parser.add_mutually_exclusive_group(required=True)
     dlpars.add_argument("--dl", "--download", dest="download", action="store_const", const=DownloadAction.Download,
@@ -29,10 +55,48 @@ def create_parser() -> argparse.ArgumentParser:
                         help="Download plugins, but do not copy (this will cache them)")
     dlpars.add_argument("--no-dl", "--no-download", dest="download", action="store_const", const=DownloadAction.NoDownload,
                         help="Do not download updated plugins")
+    dlpars.add_argument("--gc", dest="gc", action="store_true",
+                        help="Evict old jars from the store, keeping those used by the specification or a generation")
+    dlpars.add_argument("--rollback", dest="rollback", action="store_true",
+                        help="Make a previously deployed generation live again")
+    dlpars.add_argument("--lock", dest="lock", action="store_true",
+                        help="Resolve and download every jar, and pin them in the lockfile")
+    dlpars.add_argument("-w", "--watch", dest="watch", action="store_true",
+                        help="Keep checking every jar for updates, downloading new builds as soon as they appear "
+                             "and deploying them (inside a --window, if given)")
+
+    parser.add_argument("--locked", dest="locked", action="store_true",
+                        help="Use the jars pinned in the lockfile instead of resolving the specification")
+    parser.add_argument("--lockfile", dest="lockfile", type=Path, metavar="FILE",
+                        help="Lockfile to write or read (default: the specification file with a .lock suffix)")
+
+    parser.add_argument("--generation", dest="generation", type=int, metavar="ID",
+                        help="Generation to roll back to (default: the one before the current generation)")
 
     parser.add_argument("-r", "--run", dest="run", action="store_true",
                         help="Run the server")
 
+    parser.add_argument("-s", "--supervise", dest="supervise", action="store_true",
+                        help="Run the server and keep it running: restart it after crashes, and download updates "
+                             "while it runs, to swap in with a single restart (type !help for commands)")
+    parser.add_argument("--prefetch", dest="prefetch", type=float, default=60, metavar="MINUTES",
+                        help="While supervising, check for updates every MINUTES (default: 60; 0 to only check on !prefetch)")
+    parser.add_argument("--update-at", dest="update_at", type=clock_time, metavar="HH:MM",
+                        help="While supervising, restart into updates at this time of day (default: as soon as they are ready)")
+    parser.add_argument("--stop-timeout", dest="stop_timeout", type=float, default=120, metavar="SECONDS",
+                        help="While supervising, how long the server may take to stop before it is terminated (default: 120)")
+
+    parser.add_argument("--interval", dest="interval", type=float, default=15, metavar="MINUTES",
+                        help="While watching, check each jar every MINUTES, backing off while it is unchanged (default: 15)")
+    parser.add_argument("--max-interval", dest="max_interval", type=float, default=240, metavar="MINUTES",
+                        help="While watching, the longest to back off to (default: 240)")
+    parser.add_argument("--window", dest="windows", type=clock_window, action="append", default=[], metavar="HH:MM-HH:MM",
+                        help="While watching, only deploy updates within this time of day; may be given more than once "
+                             "(default: deploy as soon as updates are downloaded)")
+    parser.add_argument("--report", dest="report", type=Path, metavar="FILE",
+                        help="While watching, keep a JSON report of pending updates in FILE "
+                             "(default: pending.json in the generations folder)")
+
     parser.add_argument("specification", type=argparse.FileType("r"),
                         help="The server definition file")
 
@@ -40,6 +104,17 @@ def create_parser() -> argparse.ArgumentParser:
                         help="Do not download anything; just show what would happen")
     parser.add_argument("-f", "--force", dest="force", action="store_true",
                         help="Clear cache and re-download everything")
+    parser.add_argument("-j", "--jobs", dest="jobs", type=positive_int, default=DEFAULT_JOBS, metavar="N",
+                        help=f"Resolve and download up to N jars at once (default: {DEFAULT_JOBS})")
+    parser.add_argument("-m", "--deploy-mode", dest="deploy_mode", type=DeployMode,
+                        choices=list(DeployMode), metavar="{" + ",".join(m.value for m in DeployMode) + "}",
+                        help="How to place jars from the store into the server folders (default: from specification)")
+
+    parser.add_argument("--trace", dest="trace", type=Path, metavar="FILE",
+                        help="Time every phase, jar, request and store operation, writing a Chrome trace to FILE "
+                             "and printing a summary (before the server is run)")
+
+    parser.set_defaults(download=DownloadAction.NoDownload)
 
     return parser
 
@@ -47,10 +122,28 @@ def create_parser() -> argparse.ArgumentParser:
 class ArgNamespace(argparse.Namespace):
     list: bool
     download: DownloadAction
+    gc: bool
+    rollback: bool
+    lock: bool
+    watch: bool
+    locked: bool
+    lockfile: Path | None
+    generation: int | None
     run: bool
+    supervise: bool
+    prefetch: float
+    update_at: time | None
+    stop_timeout: float
+    interval: float
+    max_interval: float
+    windows: list[tuple[time, time]]
+    report: Path | None
     specification: TextIO
     dry: bool
     force: bool
+    jobs: int
+    deploy_mode: DeployMode | None
+    trace: Path | None
 
 
 def parse_args(args: Sequence[str] | None = None) -> ArgNamespace:
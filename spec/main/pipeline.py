@@ -0,0 +1,136 @@
+from __future__ import annotations
+
+from pathlib import Path
+import traceback
+from typing import TYPE_CHECKING, Any, Awaitable, Callable, Sequence
+from .. import trace
+from ..http import run_sync
+
+if TYPE_CHECKING:
+    import asyncio
+    from ..http import HttpSessions
+    from ..jars import BaseJar
+    from ..jars.base import JarInfo
+    from ..store import BaseStore
+
+
+DEFAULT_JOBS = 8
+
+
+class FetchTask:
+    "A jar to fetch, and the folder its files should be placed in"
+
+    def __init__(self, label: str, jar: BaseJar, folder: Path):
+        self.label = label
+        self.jar = jar
+        self.folder = Path(folder)
+
+    label: str
+    jar: BaseJar
+    folder: Path
+
+
+class FetchResult:
+    "The outcome of one `FetchTask`; exactly one of `infos` and `error` is meaningful"
+
+    def __init__(self, task: FetchTask):
+        self.task = task
+        self.infos = []
+        self.copies = []
+        self.error = None
+        self.trace = None
+
+    task: FetchTask
+    infos: list[JarInfo]
+    copies: list[tuple[Path, Path]]
+    error: BaseException | None
+    trace: str | None
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
+
+def jar_identity(jar: BaseJar) -> Any:
+    "Jars which resolve to the same files have the same identity, even if they were listed separately"
+    try:
+        return jar.fetch_identity()
+    except Exception:
+        return id(jar)
+
+
+async def _fetch(
+    task: FetchTask,
+    store: BaseStore,
+    dry: bool,
+    http: HttpSessions | None,
+    limit: asyncio.Semaphore,
+) -> list[JarInfo]:
+    async with limit:
+        # every jar gets its own lane in the trace, covering the threads it starts
+        with trace.lane(task.label), trace.span(task.label, "jar"):
+            return list(await task.jar.fetch_async(store, dry=dry, http=http))
+
+
+async def _run_task(
+    task: FetchTask,
+    fetch: Awaitable[list[JarInfo]],
+    place: Callable[[Path, Path], object] | None,
+) -> FetchResult:
+    import asyncio
+    result = FetchResult(task)
+    try:
+        result.infos = list(await fetch)
+        for ji in result.infos:
+            dest = task.folder / ji.name
+            if place is not None:
+                # copy as soon as this jar is ready, while other jars are still downloading
+                with trace.lane(task.label), trace.span("place", "deploy", dest=str(dest)):
+                    await asyncio.to_thread(place, ji.path, dest)
+            result.copies.append((ji.path, dest))
+    except Exception as e:
+        result.error = e
+        result.trace = traceback.format_exc()
+    return result
+
+
+async def fetch_all_async(
+    tasks: Sequence[FetchTask],
+    store: BaseStore,
+    dry: bool = False,
+    jobs: int = DEFAULT_JOBS,
+    place: Callable[[Path, Path], object] | None = None,
+    http: HttpSessions | None = None,
+) -> list[FetchResult]:
+    """Fetch every task concurrently, with at most `jobs` in progress at once
+
+    Tasks with identically configured jars (such as a plugin used by several members of
+    a network) share one fetch. If `place` is given, it is called (in a thread) with
+    `(source, destination)` for each jar as soon as it is fetched. Results are returned
+    in the order of `tasks`, regardless of the order in which they completed."""
+    import asyncio
+    if jobs < 1:
+        raise ValueError("Number of jobs must be at least 1")
+    limit = asyncio.Semaphore(jobs)
+    fetches: dict[Any, asyncio.Task[list[JarInfo]]] = {}
+    runs = []
+    for task in tasks:
+        key = jar_identity(task.jar)
+        if key not in fetches:
+            fetches[key] = asyncio.ensure_future(_fetch(task, store, dry, http, limit))
+        runs.append(_run_task(task, fetches[key], place))
+    return list(await asyncio.gather(*runs))
+
+
+def fetch_all(
+    tasks: Sequence[FetchTask],
+    store: BaseStore,
+    dry: bool = False,
+    jobs: int = DEFAULT_JOBS,
+    place: Callable[[Path, Path], object] | None = None,
+    http: HttpSessions | None = None,
+) -> list[FetchResult]:
+    "Blocking wrapper around `fetch_all_async`"
+    if not tasks:
+        return []
+    return run_sync(fetch_all_async(tasks, store, dry=dry, jobs=jobs, place=place, http=http), http)
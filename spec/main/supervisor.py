@@ -0,0 +1,322 @@
+from __future__ import annotations
+
+from datetime import datetime, time as clock, timedelta
+from pathlib import Path
+import queue
+import signal
+import subprocess
+import sys
+import threading
+import time
+from typing import TYPE_CHECKING, Any
+
+from . import collect_garbage, fetch_tasks, generation_jars, make_live, place_jar
+from .pipeline import fetch_all
+from ..deploy import DeployMode
+from ..generations import Generation, GenerationStore, same_jars
+
+if TYPE_CHECKING:
+    from ..console import Console
+    from ..spec import Specification
+
+
+COMMANDS = {
+    "update": "go live with the pending generation now",
+    "prefetch": "check for updates now",
+    "restart": "restart the server",
+    "status": "show the server and any pending generation",
+    "quit": "stop the server and stop supervising",
+}
+
+
+class Backoff:
+    "Delay before restarting a crashed server, doubling with every crash soon after a start"
+
+    def __init__(self, initial: float = 5, maximum: float = 300, stable: float = 600):
+        self.initial = initial
+        self.maximum = maximum
+        self.stable = stable
+        self.delay = initial
+
+    initial: float
+    maximum: float
+    stable: float  # seconds of uptime after which a crash starts from `initial` again
+    delay: float
+
+    def next(self, uptime: float) -> float:
+        if uptime >= self.stable:
+            self.delay = self.initial
+        delay = self.delay
+        self.delay = min(self.delay * 2, self.maximum)
+        return delay
+
+
+class Supervisor:
+    """Keeps the server running, swapping in new jars at the cost of one restart
+
+    While the server runs, the jars are resolved every `prefetch` seconds, and any
+    updates are downloaded into the store and staged as a new generation. That goes
+    live at the next `update_at` time of day (or as soon as it is staged): the server
+    is sent its stop command, the generation is activated, and the server is started
+    again, so the downtime is little more than the server's startup.
+
+    A server which exits with an error is restarted after a growing delay; one which
+    exits cleanly (such as after `stop` is typed) ends supervision. Console input is
+    passed on to the server, except lines starting with `!`, which are `COMMANDS`."""
+
+    def __init__(
+        self,
+        spec: Specification,
+        args: Any,
+        mode: DeployMode,
+        prefetch: float | None = 3600,
+        update_at: clock | None = None,
+        stop_timeout: float = 120,
+        backoff: Backoff | None = None,
+    ):
+        self.spec = spec
+        self.args = args
+        self.mode = mode
+        self.generations = GenerationStore(spec.folders.generations)
+        self.prefetch_interval = prefetch or None
+        self.update_at = update_at
+        self.stop_timeout = stop_timeout
+        self.backoff = backoff or Backoff()
+        # one log for every run of the server, so that a crash and the restart after it are in the same place
+        self.console = spec.console.open(spec.folders.server) if spec.console is not None else None
+
+        self.process = None
+        self.serverjar = None
+        self.pending = None
+        self.due = None
+        self.started = 0.0
+
+        self.commands: queue.Queue[str] = queue.Queue()
+        self.prefetch_now = threading.Event()
+        self.stopping = threading.Event()
+        self._lock = threading.Lock()  # guards `pending` and `due`
+        self._stdin_lock = threading.Lock()
+
+    spec: Specification
+    args: Any
+    mode: DeployMode
+    generations: GenerationStore
+    prefetch_interval: float | None  # seconds
+    update_at: clock | None
+    stop_timeout: float
+    backoff: Backoff
+    console: Console | None
+    process: subprocess.Popen[bytes] | None
+    serverjar: Path | None
+    pending: Generation | None  # staged, waiting to go live
+    due: float | None  # when `pending` goes live
+    started: float
+
+    def run(self, serverjar: Path) -> int:
+        "Supervise the server until it stops cleanly or `!quit`, returning its last exit code"
+        self.serverjar = serverjar
+        try:
+            signal.signal(signal.SIGTERM, lambda signum, frame: self.commands.put("quit"))
+        except ValueError:
+            pass  # not the main thread
+        threading.Thread(target=self._read_console, name="console", daemon=True).start()
+        if self.prefetch_interval is not None:
+            threading.Thread(target=self._prefetch_loop, name="prefetch", daemon=True).start()
+
+        self.launch()
+        assert self.process is not None
+        try:
+            while True:
+                try:
+                    command = self.commands.get(timeout=0.5)
+                except queue.Empty:
+                    command = None
+                if command is not None and not self.handle(command):
+                    break
+
+                code = self.process.poll()
+                if code == 0:
+                    print("Server stopped")
+                    break
+                if code is not None:
+                    delay = self.backoff.next(time.monotonic() - self.started)
+                    print(f"Server exited with code {code}; restarting in {delay:.0f} seconds", file=sys.stderr)
+                    if not self._wait(delay):
+                        break
+                    self.launch_latest()
+                elif self.pending is not None and self.due is not None and time.time() >= self.due:
+                    self.update()
+        except KeyboardInterrupt:
+            print("Stopping server")
+        finally:
+            self.stopping.set()
+            self.prefetch_now.set()  # wake the prefetch thread so that it ends
+            self.stop_server()
+            if self.console is not None:
+                self.console.close()
+        return self.process.returncode or 0
+
+    def handle(self, command: str) -> bool:
+        "Carry out a console command, returning False if supervision should end"
+        name = command.strip().lower()
+        if name == "quit":
+            return False
+        elif name == "update":
+            if self.pending is None:
+                print("No update is pending")
+            else:
+                self.update()
+        elif name == "prefetch":
+            self.prefetch_now.set()
+        elif name == "restart":
+            self.stop_server()
+            self.launch_latest()
+        elif name == "status":
+            print(f"Running {self.serverjar}, up for {time.monotonic() - self.started:.0f} seconds")
+            with self._lock:
+                if self.pending is None:
+                    print("No update is pending")
+                else:
+                    print(f"Generation {self.pending.id} goes live {self._describe_due()}")
+        else:
+            print("Supervisor commands:")
+            for name, description in COMMANDS.items():
+                print(f"  !{name:<10} {description}")
+        return True
+
+    def _wait(self, delay: float) -> bool:
+        "Sleep for `delay` seconds, cut short by `!update` or `!restart`; returns False on `!quit`"
+        deadline = time.monotonic() + delay
+        while (remaining := deadline - time.monotonic()) > 0:
+            try:
+                command = self.commands.get(timeout=remaining)
+            except queue.Empty:
+                break
+            name = command.strip().lower()
+            if name == "quit":
+                return False
+            if name in ("update", "restart"):
+                break
+            self.handle(command)
+        return True
+
+    def launch(self):
+        assert self.serverjar is not None
+        print(f"Running server {self.serverjar}")
+        sys.stdout.flush()
+        if self.console is None:
+            output = {}
+        else:
+            output = {"stdout": subprocess.PIPE, "stderr": subprocess.STDOUT}
+        self.process = self.spec.server.start(
+            self.serverjar, cwd=self.spec.folders.server, store=self.spec.store, stdin=subprocess.PIPE, **output,
+        )
+        if self.console is not None:
+            assert self.process.stdout is not None
+            self.console.attach(self.process.stdout)
+        self.started = time.monotonic()
+
+    def launch_latest(self):
+        "Start the server, first making the pending generation live if there is one"
+        with self._lock:
+            gen, self.pending, self.due = self.pending, None, None
+        if gen is not None:
+            make_live(self.spec, self.generations, gen, self.mode)
+            self.serverjar = self.spec.folders.server / gen.server
+            if self.spec.store.auto_gc:
+                collect_garbage(self.spec, self.generations, [], self.args.lockfile)
+        self.launch()
+
+    def update(self):
+        print(f"Restarting the server to update to generation {self.pending.id if self.pending else None}")
+        self.stop_server()
+        self.launch_latest()
+
+    def send(self, line: str):
+        "Type a line into the server console"
+        p = self.process
+        if p is None or p.stdin is None:
+            return
+        with self._stdin_lock:
+            try:
+                p.stdin.write(line.encode() + b"\n")
+                p.stdin.flush()
+            except (BrokenPipeError, ValueError):
+                pass  # the server has already exited
+
+    def stop_server(self):
+        "Stop the server with its stop command, terminating it if it takes too long"
+        p = self.process
+        if p is None or p.poll() is not None:
+            return
+        self.send(self.spec.server.stop_command)
+        try:
+            p.wait(timeout=self.stop_timeout)
+        except subprocess.TimeoutExpired:
+            print(f"Server did not stop within {self.stop_timeout:.0f} seconds; terminating it", file=sys.stderr)
+            p.terminate()
+            try:
+                p.wait(timeout=30)
+            except subprocess.TimeoutExpired:
+                p.kill()
+                p.wait()
+
+    def _read_console(self):
+        for line in sys.stdin:
+            if line.startswith("!"):
+                self.commands.put(line[1:])
+            else:
+                self.send(line.rstrip("\r\n"))
+
+    def _prefetch_loop(self):
+        assert self.prefetch_interval is not None
+        while True:
+            self.prefetch_now.wait(self.prefetch_interval)
+            self.prefetch_now.clear()
+            if self.stopping.is_set():
+                return
+            try:
+                self.prefetch()
+            except Exception as e:
+                print(f"Checking for updates failed: {e}", file=sys.stderr)
+
+    def prefetch(self) -> Generation | None:
+        "Download any updated jars and stage them as the pending generation"
+        staging = self.generations.stage()
+        try:
+            tasks = fetch_tasks(self.spec, staging, self.args)
+            results = fetch_all(tasks, self.spec.store, jobs=self.args.jobs, place=place_jar, http=self.spec.http)
+            failed = [res for res in results if not res.ok]
+            for res in failed:
+                print(f"Failed to download {res.task.label}: {res.error}", file=sys.stderr)
+            if failed or not results[0].infos:
+                self.generations.discard(staging)
+                return None
+
+            jars = generation_jars(self.spec, results)
+            with self._lock:
+                if same_jars(self.pending or self.generations.current(), jars):
+                    self.generations.discard(staging)
+                    return None
+                gen = self.generations.commit(staging, server=results[0].infos[-1].name, jars=jars)
+                self.pending = gen
+                self.due = self._next_update()
+                print(f"Staged generation {gen.id}, which goes live {self._describe_due()}")
+            return gen
+        except BaseException:
+            self.generations.discard(staging)
+            raise
+
+    def _next_update(self) -> float:
+        if self.update_at is None:
+            return time.time()
+        now = datetime.now()
+        due = datetime.combine(now.date(), self.update_at)
+        if due <= now:
+            due += timedelta(days=1)
+        return due.timestamp()
+
+    def _describe_due(self) -> str:
+        if self.due is None or self.due <= time.time():
+            return "now (or type !update)"
+        return f"at {datetime.fromtimestamp(self.due):%Y-%m-%d %H:%M} (or type !update)"
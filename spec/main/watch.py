@@ -0,0 +1,239 @@
+from __future__ import annotations
+
+from datetime import datetime, time as clock, timedelta
+import json
+import os
+from pathlib import Path
+import sys
+import time
+from typing import Any, Sequence
+
+from . import build_generation, collect_garbage, fetch_tasks, generation_jars, make_live, place_jar
+from .pipeline import FetchResult, FetchTask, fetch_all
+from ..deploy import DeployMode
+from ..generations import GenerationStore
+from ..spec import Specification
+
+
+Window = tuple[clock, clock]
+
+
+def in_window(when: datetime, windows: Sequence[Window]) -> bool:
+    "Whether the time of day of `when` is in any of `windows`, each of which may wrap past midnight"
+    t = when.time()
+    for start, end in windows:
+        if start <= end:
+            if start <= t < end:
+                return True
+        elif t >= start or t < end:
+            return True
+    return False
+
+
+def next_window(when: datetime, windows: Sequence[Window]) -> datetime | None:
+    "Start of the next of `windows` after `when`, or `when` itself if it is in one"
+    if not windows:
+        return None
+    if in_window(when, windows):
+        return when
+    starts = []
+    for start, _ in windows:
+        s = datetime.combine(when.date(), start)
+        starts.append(s if s > when else s + timedelta(days=1))
+    return min(starts)
+
+
+class Source:
+    "One jar of the specification, checked on its own schedule"
+
+    def __init__(self, task: FetchTask, interval: float):
+        self.task = task
+        self.interval = interval
+        self.next_check = 0.0
+        self.checked_at = None
+        self.changed_at = None
+        self.result = None
+        self.jars = None
+        self.error = None
+
+    task: FetchTask
+    interval: float  # seconds until the next check; grows while nothing changes
+    next_check: float
+    checked_at: float | None
+    changed_at: float | None  # when `jars` last changed
+    result: FetchResult | None  # the last successful check
+    jars: list[dict[str, Any]] | None  # manifest entries of `result`
+    error: str | None  # of the last check, if it failed
+
+    @property
+    def label(self) -> str:
+        return self.task.label
+
+
+class Watcher:
+    """Checks every source of the specification on its own schedule, and deploys updates in maintenance windows
+
+    Each source is checked every `interval` seconds, which doubles (up to `max_interval`)
+    every time it is found unchanged or fails, and drops back when it changes. New builds
+    are downloaded into the store as soon as they are found, so going live is only a
+    matter of linking them into a new generation; that happens as soon as the updates
+    are found, or if `windows` are given, inside the next of them.
+
+    A report of the pending updates and of every source is kept in `report` (JSON)."""
+
+    def __init__(
+        self,
+        spec: Specification,
+        args: Any,
+        mode: DeployMode,
+        report: Path,
+        interval: float = 900,
+        max_interval: float = 14400,
+        windows: Sequence[Window] = [],
+    ):
+        self.spec = spec
+        self.args = args
+        self.mode = mode
+        self.report = report
+        self.base_interval = interval
+        self.max_interval = max(interval, max_interval)
+        self.windows = list(windows)
+        self.generations = GenerationStore(spec.folders.generations)
+        # placed by folder name only; deploys link the stored jars into a staged generation
+        self.sources = [Source(task, interval) for task in fetch_tasks(spec, Path(), args)]
+
+    spec: Specification
+    args: Any
+    mode: DeployMode
+    report: Path
+    base_interval: float
+    max_interval: float
+    windows: list[Window]
+    generations: GenerationStore
+    sources: list[Source]
+
+    def run(self):
+        windows = ", ".join(f"{a:%H:%M}-{b:%H:%M}" for a, b in self.windows) or "as soon as they are found"
+        print(f"Watching {len(self.sources)} sources every {self.base_interval / 60:g} to "
+              f"{self.max_interval / 60:g} minutes; updates go live {windows}")
+        try:
+            while True:
+                self.step()
+                now = time.time()
+                wake = min(s.next_check for s in self.sources)
+                # wake at least every minute, so that a maintenance window is not missed
+                time.sleep(min(max(wake - now, 1), 60))
+        except KeyboardInterrupt:
+            print("Stopped watching")
+
+    def step(self):
+        "Check every source which is due, write the report, and deploy if it is time to"
+        now = time.time()
+        due = [s for s in self.sources if s.next_check <= now]
+        if due:
+            self.check(due)
+        pending = self.pending()
+        if due:
+            self.write_report(pending)
+        if pending and self.ready() and (not self.windows or in_window(datetime.now(), self.windows)):
+            self.deploy()
+            self.write_report(self.pending())
+
+    def check(self, sources: Sequence[Source]):
+        "Resolve `sources` at once, downloading any new builds into the store"
+        results = fetch_all([s.task for s in sources], self.spec.store, jobs=self.args.jobs, http=self.spec.http)
+        now = time.time()
+        for s, res in zip(sources, results):
+            s.checked_at = now
+            if not res.ok:
+                s.error = f"{type(res.error).__name__}: {res.error}"
+                print(f"Checking {s.label} failed: {s.error}", file=sys.stderr)
+                s.interval = min(s.interval * 2, self.max_interval)
+            else:
+                s.error = None
+                jars = generation_jars(self.spec, [res])
+                if s.jars is not None and _jar_keys(jars) != _jar_keys(s.jars):
+                    print(f"New build of {s.label}: {', '.join(j['name'] for j in jars)}")
+                    s.interval = self.base_interval
+                    s.changed_at = now
+                elif s.jars is not None:
+                    s.interval = min(s.interval * 2, self.max_interval)
+                else:
+                    s.changed_at = now
+                s.result = res
+                s.jars = jars
+            s.next_check = now + s.interval
+
+    def ready(self) -> bool:
+        "Whether every source has been resolved, so that a complete generation can be built"
+        return all(s.result is not None for s in self.sources) and bool(self.sources[0].jars)
+
+    def pending(self) -> list[Source]:
+        "Sources whose latest jars are not the ones in the live generation"
+        current = self.generations.current()
+        live = current.jars if current is not None else []
+        return [
+            s for s in self.sources
+            if s.jars is not None and _jar_keys(s.jars) != _jar_keys(j for j in live if j.get("source") == s.label)
+        ]
+
+    def deploy(self):
+        "Make a generation of the latest jars of every source live"
+        staging = self.generations.stage()
+        try:
+            results = [s.result for s in self.sources if s.result is not None]
+            for res in results:
+                for ji in res.infos:
+                    place_jar(ji.path, staging / res.task.folder.name / ji.name)
+            gen = build_generation(self.spec, self.generations, staging, results)
+        except BaseException:
+            self.generations.discard(staging)
+            raise
+        make_live(self.spec, self.generations, gen, self.mode)
+        if self.spec.store.auto_gc:
+            collect_garbage(self.spec, self.generations, results, self.args.lockfile)
+
+    def write_report(self, pending: Sequence[Source]):
+        current = self.generations.current()
+        live = current.jars if current is not None else []
+        upcoming = next_window(datetime.now(), self.windows)
+
+        def stamp(t: float | None) -> str | None:
+            return datetime.fromtimestamp(t).astimezone().isoformat(timespec="seconds") if t else None
+
+        report = {
+            "updated": stamp(time.time()),
+            "live_generation": current.id if current is not None else None,
+            "windows": [f"{a:%H:%M}-{b:%H:%M}" for a, b in self.windows],
+            "next_deploy": (upcoming.astimezone().isoformat(timespec="seconds") if upcoming else stamp(time.time()))
+            if pending else None,
+            "pending": [
+                {
+                    "source": s.label,
+                    "live": [j for j in live if j.get("source") == s.label],
+                    "available": s.jars,
+                    "builds": [ji.build for ji in s.result.infos] if s.result is not None else [],
+                    "found": stamp(s.changed_at),
+                }
+                for s in pending
+            ],
+            "sources": [
+                {
+                    "source": s.label,
+                    "checked": stamp(s.checked_at),
+                    "next_check": stamp(s.next_check),
+                    "interval_minutes": round(s.interval / 60, 2),
+                    "error": s.error,
+                }
+                for s in self.sources
+            ],
+        }
+        self.report.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.report.with_name(f".{self.report.name}.{os.getpid()}.tmp")
+        with open(tmp, "w") as f:
+            json.dump(report, f, indent=2)
+        os.replace(tmp, self.report)
+
+
+def _jar_keys(jars: Any) -> list[tuple[str, str | None]]:
+    return sorted((j["name"], j.get("sha256")) for j in jars)
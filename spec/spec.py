@@ -1,9 +1,13 @@
 from __future__ import annotations
 
 from pathlib import Path
-from typing import Any, Sequence, TextIO
+from typing import Any, Mapping, Sequence, TextIO
 from .base import YamlObject, load
+from .console import ConsoleLog
+from .deploy import DeployMode
+from .http import HttpSessions
 from .jars import BaseJar, BaseLaunchableJar
+from .speccache import load_compiled
 from .store import BaseStore
 
 
@@ -12,6 +16,8 @@ class Specification(YamlObject, yamltag="!spec", path_resolver=[]):
     plugins: Sequence[BaseJar]
     store: BaseStore
     folders: FolderSpecification
+    http: HttpSessions
+    console: ConsoleLog | None
 
     def __init__(
         self,
@@ -19,6 +25,8 @@ class Specification(YamlObject, yamltag="!spec", path_resolver=[]):
         plugins: Sequence[BaseJar],
         store: BaseStore,
         folders: FolderSpecification,
+        http: HttpSessions | None = None,
+        console: ConsoleLog | None = None,
         **kw: Any,
     ):
         assert isinstance(server, BaseLaunchableJar)
@@ -29,18 +37,106 @@ class Specification(YamlObject, yamltag="!spec", path_resolver=[]):
         self.store = store
         assert isinstance(folders, FolderSpecification)
         self.folders = folders
-        print("Specification given extra keys:", kw)
+        if http is None:
+            http = HttpSessions()
+        assert isinstance(http, HttpSessions)
+        self.http = http
+        # without it, the server writes straight to the terminal
+        assert console is None or isinstance(console, ConsoleLog)
+        self.console = console
+        if kw:
+            print("Specification given extra keys:", kw)
 
     @classmethod
-    def from_yaml(cls, stream: str | TextIO) -> Specification:
+    def from_yaml(cls, stream: str | bytes | TextIO) -> Specification | Network:
         return load(stream)
 
+    @classmethod
+    def from_file(cls, path: str | Path, use_cache: bool = True) -> Specification | Network:
+        "Load a specification file, reusing its compiled form if the file is unchanged since the last load"
+        return load_compiled(path, cls.from_yaml, use_cache=use_cache)
+
 
-class FolderSpecification(YamlObject, yamltag="!folder", path_resolver=["folders"]):
+class FolderSpecification(YamlObject, yamltag="!folder", path_resolvers=[["folders"], ["members", None, "folders"]]):
     server: Path
     plugins: Path
+    mode: DeployMode
+    generations: Path
+    keep_generations: int
 
-    def __init__(self, server: str | Path, plugins: str | Path, **kw: Any):
+    def __init__(
+        self,
+        server: str | Path,
+        plugins: str | Path,
+        mode: str | DeployMode = DeployMode.Copy,
+        generations: str | Path | None = None,
+        keep_generations: int = 5,
+        **kw: Any,
+    ):
         self.server = Path(server)
         self.plugins = Path(plugins)
-        print("Folders given extra keys:", kw)
+        self.mode = DeployMode(mode)
+        self.generations = Path(generations) if generations is not None else self.server / ".generations"
+        if keep_generations < 1:
+            raise ValueError("Must keep at least 1 generation")
+        self.keep_generations = int(keep_generations)
+        if kw:
+            print("Folders given extra keys:", kw)
+
+
+class Member(YamlObject, yamltag="!member", path_resolver=["members", None]):
+    "One server of a network; it shares the store and connections of the network"
+
+    server: BaseLaunchableJar
+    plugins: Sequence[BaseJar]
+    folders: FolderSpecification
+    console: ConsoleLog | None
+
+    def __init__(
+        self,
+        server: BaseLaunchableJar,
+        folders: FolderSpecification,
+        plugins: Sequence[BaseJar] = [],
+        console: ConsoleLog | None = None,
+        **kw: Any,
+    ):
+        self.server = server
+        self.plugins = list(plugins)
+        self.folders = folders
+        self.console = console
+        if kw:
+            print("Member given extra keys:", kw)
+
+
+class Network(YamlObject, yamltag="!network"):
+    """A proxy and its backend servers, written as a document tagged `!network`
+
+    Each member is a `Specification` of its own, but they all share one store and
+    one set of connections, so a jar used by several members is fetched once."""
+
+    members: dict[str, Specification]
+    store: BaseStore
+    http: HttpSessions
+    yaml_deep = True  # members are read in __init__
+
+    def __init__(
+        self,
+        members: Mapping[str, Member],
+        store: BaseStore,
+        http: HttpSessions | None = None,
+        **kw: Any,
+    ):
+        if not members:
+            raise ValueError("A network must have at least one member")
+        assert isinstance(store, BaseStore)
+        self.store = store
+        if http is None:
+            http = HttpSessions()
+        assert isinstance(http, HttpSessions)
+        self.http = http
+        self.members = {}
+        for name, m in members.items():
+            assert isinstance(m, Member)
+            self.members[str(name)] = Specification(m.server, m.plugins, store, m.folders, http, m.console)
+        if kw:
+            print("Network given extra keys:", kw)
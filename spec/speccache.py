@@ -0,0 +1,66 @@
+from __future__ import annotations
+
+from hashlib import sha256
+import os
+from pathlib import Path
+import pickle
+from typing import Any, Callable
+
+
+CACHE_VERSION = 1
+
+
+def cache_path(path: Path) -> Path:
+    "Where the compiled form of the specification file `path` is cached"
+    return path.with_name(f".{path.name}.compiled")
+
+
+def code_fingerprint() -> str:
+    "Changes whenever this package is changed, since objects pickled by other code may not fit"
+    h = sha256()
+    for f in sorted(Path(__file__).parent.rglob("*.py")):
+        st = f.stat()
+        h.update(f"{f}\0{st.st_mtime_ns}\0{st.st_size}\0".encode())
+    return h.hexdigest()
+
+
+def load_compiled(path: str | Path, build: Callable[[bytes], Any], use_cache: bool = True) -> Any:
+    """Build the object described by the file at `path`, or load it from the cache
+
+    The cache is used only if the file has the same hash and modification time as
+    when it was cached, and this package has not changed since. Otherwise `build`
+    is called with the contents of the file, and its result is cached."""
+    path = Path(path)
+    with open(path, "rb") as f:
+        data = f.read()
+        mtime = os.fstat(f.fileno()).st_mtime_ns
+    header = {
+        "version": CACHE_VERSION,
+        "sha256": sha256(data).hexdigest(),
+        "mtime": mtime,
+        "code": code_fingerprint(),
+    }
+
+    cache = cache_path(path)
+    if use_cache:
+        try:
+            with open(cache, "rb") as f:
+                # the header is checked before the object is unpickled, so a stale object is never built
+                if pickle.load(f) == header:
+                    return pickle.load(f)
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            print(f"Ignoring unreadable specification cache {cache}: {e}")
+
+    obj = build(data)
+    tmp = cache.with_name(f"{cache.name}.{os.getpid()}.tmp")
+    try:
+        with open(tmp, "wb") as f:
+            pickle.dump(header, f, protocol=pickle.HIGHEST_PROTOCOL)
+            pickle.dump(obj, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, cache)
+    except (OSError, pickle.PicklingError, TypeError, AttributeError) as e:
+        tmp.unlink(missing_ok=True)
+        print(f"Cannot cache the compiled specification: {e}")
+    return obj
@@ -1,14 +1,40 @@
 from __future__ import annotations
 
 from abc import ABC, abstractmethod
+import hashlib
 from hashlib import sha256
+import json
+import os
 from pathlib import Path
 import pickle
-from typing import Any
-from .base import YamlObject
+import shutil
+import threading
+import time
+from typing import TYPE_CHECKING, Any, Iterable, Mapping
+from . import trace
+from .base import YamlObject, parse_size
+from .http import ResponseCache
+from .storeindex import IndexEntry, StoreIndex, encode_key
+
+if TYPE_CHECKING:
+    from typing import Literal
+
+
+class GcResult:
+    def __init__(self):
+        self.removed = []
+        self.freed = 0
+        self.kept = 0
+
+    removed: list[Path]
+    freed: int
+    kept: int  # bytes still in the store
 
 
 class BaseStore(ABC, YamlObject):
+    response_cache: ResponseCache | None = None
+    auto_gc: bool = False
+
     @abstractmethod
     def fetch(self, key: Any) -> Path | None:
         pass
@@ -17,26 +43,343 @@ class BaseStore(ABC, YamlObject):
     def get_name(self, key: Any) -> Path:
         pass
 
+    def fetch_digest(self, algorithm: str, digest: str) -> Path | None:
+        "Find any stored file with the given content hash"
+        return None
+
+    def get_digests(self, key: Any) -> dict[str, str]:
+        "Get the content hashes recorded for `key`"
+        return {}
+
+    def record(self, key: Any, digests: Mapping[str, str] = {}, **info: Any):
+        """Record the content hashes of the file stored under `key`
+
+        `info` may describe where it came from: `url`, `name` and `build_time` (unix seconds)."""
+        pass
+
+    def entries(self) -> list[IndexEntry]:
+        "Describe every entry in the store"
+        return []
+
+    def put_file(self, key: Any, src: Path) -> Path:
+        "Store a copy of the local file `src` under `key`"
+        return Path(shutil.copy2(src, self.get_name(key)))
+
+    def lookup(self, key: Any, digests: Mapping[str, str] = {}, **info: Any) -> Path | None:
+        """Find a stored file for `key`, or any stored file with the expected content
+
+        An entry for `key` whose recorded hashes contradict `digests` is ignored.
+        `info` is recorded (see `record`) if the file is found by its content."""
+        path = self.fetch(key)
+        if path is not None:
+            recorded = self.get_digests(key)
+            if all(recorded.get(a, d.lower()) == d.lower() for a, d in digests.items()):
+                return path
+        for algorithm, digest in digests.items():
+            path = self.fetch_digest(algorithm, digest)
+            if path is not None:
+                return path
+        return None
+
+    def collect_garbage(
+        self,
+        protect_paths: Iterable[Path] = (),
+        protect_digests: Iterable[str] = (),
+        dry: bool = False,
+    ) -> GcResult:
+        """Evict entries according to the store's limits
+
+        Files in `protect_paths`, and content with a sha256 in `protect_digests`, are never evicted."""
+        return GcResult()
+
 
 class Store(BaseStore, yamltag="!store.default"):
     directory: Path
+    max_size: int | None
+    max_age: float | None
+    index: StoreIndex
 
-    def __init__(self, directory: Path):
+    def __init__(
+        self,
+        directory: Path,
+        http_cache: str | Path | None | Literal[False] = None,
+        max_size: str | int | None = None,
+        max_age: float | None = None,
+        auto_gc: bool = False,
+    ):
         self.directory = Path(directory)
         self.directory.mkdir(parents=True, exist_ok=True)
+        self.index = StoreIndex(self.directory / "index.sqlite")
+
+        # garbage collection limits: total size, and days since an entry was last used
+        self.max_size = None if max_size is None else parse_size(max_size)
+        self.max_age = None if max_age is None else float(max_age) * 86400
+        self.auto_gc = bool(auto_gc)
+
+        # API responses are cached next to the store, unless disabled with `http_cache: false`
+        if http_cache is None:
+            http_cache = self.directory.with_name(self.directory.name + ".http")
+        if http_cache is not False:
+            self.response_cache = ResponseCache(http_cache)
+
+    def __getstate__(self) -> dict[str, Any]:
+        # the index database is reopened when unpickled (for the compiled specification cache)
+        return {k: v for k, v in self.__dict__.items() if k != "index"}
+
+    def __setstate__(self, state: dict[str, Any]):
+        self.__dict__.update(state)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.index = StoreIndex(self.directory / "index.sqlite")
 
     def get_key(self, obj: Any) -> Path:
-        p = pickle.dumps(obj)
-        h = sha256(p).hexdigest()
+        h = sha256(encode_key(obj).encode()).hexdigest()
+        return Path(h[:2], h[2:])
+
+    def _get_legacy_key(self, obj: Any) -> Path:
+        "Key used before the index, which depended on the pickle protocol"
+        h = sha256(pickle.dumps(obj)).hexdigest()
         return Path(h[:2], h[2:])
 
+    @trace.traced("fetch", "store")
     def fetch(self, key: Any) -> Path | None:
-        path = self.get_name(key)
-        if path.exists():
-            return path
-        return None
+        entry = self.index.get(encode_key(key))
+        if entry is not None:
+            self.index.touch(entry.key)
+            return self.directory / entry.slot
+        return self._adopt(key)
+
+    def _adopt(self, key: Any) -> Path | None:
+        "Add an entry which is in the store directory but not in the index, such as one from an older version"
+        dest = self.get_name(key)
+        if not dest.exists():
+            legacy = self.directory / self._get_legacy_key(key)
+            if not legacy.exists():
+                return None
+            try:
+                _link_atomic(legacy, dest)
+            except OSError:
+                _copy_unlinked(legacy, dest)
+
+        digests: dict[str, str] = {}
+        for sidecar in (dest.with_suffix(".digests"), (self.directory / self._get_legacy_key(key)).with_suffix(".digests")):
+            try:
+                with open(sidecar) as f:
+                    digests = json.load(f)
+                break
+            except (OSError, ValueError):
+                continue
+        self.record(key, digests)
+        return dest
 
     def get_name(self, key: Any) -> Path:
         dest = self.directory / self.get_key(key)
         dest.parent.mkdir(exist_ok=True)
         return dest
+
+    def get_blob(self, sha256: str) -> Path:
+        "Path of the content-addressed copy of data with the given sha256"
+        sha256 = sha256.lower()
+        return self.directory / "blobs" / sha256[:2] / sha256[2:]
+
+    @trace.traced("fetch_digest", "store")
+    def fetch_digest(self, algorithm: str, digest: str) -> Path | None:
+        if algorithm == "sha256":
+            sha = digest.lower()
+        else:
+            # other algorithms are aliases of the sha256 of the same content
+            sha = self.index.resolve_alias(algorithm, digest)
+            if sha is None:
+                return None
+        entry = self.index.find_content(sha)
+        if entry is None:
+            return None
+        return self.directory / entry.slot
+
+    @trace.traced("get_digests", "store")
+    def get_digests(self, key: Any) -> dict[str, str]:
+        entry = self.index.get(encode_key(key))
+        if entry is None or entry.sha256 is None:
+            return {}
+        return {**self.index.aliases(entry.sha256), "sha256": entry.sha256}
+
+    @trace.traced("record", "store")
+    def record(self, key: Any, digests: Mapping[str, str] = {}, **info: Any):
+        path = self.get_name(key)
+        digests = {a: d.lower() for a, d in digests.items()}
+        if "sha256" not in digests:
+            digests.update(hash_file(path))
+        for algorithm, digest in digests.items():
+            if algorithm != "sha256":
+                self.index.add_alias(algorithm, digest, digests["sha256"])
+        self._link_blob(path, digests["sha256"])
+
+        if isinstance(key, (tuple, list)) and key and isinstance(key[0], str):
+            info.setdefault("source", key[0])
+        enc = encode_key(key)
+        old = self.index.get(enc)
+        self.index.put(
+            enc,
+            path.relative_to(self.directory).as_posix(),
+            sha256=digests["sha256"],
+            size=path.stat().st_size,
+            **info,
+        )
+
+        if old is not None and old.sha256 not in (None, digests["sha256"]) and self.index.find_content(old.sha256) is None:
+            # the key now has new content; keep tracking the old blob so it can still be found and evicted
+            blob = self.get_blob(old.sha256)
+            if blob.exists():
+                self.index.put(
+                    encode_key(("blob", old.sha256)),
+                    blob.relative_to(self.directory).as_posix(),
+                    last_used=old.last_used,
+                    source=old.source, url=old.url, name=old.name,
+                    sha256=old.sha256, size=old.size, build_time=old.build_time,
+                )
+
+    def _link_blob(self, path: Path, sha256: str):
+        "Make `path` a hardlink of the blob with its content, creating the blob if needed"
+        blob = self.get_blob(sha256)
+        blob.parent.mkdir(parents=True, exist_ok=True)
+        try:
+            if blob.exists():
+                if not blob.samefile(path):
+                    _link_atomic(blob, path)
+            else:
+                os.link(path, blob)
+        except FileExistsError:
+            # another thread created the blob between the check and the link
+            _link_atomic(blob, path)
+        except OSError:
+            pass  # filesystem without hardlinks; the key slot keeps its own copy
+
+    @trace.traced("lookup", "store")
+    def lookup(self, key: Any, digests: Mapping[str, str] = {}, **info: Any) -> Path | None:
+        path = self.fetch(key)
+        if path is not None:
+            recorded = self.get_digests(key)
+            if all(recorded.get(a, d.lower()) == d.lower() for a, d in digests.items()):
+                entry = self.index.get(encode_key(key))
+                if info and entry is not None and entry.name is None:
+                    # adopted from an older store, which did not record where entries came from
+                    self.index.put(entry.key, entry.slot, **info)
+                return path
+
+        for algorithm, digest in digests.items():
+            found = self.fetch_digest(algorithm, digest)
+            if found is None:
+                continue
+            # found by content; link it into this key's slot so the next lookup is direct
+            dest = self.get_name(key)
+            try:
+                _link_atomic(found, dest)
+            except OSError:
+                _copy_unlinked(found, dest)
+            self.record(key, {**digests, **self.get_digests_by_path(found)}, **info)
+            return dest
+        return None
+
+    def get_digests_by_path(self, path: Path) -> dict[str, str]:
+        entry = self.index.get_slot(Path(path).relative_to(self.directory).as_posix())
+        if entry is None or entry.sha256 is None:
+            return {}
+        return {**self.index.aliases(entry.sha256), "sha256": entry.sha256}
+
+    @trace.traced("put_file", "store")
+    def put_file(self, key: Any, src: Path) -> Path:
+        "Store a copy of the local file `src` under `key`, without copying data already in the store"
+        dest = self.get_name(key)
+        digests = hash_file(src)
+        blob = self.get_blob(digests["sha256"])
+        if blob.exists():
+            try:
+                _link_atomic(blob, dest)
+            except OSError:
+                _copy_unlinked(src, dest)
+        else:
+            _copy_unlinked(src, dest)
+        self.record(key, digests, name=src.name, url=Path(src).absolute().as_uri(),
+                    build_time=src.stat().st_mtime)
+        return dest
+
+    def entries(self) -> list[IndexEntry]:
+        return self.index.entries()
+
+    @trace.traced("collect_garbage", "store")
+    def collect_garbage(
+        self,
+        protect_paths: Iterable[Path] = (),
+        protect_digests: Iterable[str] = (),
+        dry: bool = False,
+    ) -> GcResult:
+        """Evict the least recently used content until the store is within `max_size`,
+        and any content unused for longer than `max_age`
+
+        Key slots and blobs with the same content are hardlinks, so they are evicted together.
+        Content which is also linked from outside the store (such as a deployed generation)
+        is never evicted."""
+        now = time.time()
+        protected = {d.lower() for d in protect_digests}
+        protected.update(self.get_digests_by_path(p).get("sha256", "") for p in protect_paths)
+
+        result = GcResult()
+        contents = self.index.contents()
+        total = sum(c.size for c in contents)
+        for c in contents:
+            if c.sha256 in protected:
+                continue
+            expired = self.max_age is not None and now - c.last_used > self.max_age
+            over = self.max_size is not None and total > self.max_size
+            if not expired and not over:
+                break  # everything after this was used more recently
+
+            blob = self.get_blob(c.sha256)
+            paths = [self.directory / slot for slot in c.slots if self.directory / slot != blob]
+            try:
+                if blob.stat().st_nlink > len(paths) + 1:
+                    continue  # also linked from outside the store
+                paths.append(blob)
+            except FileNotFoundError:
+                pass
+
+            if not dry:
+                for path in paths:
+                    path.unlink(missing_ok=True)
+                self.index.remove_content(c.sha256)
+            result.removed.extend(paths)
+            total -= c.size
+            result.freed += c.size
+        result.kept = total
+        return result
+
+
+def hash_file(path: Path, algorithms: Iterable[str] = ("sha256",)) -> dict[str, str]:
+    hashes = {name: hashlib.new(name) for name in algorithms}
+    with open(path, "rb") as f:
+        while chunk := f.read(1 << 20):
+            for h in hashes.values():
+                h.update(chunk)
+    return {name: h.hexdigest() for name, h in hashes.items()}
+
+
+def _tmp_name(path: Path) -> Path:
+    return path.with_name(f"{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+
+
+def _copy_unlinked(src: Path, dest: Path):
+    "Copy to `dest` without writing into the file it currently links to, which may be a blob"
+    dest.unlink(missing_ok=True)
+    shutil.copy2(src, dest)
+
+
+def _link_atomic(src: Path, dest: Path):
+    "Replace `dest` with a hardlink to `src`"
+    if dest.exists() and dest.samefile(src):
+        return
+    tmp = _tmp_name(dest)
+    os.link(src, tmp)
+    try:
+        os.replace(tmp, dest)
+    except OSError:
+        tmp.unlink()
+        raise
@@ -0,0 +1,196 @@
+from __future__ import annotations
+
+import json
+from pathlib import Path, PurePath
+import sqlite3
+import threading
+import time
+from typing import Any, Iterable
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    key TEXT PRIMARY KEY,
+    slot TEXT NOT NULL,
+    source TEXT,
+    url TEXT,
+    name TEXT,
+    sha256 TEXT,
+    size INTEGER,
+    build_time REAL,
+    created REAL NOT NULL,
+    last_used REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS entries_sha256 ON entries (sha256);
+CREATE INDEX IF NOT EXISTS entries_slot ON entries (slot);
+CREATE TABLE IF NOT EXISTS aliases (
+    algorithm TEXT NOT NULL,
+    digest TEXT NOT NULL,
+    sha256 TEXT NOT NULL,
+    PRIMARY KEY (algorithm, digest)
+);
+CREATE INDEX IF NOT EXISTS aliases_sha256 ON aliases (sha256);
+"""
+
+ENTRY_FIELDS = ("source", "url", "name", "sha256", "size", "build_time")
+
+
+def _canonical(obj: Any) -> Any:
+    if obj is None or isinstance(obj, (str, int, float, bool)):
+        return obj
+    if isinstance(obj, (tuple, list)):
+        return [_canonical(o) for o in obj]
+    if isinstance(obj, PurePath):
+        return obj.as_posix()
+    if isinstance(obj, dict):
+        return {str(k): _canonical(v) for k, v in obj.items()}
+    raise TypeError(f"Cannot use {type(obj).__name__} in a store key")
+
+
+def encode_key(key: Any) -> str:
+    """Encode a store key as text which is stable across Python versions
+
+    Keys may be built from strings, numbers, paths, lists, tuples and dicts."""
+    return json.dumps(_canonical(key), separators=(",", ":"), sort_keys=True, ensure_ascii=False)
+
+
+class IndexEntry:
+    def __init__(self, row: sqlite3.Row):
+        self.key = row["key"]
+        self.slot = row["slot"]
+        self.source = row["source"]
+        self.url = row["url"]
+        self.name = row["name"]
+        self.sha256 = row["sha256"]
+        self.size = row["size"]
+        self.build_time = row["build_time"]
+        self.created = row["created"]
+        self.last_used = row["last_used"]
+
+    def __repr__(self) -> str:
+        return f"IndexEntry({self.key}, {self.slot})"
+
+    key: str
+    slot: str  # relative to the store directory
+    source: str | None
+    url: str | None
+    name: str | None
+    sha256: str | None
+    size: int | None
+    build_time: float | None  # unix seconds
+    created: float
+    last_used: float
+
+
+class IndexContent:
+    "All entries with the same content"
+
+    def __init__(self, sha256: str, size: int, last_used: float, slots: list[str]):
+        self.sha256 = sha256
+        self.size = size
+        self.last_used = last_used
+        self.slots = slots
+
+    sha256: str
+    size: int
+    last_used: float
+    slots: list[str]
+
+
+class StoreIndex:
+    "SQLite database of the entries in a store"
+
+    path: Path
+
+    def __init__(self, path: str | Path):
+        self.path = Path(path)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(self.path, timeout=30, check_same_thread=False, isolation_level=None)
+        self._db.row_factory = sqlite3.Row
+        with self._lock:
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("PRAGMA synchronous=NORMAL")
+            self._db.executescript(SCHEMA)
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+    def _query(self, sql: str, params: Iterable[Any] = ()) -> list[sqlite3.Row]:
+        with self._lock:
+            return self._db.execute(sql, tuple(params)).fetchall()
+
+    def _execute(self, sql: str, params: Iterable[Any] = ()):
+        with self._lock:
+            self._db.execute(sql, tuple(params))
+
+    def get(self, key: str) -> IndexEntry | None:
+        rows = self._query("SELECT * FROM entries WHERE key = ?", (key,))
+        return IndexEntry(rows[0]) if rows else None
+
+    def get_slot(self, slot: str) -> IndexEntry | None:
+        rows = self._query("SELECT * FROM entries WHERE slot = ?", (slot,))
+        return IndexEntry(rows[0]) if rows else None
+
+    def find_content(self, sha256: str) -> IndexEntry | None:
+        "Most recently used entry with the given content"
+        rows = self._query("SELECT * FROM entries WHERE sha256 = ? ORDER BY last_used DESC LIMIT 1", (sha256,))
+        return IndexEntry(rows[0]) if rows else None
+
+    def touch(self, key: str, when: float | None = None):
+        self._execute("UPDATE entries SET last_used = ? WHERE key = ?", (when or time.time(), key))
+
+    def put(self, key: str, slot: str, last_used: float | None = None, **fields: Any):
+        """Add or update an entry
+
+        Only the fields given are changed on an existing entry; unknown fields are an error."""
+        unknown = set(fields) - set(ENTRY_FIELDS)
+        if unknown:
+            raise TypeError(f"Unknown index fields: {', '.join(sorted(unknown))}")
+        now = time.time()
+        cols = ["key", "slot", "created", "last_used", *fields]
+        updates = ", ".join(f"{c} = excluded.{c}" for c in ["slot", "last_used", *fields])
+        self._execute(
+            f"INSERT INTO entries ({', '.join(cols)}) VALUES ({', '.join('?' * len(cols))}) "
+            f"ON CONFLICT (key) DO UPDATE SET {updates}",
+            (key, slot, now, last_used or now, *fields.values()),
+        )
+
+    def remove(self, key: str):
+        self._execute("DELETE FROM entries WHERE key = ?", (key,))
+
+    def add_alias(self, algorithm: str, digest: str, sha256: str):
+        self._execute(
+            "INSERT OR REPLACE INTO aliases (algorithm, digest, sha256) VALUES (?, ?, ?)",
+            (algorithm, digest.lower(), sha256.lower()),
+        )
+
+    def resolve_alias(self, algorithm: str, digest: str) -> str | None:
+        rows = self._query("SELECT sha256 FROM aliases WHERE algorithm = ? AND digest = ?", (algorithm, digest.lower()))
+        return rows[0]["sha256"] if rows else None
+
+    def aliases(self, sha256: str) -> dict[str, str]:
+        rows = self._query("SELECT algorithm, digest FROM aliases WHERE sha256 = ?", (sha256,))
+        return {r["algorithm"]: r["digest"] for r in rows}
+
+    def entries(self) -> list[IndexEntry]:
+        return [IndexEntry(r) for r in self._query("SELECT * FROM entries ORDER BY source, name, build_time")]
+
+    def contents(self) -> list[IndexContent]:
+        "All distinct contents, least recently used first"
+        rows = self._query(
+            "SELECT sha256, MAX(size) AS size, MAX(last_used) AS last_used, GROUP_CONCAT(slot, char(10)) AS slots "
+            "FROM entries WHERE sha256 IS NOT NULL GROUP BY sha256 ORDER BY last_used")
+        return [IndexContent(r["sha256"], r["size"] or 0, r["last_used"], r["slots"].split("\n")) for r in rows]
+
+    def remove_content(self, sha256: str):
+        with self._lock:
+            self._db.execute("BEGIN")
+            try:
+                self._db.execute("DELETE FROM entries WHERE sha256 = ?", (sha256,))
+                self._db.execute("DELETE FROM aliases WHERE sha256 = ?", (sha256,))
+            except BaseException:
+                self._db.execute("ROLLBACK")
+                raise
+            self._db.execute("COMMIT")
+
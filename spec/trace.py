@@ -0,0 +1,238 @@
+"""Timings of the phases of a run, of each jar, and of HTTP and store operations
+
+Tracing is off unless `enable` is called, and then `span` records how long a block
+took, in a lane named by `lane` (each jar gets its own) or after the current thread.
+The trace can be written in the Chrome trace format (for chrome://tracing or
+https://ui.perfetto.dev) and summarised as a table."""
+
+from __future__ import annotations
+
+import contextlib
+import contextvars
+import functools
+import json
+import os
+from pathlib import Path
+import threading
+import time
+from typing import Any, Callable, Iterator, TypeVar
+from urllib.parse import urlsplit
+
+F = TypeVar("F", bound=Callable[..., Any])
+
+
+class Event:
+    def __init__(self, name: str, cat: str, lane: str, start: float, end: float, args: dict[str, Any]):
+        self.name = name
+        self.cat = cat
+        self.lane = lane
+        self.start = start
+        self.end = end
+        self.args = args
+
+    name: str
+    cat: str  # "phase", "jar", "http", "store" or "deploy"
+    lane: str
+    start: float  # perf_counter seconds
+    end: float
+    args: dict[str, Any]
+
+    @property
+    def duration(self) -> float:
+        return self.end - self.start
+
+
+class Tracer:
+    "Events and counters recorded since tracing was enabled"
+
+    def __init__(self):
+        self.origin = time.perf_counter()
+        self.events = []
+        self.counters = {}
+        self._lock = threading.Lock()
+
+    origin: float
+    events: list[Event]
+    counters: dict[str, float]
+
+    def add(self, event: Event):
+        with self._lock:
+            self.events.append(event)
+
+    def count(self, name: str, n: float = 1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def chrome_trace(self) -> dict[str, Any]:
+        "The trace as a Chrome trace event document, with a lane (thread) per jar"
+        pid = os.getpid()
+        lanes: dict[str, int] = {}
+        events: list[dict[str, Any]] = []
+        with self._lock:
+            recorded = sorted(self.events, key=lambda e: e.start)
+            counters = dict(self.counters)
+        for e in recorded:
+            if e.lane not in lanes:
+                lanes[e.lane] = len(lanes) + 1
+                events.append({"name": "thread_name", "ph": "M", "pid": pid, "tid": lanes[e.lane], "args": {"name": e.lane}})
+            events.append({
+                "name": e.name,
+                "cat": e.cat,
+                "ph": "X",
+                "ts": round((e.start - self.origin) * 1e6, 1),
+                "dur": round(e.duration * 1e6, 1),
+                "pid": pid,
+                "tid": lanes[e.lane],
+                "args": e.args,
+            })
+        return {"traceEvents": events, "displayTimeUnit": "ms", "otherData": {"counters": counters}}
+
+    def write(self, path: str | Path):
+        with open(path, "w") as f:
+            json.dump(self.chrome_trace(), f, default=str)
+
+    def summary(self, top: int = 20) -> str:
+        "A table of the phases, the slowest jars and hosts, the HTTP cache and the store"
+        with self._lock:
+            recorded = list(self.events)
+            counters = dict(self.counters)
+        lines = []
+
+        phases = [e for e in recorded if e.cat == "phase"]
+        if phases:
+            lines.append(f"{'phase':<32} {'time (s)':>9}")
+            for e in sorted(phases, key=lambda e: e.start):
+                # phases run for each member of a network are in the member's lane
+                name = e.name if e.lane == "MainThread" else f"{e.name} ({e.lane})"
+                lines.append(f"{name[:32]:<32} {e.duration:>9.3f}")
+
+        by_lane: dict[str, list[Event]] = {}
+        for e in recorded:
+            by_lane.setdefault(e.lane, []).append(e)
+        jars = sorted((e for e in recorded if e.cat == "jar"), key=lambda e: -e.duration)
+        if jars:
+            lines.append("")
+            lines.append(f"{'total (s)':>9} {'api':>4} {'api (s)':>8} {'MiB':>7} {'download (s)':>12} "
+                         f"{'place (s)':>9}  jar (slowest first)")
+            for e in jars[:top]:
+                own = by_lane.get(e.lane, [])
+                api = [o for o in own if o.cat == "http" and o.name == "GET"]
+                downloads = [o for o in own if o.cat == "http" and o.name == "download"]
+                places = [o for o in own if o.cat == "deploy"]
+                size = sum(o.args.get("size") or 0 for o in downloads)
+                lines.append(
+                    f"{e.duration:>9.3f} {len(api):>4} {sum(o.duration for o in api):>8.3f} "
+                    f"{size / (1 << 20):>7.1f} {sum(o.duration for o in downloads):>12.3f} "
+                    f"{sum(o.duration for o in places):>9.3f}  {e.name}")
+            if len(jars) > top:
+                lines.append(f"... and {len(jars) - top} more")
+
+        hosts: dict[str, list[Event]] = {}
+        for e in recorded:
+            if e.cat == "http" and "url" in e.args:
+                hosts.setdefault(urlsplit(e.args["url"]).netloc, []).append(e)
+        if hosts:
+            lines.append("")
+            lines.append(f"{'total (s)':>9} {'calls':>6} {'mean (s)':>9} {'max (s)':>8}  host (slowest first)")
+            for host, es in sorted(hosts.items(), key=lambda h: -sum(e.duration for e in h[1])):
+                total = sum(e.duration for e in es)
+                lines.append(f"{total:>9.3f} {len(es):>6} {total / len(es):>9.3f} "
+                             f"{max(e.duration for e in es):>8.3f}  {host}")
+
+        cache: dict[str, int] = {}
+        for e in recorded:
+            if e.cat == "http" and "cache" in e.args:
+                cache[e.args["cache"]] = cache.get(e.args["cache"], 0) + 1
+        if cache or counters:
+            lines.append("")
+        if cache:
+            lines.append("API cache: " + ", ".join(f"{n} {outcome}" for outcome, n in sorted(cache.items())))
+        if counters:
+            lines.append("Counters: " + ", ".join(f"{name} {n:.0f}" for name, n in sorted(counters.items())))
+
+        store: dict[str, list[Event]] = {}
+        for e in recorded:
+            if e.cat == "store":
+                store.setdefault(e.name, []).append(e)
+        if store:
+            lines.append("")
+            lines.append(f"{'store operation':<32} {'calls':>6} {'total (s)':>9} {'mean (ms)':>9} {'max (ms)':>8}")
+            for name, es in sorted(store.items()):
+                total = sum(e.duration for e in es)
+                lines.append(f"{name:<32} {len(es):>6} {total:>9.3f} {total / len(es) * 1000:>9.2f} "
+                             f"{max(e.duration for e in es) * 1000:>8.2f}")
+
+        return "\n".join(lines)
+
+
+_tracer: Tracer | None = None
+_lane: contextvars.ContextVar[str | None] = contextvars.ContextVar("trace_lane", default=None)
+
+
+def enable() -> Tracer:
+    "Start recording, discarding anything recorded before"
+    global _tracer
+    _tracer = Tracer()
+    return _tracer
+
+
+def disable() -> Tracer | None:
+    "Stop recording, returning what was recorded"
+    global _tracer
+    tracer, _tracer = _tracer, None
+    return tracer
+
+
+def active() -> Tracer | None:
+    return _tracer
+
+
+@contextlib.contextmanager
+def lane(name: str) -> Iterator[None]:
+    "Record spans in the block (including in tasks and threads started from it with its context) in lane `name`"
+    token = _lane.set(name)
+    try:
+        yield
+    finally:
+        _lane.reset(token)
+
+
+@contextlib.contextmanager
+def span(name: str, cat: str, **args: Any) -> Iterator[dict[str, Any]]:
+    """Record how long the block takes
+
+    Yields the arguments of the span, to which the block may add its results.
+    When tracing is off, nothing is recorded."""
+    tracer = _tracer
+    if tracer is None:
+        yield args
+        return
+    start = time.perf_counter()
+    try:
+        yield args
+    except BaseException as e:
+        args["error"] = type(e).__name__
+        raise
+    finally:
+        end = time.perf_counter()
+        tracer.add(Event(name, cat, _lane.get() or threading.current_thread().name, start, end, args))
+
+
+def traced(name: str, cat: str) -> Callable[[F], F]:
+    "Decorator recording every call of a function as a span"
+    def decorator(func: F) -> F:
+        @functools.wraps(func)
+        def wrapper(*args: Any, **kwargs: Any) -> Any:
+            if _tracer is None:
+                return func(*args, **kwargs)
+            with span(name, cat):
+                return func(*args, **kwargs)
+        return wrapper  # type: ignore
+    return decorator
+
+
+def count(name: str, n: float = 1):
+    "Add `n` to a counter, if tracing"
+    tracer = _tracer
+    if tracer is not None:
+        tracer.count(name, n)
@@ -0,0 +1,102 @@
+from __future__ import annotations
+
+import json
+from pathlib import Path
+import sys
+import time
+
+import pytest
+
+from spec.jars import cds
+from spec.store import Store
+
+# stands in for `java`: reports a JDK 17 build, records how it was run, and fails if asked to
+JAVA = """\
+import json, os, sys
+if sys.argv[1:] == ["-version"]:
+    sys.stderr.write('openjdk version "17.0.2" 2022-01-18\\n')
+    sys.exit(0)
+with open(os.environ["FAKE_JAVA_LOG"], "a") as f:
+    f.write(json.dumps({"argv": sys.argv[1:], "cwd": os.getcwd()}) + "\\n")
+sys.exit(1 if os.path.exists(os.environ["FAKE_JAVA_FAIL"]) else 0)
+"""
+
+
+@pytest.fixture
+def java(tmp_path, monkeypatch):
+    path = tmp_path / "java"
+    path.write_text(f"#!{sys.executable}\n{JAVA}")
+    path.chmod(0o755)
+    monkeypatch.setenv("FAKE_JAVA_LOG", str(tmp_path / "java.log"))
+    monkeypatch.setenv("FAKE_JAVA_FAIL", str(tmp_path / "fail"))
+    cds.java_version.cache_clear()
+    return path
+
+
+def runs(tmp_path: Path) -> list[dict]:
+    log = tmp_path / "java.log"
+    return [json.loads(line) for line in log.read_text().splitlines()] if log.exists() else []
+
+
+@pytest.fixture
+def server(tmp_path):
+    folder = tmp_path / "server"
+    folder.mkdir()
+    (folder / "paper.jar").write_bytes(b"jar")
+    return folder
+
+
+def test_feature_version():
+    assert cds.feature_version('openjdk version "17.0.2" 2022-01-18') == 17
+    assert cds.feature_version('java version "1.8.0_302"') == 8
+
+
+def test_trains_then_uses_archive(tmp_path, java, server):
+    store = Store(tmp_path / "store")
+    options = ["-Xmx1G", "-Xms1G"]
+    train = cds.launch_options(store, str(java), options, Path("paper.jar"), server, check=False)
+    assert len(train) == 1 and train[0].startswith("-XX:ArchiveClassesAtExit=")
+
+    # the training launch dumps the archive when it exits
+    Path(train[0].partition("=")[2]).write_bytes(b"archive")
+    use = cds.launch_options(store, str(java), options, Path("paper.jar"), server, check=False)
+    assert len(use) == 1 and use[0].startswith("-XX:SharedArchiveFile=")
+    assert Path(use[0].partition("=")[2]).read_bytes() == b"archive"
+
+
+def test_check_runs_the_launch_command(tmp_path, java, server):
+    store = Store(tmp_path / "store")
+    archive = cds.Archive.for_launch(store, str(java), ["-Xmx1G", "-Xms1G"], Path("paper.jar"), server)
+    assert archive is not None
+    assert archive.check(tmp_path / "archive.jsa")
+    (run,) = runs(tmp_path)
+    assert run["cwd"] == str(server)
+    # the classpath the archive was recorded with, and not -Xms, which only slows the check
+    assert run["argv"][-2:] == ["-jar", "paper.jar"]
+    assert "-Xmx1G" in run["argv"] and "-Xms1G" not in run["argv"]
+    assert "-Xshare:on" in run["argv"] and "-XX:+PrintSharedArchiveAndExit" in run["argv"]
+
+
+def test_failed_check_marks_archive_stale(tmp_path, java, server):
+    store = Store(tmp_path / "store")
+    archive = cds.Archive.for_launch(store, str(java), [], Path("paper.jar"), server)
+    assert archive is not None
+    archive.training.write_bytes(b"archive")
+    path = archive.path()
+    assert path is not None
+
+    (tmp_path / "fail").touch()
+    archive.check_in_background(path)
+    deadline = time.monotonic() + 10
+    while not archive.stale_marker.exists() and time.monotonic() < deadline:
+        time.sleep(0.05)
+    assert archive.stale_marker.exists()
+    assert archive.path() is None
+    # so the next launch trains a new one
+    train = cds.launch_options(store, str(java), [], Path("paper.jar"), server, check=False)
+    assert train[0].startswith("-XX:ArchiveClassesAtExit=")
+
+
+def test_old_java_gets_no_archive(tmp_path, server, monkeypatch):
+    monkeypatch.setattr(cds, "java_version", lambda java: 'java version "1.8.0_302"')
+    assert cds.launch_options(Store(tmp_path / "store"), "java", [], Path("paper.jar"), server) == []
@@ -0,0 +1,96 @@
+from __future__ import annotations
+
+import gzip
+import io
+import re
+import threading
+
+import pytest
+
+from spec.console import ConsoleLog, Echo, RingBuffer, SegmentWriter, _Follower
+
+
+def test_ring_buffer_read():
+    ring = RingBuffer(1000)
+    for i in range(5):
+        ring.append(b"line %d\n" % i)
+    assert ring.read(0) == ([b"line %d\n" % i for i in range(5)], 5, 0)
+    assert ring.read(3) == ([b"line 3\n", b"line 4\n"], 5, 0)
+    assert ring.read(5, timeout=0) == ([], 5, 0)
+
+
+def test_ring_buffer_overwrites_oldest():
+    ring = RingBuffer(20)
+    for i in range(10):
+        ring.append(b"line %d\n" % i)  # 7 bytes each
+    assert ring.first == 8
+    assert ring.read(5) == ([b"line 8\n", b"line 9\n"], 10, 3)
+    assert ring.tail(1) == [b"line 9\n"]
+    assert ring.tail(5) == [b"line 8\n", b"line 9\n"]
+    assert ring.tail(0) == []
+
+
+def test_ring_buffer_keeps_an_oversized_line():
+    ring = RingBuffer(4)
+    ring.append(b"a long line\n")
+    assert ring.tail(1) == [b"a long line\n"]
+
+
+def test_ring_buffer_close():
+    ring = RingBuffer(100)
+    ring.append(b"last\n")
+    ring.close()
+    assert ring.read(0) == ([b"last\n"], 1, 0)
+    assert ring.read(1) is None
+
+
+def test_ring_buffer_wakes_reader():
+    ring = RingBuffer(100)
+    result = []
+    reader = threading.Thread(target=lambda: result.append(ring.read(0, timeout=10)))
+    reader.start()
+    ring.append(b"hello\n")
+    reader.join(10)
+    assert result == [([b"hello\n"], 1, 0)]
+
+
+def test_follower_is_abstract():
+    with pytest.raises(TypeError):
+        _Follower(RingBuffer(100), "follower")  # type: ignore[abstract]
+
+
+def test_echo_filters():
+    ring = RingBuffer(1000)
+    out = io.BytesIO()
+    echo = Echo(ring, out, "[a] ", exclude=re.compile("noise"))
+    echo.start()
+    for line in (b"hello\n", b"noise\n", b"world\n"):
+        ring.append(line)
+    ring.close()
+    echo.join(10)
+    assert out.getvalue() == b"[a] hello\n[a] world\n"
+
+
+def test_segment_writer_rotates_and_prunes(tmp_path):
+    ring = RingBuffer(1 << 20)
+    writer = SegmentWriter(ring, tmp_path, "gzip", segment_size=100, keep=3)
+    writer.start()
+    lines = [b"line %03d\n" % i for i in range(100)]  # 9 bytes each
+    for line in lines:
+        ring.append(line)
+    ring.close()
+    writer.join(10)
+    segments = sorted(tmp_path.glob("console-*.log.gz"), key=lambda p: p.stat().st_mtime_ns)
+    assert len(segments) == 3
+    data = b"".join(gzip.decompress(p.read_bytes()) for p in segments)
+    assert lines[-1] in data
+    assert lines[0] not in data
+
+
+def test_console_log_settings():
+    settings = ConsoleLog(segment_size="1M", buffer="2K", keep=5)
+    assert (settings.segment_size, settings.buffer, settings.keep) == (1 << 20, 2048, 5)
+    with pytest.raises(ValueError):
+        ConsoleLog(compression="lzma")
+    with pytest.raises(ValueError):
+        ConsoleLog(keep=0)
@@ -0,0 +1,138 @@
+from __future__ import annotations
+
+import hashlib
+from types import SimpleNamespace
+
+import pytest
+
+from spec.deploy import DeployMode
+from spec.generations import GenerationStore, activate, same_jars
+from spec.main import make_live
+from spec.spec import FolderSpecification
+
+
+def jar(folder: str, name: str, sha256: str) -> dict[str, str]:
+    return {"folder": folder, "name": name, "sha256": sha256}
+
+
+def make_generation(store: GenerationStore, files: dict[str, bytes]):
+    staging = store.stage()
+    jars = []
+    for path, data in files.items():
+        folder, name = path.split("/")
+        (staging / folder / name).write_bytes(data)
+        jars.append(jar(folder, name, hashlib.sha256(data).hexdigest()))
+    # as written by `build_generation`: the server is named by its filename
+    server = next(j["name"] for j in jars if j["folder"] == "server")
+    return store.commit(staging, server=server, jars=jars)
+
+
+@pytest.fixture
+def folders(tmp_path):
+    return FolderSpecification(tmp_path / "server", tmp_path / "server" / "plugins", generations=tmp_path / "generations")
+
+
+def test_same_jars(tmp_path):
+    store = GenerationStore(tmp_path)
+    gen = make_generation(store, {"server/paper.jar": b"a", "plugins/a.jar": b"b"})
+    a, paper = hashlib.sha256(b"b").hexdigest(), hashlib.sha256(b"a").hexdigest()
+    assert gen.server == "paper.jar"
+    assert same_jars(gen, [jar("plugins", "a.jar", a), jar("server", "paper.jar", paper)])
+    assert not same_jars(gen, [jar("server", "paper.jar", paper)])
+    assert not same_jars(gen, [jar("plugins", "a.jar", "other"), jar("server", "paper.jar", paper)])
+    assert not same_jars(None, [])
+
+
+def test_store_numbers_and_switches(tmp_path):
+    store = GenerationStore(tmp_path)
+    assert store.current() is None
+    first = make_generation(store, {"server/paper.jar": b"1"})
+    second = make_generation(store, {"server/paper.jar": b"2"})
+    assert [g.id for g in store.list()] == [1, 2]
+    assert store.current() is None
+
+    store.switch(second)
+    assert store.current().id == 2
+    assert store.previous().id == 1
+    store.switch(first)
+    assert store.current().id == 1
+    assert store.previous() is None
+
+
+def test_store_discards_staging(tmp_path):
+    store = GenerationStore(tmp_path)
+    staging = store.stage()
+    store.discard(staging)
+    assert not staging.exists()
+    assert store.list() == []
+
+
+def test_cleanup_keeps_current(tmp_path):
+    store = GenerationStore(tmp_path)
+    gens = [make_generation(store, {"server/paper.jar": bytes([i])}) for i in range(4)]
+    store.switch(gens[0])
+    removed = store.cleanup(keep=2)
+    assert [g.id for g in removed] == [2]
+    assert [g.id for g in store.list()] == [1, 3, 4]
+
+
+def test_activate_syncs_folders(tmp_path, folders):
+    store = GenerationStore(folders.generations)
+    old = make_generation(store, {"server/paper.jar": b"1", "plugins/a.jar": b"a"})
+    new = make_generation(store, {"server/paper.jar": b"2", "plugins/b.jar": b"b"})
+    activate(old, folders, DeployMode.Copy)
+    changed, removed = activate(new, folders, DeployMode.Copy)
+    assert (folders.server / "paper.jar").read_bytes() == b"2"
+    assert sorted(p.name for p in folders.plugins.glob("*.jar")) == ["b.jar"]
+    assert {p.name for p in changed} == {"paper.jar", "b.jar"}
+    assert [p.name for p in removed] == ["a.jar"]
+
+
+def test_make_live_switches_after_activating(tmp_path, folders, monkeypatch):
+    store = GenerationStore(folders.generations)
+    spec = SimpleNamespace(folders=folders)
+    old = make_generation(store, {"server/paper.jar": b"1"})
+    make_live(spec, store, old, DeployMode.Copy)
+    assert store.current().id == old.id
+
+    new = make_generation(store, {"server/paper.jar": b"2"})
+
+    def fail(*args, **kwargs):
+        raise OSError("No space left on device")
+    monkeypatch.setattr("spec.main.activate", fail)
+    with pytest.raises(OSError):
+        make_live(spec, store, new, DeployMode.Copy)
+    assert store.current().id == old.id
+
+
+def test_activate_skips_unchanged_files(tmp_path, folders):
+    store = GenerationStore(folders.generations)
+    old = make_generation(store, {"server/paper.jar": b"1", "plugins/a.jar": b"a"})
+    activate(old, folders, DeployMode.Hardlink)
+    new = make_generation(store, {"server/paper.jar": b"2", "plugins/a.jar": b"a"})
+    # hardlinked from the store in production; here the unchanged plugin is linked by hand
+    (new.path / "plugins" / "a.jar").unlink()
+    (new.path / "plugins" / "a.jar").hardlink_to(old.path / "plugins" / "a.jar")
+    changed, removed = activate(new, folders, DeployMode.Hardlink)
+    assert [p.name for p in changed] == ["paper.jar"]
+    assert removed == []
+
+
+def test_symlinks_switch_with_current(tmp_path, folders):
+    store = GenerationStore(folders.generations)
+    spec = SimpleNamespace(folders=folders)
+    old = make_generation(store, {"server/paper.jar": b"1", "plugins/a.jar": b"a"})
+    make_live(spec, store, old, DeployMode.Symlink)
+    assert (folders.server / "paper.jar").read_bytes() == b"1"
+
+    new = make_generation(store, {"server/paper.jar": b"2", "plugins/a.jar": b"a2"})
+    changed, removed = activate(new, folders, DeployMode.Symlink)
+    # the links already point through `current`, so nothing is relinked
+    assert changed == [] and removed == []
+    store.switch(new)
+    assert (folders.server / "paper.jar").read_bytes() == b"2"
+    assert (folders.plugins / "a.jar").read_bytes() == b"a2"
+
+    # and a rollback is the switch alone
+    store.switch(old)
+    assert (folders.server / "paper.jar").read_bytes() == b"1"
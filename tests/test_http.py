@@ -0,0 +1,119 @@
+from __future__ import annotations
+
+import hashlib
+from types import SimpleNamespace
+
+import pytest
+
+from bench.servers import StandIn
+from spec.http import HttpSessions, _plan_segments, _total_size, download_file, download_lock, download_to_store
+
+
+def response(status: int, **headers: str) -> SimpleNamespace:
+    return SimpleNamespace(status_code=status, headers=headers)
+
+
+def test_plan_segments_splits_the_rest():
+    assert _plan_segments(100, 1000, 4, 100) == [[0, 100, 0], [100, 400, 0], [400, 700, 0], [700, 1000, 0]]
+
+
+def test_plan_segments_respects_min_size():
+    assert _plan_segments(100, 250, 4, 100) == [[0, 100, 0], [100, 250, 0]]
+
+
+def test_plan_segments_small_file():
+    assert _plan_segments(100, 60, 4, 100) == [[0, 60, 0]]
+    assert _plan_segments(100, 100, 4, 100) == [[0, 100, 0]]
+
+
+def test_total_size():
+    assert _total_size(response(206, **{"Content-Range": "bytes 0-99/1000"})) == 1000
+    assert _total_size(response(206, **{"Content-Range": "bytes 0-99/*"})) is None
+    assert _total_size(response(200, **{"Content-Length": "1000"})) == 1000
+    assert _total_size(response(200)) is None
+
+
+@pytest.fixture
+def sessions():
+    s = HttpSessions(segments=4, segment_size=1 << 16)
+    yield s
+    s.close()
+
+
+def expected_sha256(server: StandIn, name: str) -> str:
+    return server.artifact(name).digest("sha256")
+
+
+@pytest.mark.parametrize("unknown_size", [False, True])
+def test_download_segmented(tmp_path, sessions, unknown_size):
+    with StandIn(artifact_size=300_000, unknown_size=unknown_size) as server:
+        dest = tmp_path / "server.jar"
+        digests = download_file(sessions, f"{server.url}/job/x/1/artifact/server.jar", dest)
+        sha256 = expected_sha256(server, "server.jar")
+    assert dest.stat().st_size == 300_000 + 32
+    assert hashlib.sha256(dest.read_bytes()).hexdigest() == sha256
+    assert digests["sha256"] == sha256
+    assert not dest.with_name("server.jar.part").exists()
+
+
+def test_download_resumes_after_failures(tmp_path, sessions):
+    with StandIn(artifact_size=300_000, failure_rate=0.3) as server:
+        dest = tmp_path / "server.jar"
+        sha256 = expected_sha256(server, "server.jar")
+        digests = download_file(sessions, f"{server.url}/job/x/1/artifact/server.jar", dest,
+                                expected={"sha256": sha256}, attempts=20)
+    assert digests["sha256"] == sha256
+
+
+def test_concurrent_downloads_to_one_destination(tmp_path, sessions):
+    from concurrent.futures import ThreadPoolExecutor
+    with StandIn(artifact_size=1 << 20) as server:
+        url = f"{server.url}/job/x/1/artifact/server.jar"
+        dest = tmp_path / "server.jar"
+        with ThreadPoolExecutor(4) as executor:
+            results = list(executor.map(lambda _: download_file(sessions, url, dest), range(4)))
+        sha256 = expected_sha256(server, "server.jar")
+    assert all(d["sha256"] == sha256 for d in results)
+    assert hashlib.sha256(dest.read_bytes()).hexdigest() == sha256
+
+
+def test_concurrent_downloads_into_the_store_download_once(tmp_path, sessions):
+    from concurrent.futures import ThreadPoolExecutor
+    from spec.store import Store
+    store = Store(tmp_path / "store")
+    with StandIn(artifact_size=1 << 20) as server:
+        url = f"{server.url}/job/x/1/artifact/server.jar"
+        with ThreadPoolExecutor(4) as executor:
+            results = list(executor.map(
+                lambda _: download_to_store(sessions, store, ("Test", url), url, name="server.jar"), range(4)))
+        sent = server.stats.bytes_sent
+        sha256 = expected_sha256(server, "server.jar")
+    assert sent < 2 << 20
+    assert {path for path, _ in results} == {store.fetch(("Test", url))}
+    assert all(digests["sha256"] == sha256 for _, digests in results)
+    assert store.get_digests(("Test", url))["sha256"] == sha256
+
+
+def test_download_lock_is_held_across_processes(tmp_path):
+    import subprocess
+    import sys
+    import time
+    dest = tmp_path / "server.jar"
+    holder = subprocess.Popen(
+        [sys.executable, "-c", "import sys, time\nfrom spec.http import download_lock\n"
+         f"with download_lock({str(dest)!r}):\n    print('locked', flush=True)\n    time.sleep(1)\n"],
+        stdout=subprocess.PIPE, text=True,
+    )
+    try:
+        assert holder.stdout.readline() == "locked\n"
+        start = time.monotonic()
+        with download_lock(dest):
+            waited = time.monotonic() - start
+    finally:
+        holder.wait()
+    assert waited > 0.5
+
+
+def test_download_lock_is_reentrant(tmp_path):
+    with download_lock(tmp_path / "a"), download_lock(tmp_path / "a"):
+        pass
@@ -0,0 +1,109 @@
+from __future__ import annotations
+
+import asyncio
+import re
+
+import pytest
+
+from spec.jars.jenkins import ArtifactFilenameRegexRestriction, JenkinsBuildJar, SuccessRestriction
+
+
+@pytest.mark.parametrize("batch, expected", [(20, 20), (1, 1), (0, None), (None, None)])
+def test_batch(batch, expected):
+    assert JenkinsBuildJar("https://ci.example.org", job="plugin", batch=batch).batch == expected
+
+
+def test_negative_batch():
+    with pytest.raises(ValueError, match="None or 0"):
+        JenkinsBuildJar("https://ci.example.org", batch=-1)
+
+
+def test_url():
+    assert JenkinsBuildJar("https://ci.example.org/", job="plugin").baseurl == "https://ci.example.org/job/plugin"
+
+
+class FakeJob:
+    """Stands in for `_api_get` of a job with builds 1 to `builds`, of which only `successful` succeeded
+
+    Every build has a plugin jar and a sources jar. Requests are recorded in `calls`."""
+
+    def __init__(self, builds: int, successful: set[int]):
+        self.builds = [
+            {
+                "number": n,
+                "url": f"https://ci.example.org/job/plugin/{n}/",
+                "result": "SUCCESS" if n in successful else "FAILURE",
+                "timestamp": n * 1000,
+                "artifacts": [
+                    {"fileName": f"Plugin-{n}.jar", "relativePath": f"target/Plugin-{n}.jar"},
+                    {"fileName": f"Plugin-{n}-sources.jar", "relativePath": f"target/Plugin-{n}-sources.jar"},
+                ],
+            }
+            for n in range(builds, 0, -1)
+        ]
+        self.successful = successful
+        self.calls: list[tuple[str, str | None]] = []
+
+    async def __call__(self, url: str, tree: str | None = None, http=None) -> dict:
+        self.calls.append((url, tree))
+        if tree is None:  # a single build
+            return next(dict(b, artifacts=list(b["artifacts"])) for b in self.builds if b["url"] == url)
+        if tree == "builds[url]":
+            return {"builds": [{"url": b["url"]} for b in self.builds]}
+        if tree.startswith("lastStableBuild"):
+            stable = next((b for b in self.builds if b["number"] in self.successful), None)
+            return {"lastStableBuild": stable}
+        m = re.fullmatch(r"builds\[.*\]\{(\d+),(\d+)\}", tree)
+        assert m, tree
+        start, end = int(m.group(1)), int(m.group(2))
+        return {"builds": [dict(b, artifacts=list(b["artifacts"])) for b in self.builds[start:end]]}
+
+
+def latest(jar: JenkinsBuildJar, job: FakeJob) -> dict:
+    jar._api_get = job  # type: ignore[method-assign]
+    return asyncio.run(jar.fetch_latest_filtered_build())
+
+
+RESTRICTIONS = [SuccessRestriction(""), ArtifactFilenameRegexRestriction(r"Plugin-\d+\.jar")]
+
+
+def test_batched_pages_stop_at_the_first_match():
+    job = FakeJob(50, successful={38, 20})
+    build = latest(JenkinsBuildJar("https://ci.example.org", job="plugin", restrictions=RESTRICTIONS, batch=5), job)
+    assert build["number"] == 38
+    # builds 50 to 38 are the first 13, so the third page of 5 is the last needed
+    assert [tree.rpartition("]")[2] for _, tree in job.calls] == ["{0,5}", "{5,10}", "{10,15}"]
+    assert all(url == "https://ci.example.org/job/plugin" for url, _ in job.calls)
+    assert all(tree.startswith("builds[number,url,result,timestamp,artifacts[") for _, tree in job.calls)
+
+
+def test_batched_restrictions_are_checked_locally():
+    job = FakeJob(10, successful={7})
+    build = latest(JenkinsBuildJar("https://ci.example.org", job="plugin", restrictions=RESTRICTIONS, batch=20), job)
+    assert len(job.calls) == 1
+    # the artifact restriction filtered the build's artifacts
+    assert [a["fileName"] for a in build["artifacts"]] == ["Plugin-7.jar"]
+
+
+def test_batched_without_a_match():
+    job = FakeJob(12, successful=set())
+    jar = JenkinsBuildJar("https://ci.example.org", job="plugin", restrictions=RESTRICTIONS, batch=5)
+    with pytest.raises(ValueError, match="No builds match"):
+        latest(jar, job)
+    # the third page is short, so it is the last
+    assert len(job.calls) == 3
+
+
+def test_batched_without_restrictions_takes_the_last_stable_build():
+    job = FakeJob(10, successful={8, 3})
+    build = latest(JenkinsBuildJar("https://ci.example.org", job="plugin", batch=5), job)
+    assert build["number"] == 8
+    assert len(job.calls) == 1 and job.calls[0][1].startswith("lastStableBuild[number,url,")
+
+
+def test_unbatched_fetches_builds_one_by_one_until_a_match():
+    job = FakeJob(10, successful={7})
+    build = latest(JenkinsBuildJar("https://ci.example.org", job="plugin", restrictions=RESTRICTIONS, batch=None), job)
+    assert build["number"] == 7
+    assert [tree for _, tree in job.calls] == ["builds[url]", None, None, None, None]
+    assert [url for url, _ in job.calls[1:]] == [f"https://ci.example.org/job/plugin/{n}/" for n in (10, 9, 8, 7)]
@@ -0,0 +1,38 @@
+from __future__ import annotations
+
+import hashlib
+
+import pytest
+
+from spec.http import ChecksumError
+from spec.lock import LockedJar
+from spec.store import Store
+
+
+def locked_file(tmp_path, data: bytes) -> LockedJar:
+    path = tmp_path / "plugin.jar"
+    path.write_bytes(data)
+    return LockedJar("plugin", [{
+        "name": path.name,
+        "url": path.as_uri(),
+        "storekey": ["FileJar", str(path)],
+        "digests": {"sha256": hashlib.sha256(data).hexdigest()},
+    }])
+
+
+def test_locked_local_file(tmp_path):
+    store = Store(tmp_path / "store", http_cache=False)
+    jar = locked_file(tmp_path, b"locked")
+    [ji] = jar.fetch(store)
+    assert ji.path.read_bytes() == b"locked"
+    assert store.get_digests(ji.storekey)["sha256"] == hashlib.sha256(b"locked").hexdigest()
+
+
+def test_changed_local_file_is_not_stored(tmp_path):
+    store = Store(tmp_path / "store", http_cache=False)
+    jar = locked_file(tmp_path, b"locked")
+    (tmp_path / "plugin.jar").write_bytes(b"changed")
+    with pytest.raises(ChecksumError, match="has changed since it was locked"):
+        jar.fetch(store)
+    assert store.fetch(["FileJar", str(tmp_path / "plugin.jar")]) is None
+    assert not store.get_name(["FileJar", str(tmp_path / "plugin.jar")]).exists()
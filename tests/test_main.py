@@ -0,0 +1,63 @@
+from __future__ import annotations
+
+import json
+from pathlib import Path
+import shutil
+
+import pytest
+
+from bench.__main__ import write_spec
+from bench.servers import StandIn
+from spec.lock import read_lock
+from spec.main import main
+
+
+@pytest.fixture
+def standin():
+    with StandIn(artifact_size=1000) as server:
+        yield server
+
+
+@pytest.fixture
+def specfile(tmp_path: Path, standin: StandIn) -> Path:
+    path = tmp_path / "spec.yml"
+    write_spec(path, standin, plugins=2, batch=20, pool_size=4, version_group="1.20")
+    return path
+
+
+def test_gc_resolves_without_downloading(specfile, standin, capsys):
+    main(["--dl", str(specfile)])
+    downloads = standin.stats.downloads
+    capsys.readouterr()
+
+    main(["--gc", str(specfile)])
+    out = capsys.readouterr().out
+    assert "Resolving 3 jars" in out
+    assert "Download" not in out
+    assert "Removed 0 store files" in out
+    assert standin.stats.downloads == downloads
+
+
+def test_lock_round_trip(tmp_path, specfile, standin, capsys):
+    main(["--lock", str(specfile)])
+    lockfile = specfile.with_suffix(".lock")
+    lock = json.loads(lockfile.read_text())
+    assert [j["folder"] for j in lock["jars"]] == ["server", "plugins", "plugins"]
+    server = lock["jars"][0]["files"][0]
+    assert server["name"] == "paper-1.20.2-50.jar"
+    assert server["digests"]["sha256"] == standin.artifact(server["name"]).digest("sha256")
+
+    # newer builds are published, and the deployment starts from nothing
+    standin.builds += 5
+    for name in ("store", "store.http", "server"):
+        shutil.rmtree(tmp_path / name, ignore_errors=True)
+
+    assert [(folder, jar.label) for folder, jar in read_lock(lockfile)] == \
+        [(j["folder"], j["source"]) for j in lock["jars"]]
+    main(["--dl", "--locked", str(specfile)])
+    assert "Downloading 3 jars" in capsys.readouterr().out
+    deployed = tmp_path / "server"
+    artifact = standin.artifact("paper-1.20.2-50.jar")
+    assert (deployed / "paper-1.20.2-50.jar").read_bytes() == artifact.read(0, artifact.size)
+    plugins = {f["name"] for j in lock["jars"][1:] for f in j["files"]}
+    assert {p.name for p in (deployed / "plugins").glob("*.jar")} == plugins
@@ -0,0 +1,113 @@
+from __future__ import annotations
+
+import io
+import subprocess
+import sys
+import threading
+from pathlib import Path
+from types import SimpleNamespace
+
+import pytest
+
+from spec.main.network import for_each_member, run_network
+
+# a server which prints a line, then runs until it reads `stop`
+SERVER = "import sys\nprint('started', flush=True)\nfor line in sys.stdin:\n    if line.strip() == 'stop':\n        break\n"
+
+
+class FakeServer:
+    stop_command = "stop"
+
+    def __init__(self, barrier: threading.Barrier | None = None, fail: bool = False):
+        self.barrier = barrier
+        self.fail = fail
+        self.process = None
+
+    def start(self, path: Path, cwd: Path, store=None, **popen):
+        if self.barrier is not None:
+            self.barrier.wait()
+        if self.fail:
+            raise OSError("cannot launch")
+        self.process = subprocess.Popen([sys.executable, "-c", SERVER], cwd=cwd, **popen)
+        return self.process
+
+
+def member(tmp_path: Path, server: FakeServer):
+    return SimpleNamespace(server=server, folders=SimpleNamespace(server=tmp_path), store=None, console=None)
+
+
+def test_for_each_member_prefixes_output(capsys):
+    stdout = sys.stdout
+    # both members write half a line before either finishes it
+    barrier = threading.Barrier(2, timeout=10)
+
+    def func(name, member, out):
+        assert sys.stdout is stdout
+        print(f"hello from {member}", file=out)
+        out.write("two ")
+        barrier.wait()
+        out.write("parts\n")
+        return name.upper()
+
+    results = for_each_member({"a": 1, "b": 2}, func)
+    assert results == {"a": "A", "b": "B"}
+    lines = sorted(capsys.readouterr().out.splitlines())
+    assert lines == ["[a] hello from 1", "[a] two parts", "[b] hello from 2", "[b] two parts"]
+
+
+def test_for_each_member_writes_unfinished_lines(capsys):
+    for_each_member({"a": 1}, lambda name, member, out: out.write("no newline"))
+    assert capsys.readouterr().out == "[a] no newline"
+
+
+def test_run_network_launches_at_once(tmp_path, monkeypatch):
+    monkeypatch.setattr(sys, "stdin", io.StringIO())
+    # each launch waits for the other, so they only complete if they run in parallel
+    barrier = threading.Barrier(2, timeout=10)
+    servers = {name: (member(tmp_path, FakeServer(barrier)), tmp_path / "server.jar") for name in ("a", "b")}
+
+    def stop():
+        for m, _ in servers.values():
+            while m.server.process is None:
+                threading.Event().wait(0.05)
+            m.server.process.stdin.write(b"stop\n")
+            m.server.process.stdin.flush()
+    threading.Thread(target=stop, daemon=True).start()
+    run_network(servers)
+    assert all(m.server.process.returncode == 0 for m, _ in servers.values())
+
+
+def test_run_network_stops_started_servers_when_a_launch_fails(tmp_path):
+    started = FakeServer()
+    servers = {
+        "a": (member(tmp_path, started), tmp_path / "server.jar"),
+        "b": (member(tmp_path, FakeServer(fail=True)), tmp_path / "server.jar"),
+    }
+    with pytest.raises(OSError):
+        run_network(servers)
+    assert started.process is not None
+    assert started.process.returncode == 0
+
+
+def test_members_differing_only_in_launch_settings_share_a_download(tmp_path, capsys):
+    from bench.servers import StandIn
+    from spec.main import main
+
+    with StandIn(artifact_size=1 << 22) as server:
+        members = "".join(f"""
+  {name}:
+    server: !jar.paper
+      project: paper
+      version_group: "1.20"
+      memory: {memory}
+      api: {server.paper_api}
+    folders: {{server: {tmp_path / name}, plugins: {tmp_path / name / "plugins"}}}""" for name, memory in [("lobby", "2G"), ("survival", "6G")])
+        spec = tmp_path / "network.yml"
+        spec.write_text(f"--- !network\nstore: !store.default\n  directory: {tmp_path / 'store'}\nmembers:{members}\n")
+        main(["--dl", str(spec)])
+        sent = server.stats.bytes_sent
+
+    assert "Downloading 1 jars for 2 servers" in capsys.readouterr().out
+    assert sent < 2 << 22  # the jar was sent once
+    for name in ("lobby", "survival"):
+        assert (tmp_path / name / "paper-1.20.2-50.jar").stat().st_size == (1 << 22) + 32
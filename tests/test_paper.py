@@ -0,0 +1,20 @@
+from __future__ import annotations
+
+import pytest
+
+from spec.jars.paper import PaperJar
+
+
+@pytest.mark.parametrize("project, command", [
+    ("paper", "stop"),
+    ("folia", "stop"),
+    ("waterfall", "end"),
+    ("velocity", "end"),
+    ("travertine", "end"),
+])
+def test_default_stop_command(project, command):
+    assert PaperJar(project, "1.20").stop_command == command
+
+
+def test_explicit_stop_command():
+    assert PaperJar("folia", "1.20", stop_command="shutdown").stop_command == "shutdown"
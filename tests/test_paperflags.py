@@ -0,0 +1,148 @@
+from __future__ import annotations
+
+import os
+from pathlib import Path
+
+import pytest
+
+from spec.jars.paper.paperflags import GiB, MiB, HostResources, auto_heap, g1_region_size, gc_threads, get_flags
+
+
+def flag(flags, name: str) -> str | None:
+    return next((f.partition("=")[2] for f in flags if f.startswith(name + "=")), None)
+
+
+@pytest.mark.parametrize("memory, heap", [
+    (512 * MiB, 384 * MiB),
+    (1 * GiB, 512 * MiB),
+    (2 * GiB, 1 * GiB),
+    (8 * GiB, 6553 * MiB),
+    (64 * GiB, 60 * GiB),
+])
+def test_auto_heap(memory, heap):
+    assert auto_heap(HostResources(memory, 4)) == heap
+
+
+@pytest.mark.parametrize("memory", [256 * MiB, 512 * MiB, 700 * MiB, GiB, 3 * GiB, 16 * GiB])
+def test_auto_heap_stays_below_the_limit(memory):
+    heap = auto_heap(HostResources(memory, 1))
+    assert 0 < heap < memory
+    assert heap % MiB == 0
+
+
+@pytest.mark.parametrize("heap, region", [
+    (1 * GiB, 4 * MiB),
+    (8 * GiB, 4 * MiB),
+    (16 * GiB, 8 * MiB),
+    (32 * GiB, 16 * MiB),
+    (64 * GiB, 32 * MiB),
+    (256 * GiB, 32 * MiB),
+])
+def test_g1_region_size(heap, region):
+    assert g1_region_size(heap) == region
+
+
+@pytest.mark.parametrize("cpus, threads", [(0.5, (1, 1)), (2, (2, 1)), (8, (8, 2)), (16, (13, 3)), (64, (43, 11))])
+def test_gc_threads(cpus, threads):
+    assert gc_threads(cpus) == threads
+
+
+def test_auto_flags():
+    flags = get_flags("auto", host=HostResources(32 * GiB, 16))
+    assert flags[:2] == ["-Xmx28672M", "-Xms28672M"]
+    assert flag(flags, "-XX:G1HeapRegionSize") == "8M"
+    assert flag(flags, "-XX:ParallelGCThreads") == "13"
+    assert flag(flags, "-XX:ConcGCThreads") == "3"
+
+
+@pytest.mark.parametrize("memory, region", [("4G", "4M"), ("24G", "8M"), ("40960M", "16M"), ("64g", "32M")])
+def test_explicit_memory_sizes_regions(memory, region):
+    flags = get_flags(memory)
+    assert flags[0] == "-Xmx" + memory
+    assert flag(flags, "-XX:G1HeapRegionSize") == region
+
+
+def test_explicit_memory_sizes_zgc():
+    assert flag(get_flags("10G", gc="zgc"), "-XX:SoftMaxHeapSize") == "9216M"
+
+
+def test_no_memory():
+    flags = get_flags(False)
+    assert not any(f.startswith(("-Xmx", "-Xms")) for f in flags)
+    assert flag(flags, "-XX:G1HeapRegionSize") == "8M"
+
+
+def test_invalid_memory():
+    with pytest.raises(ValueError):
+        get_flags("lots")
+
+
+UNLIMITED_V1 = "9223372036854771712"  # the largest page-aligned 64-bit value
+HOST_CPUS = float(len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else os.cpu_count() or 1)
+
+
+def fake_host(root: Path, cgroup: str, files: dict[str, str], memory: int = 16 * GiB) -> HostResources:
+    "Detect the resources of a host with the given /proc/self/cgroup, and files under /sys/fs/cgroup"
+    (root / "proc" / "self").mkdir(parents=True)
+    (root / "proc" / "self" / "cgroup").write_text(cgroup)
+    (root / "proc" / "meminfo").write_text(f"MemTotal:       {memory // 1024} kB\nMemFree:        1024 kB\n")
+    for name, content in files.items():
+        path = root / "sys" / "fs" / "cgroup" / name
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(content + "\n")
+    return HostResources.detect(proc=root / "proc", sysfs=root / "sys")
+
+
+def test_detect_without_cgroups(tmp_path):
+    host = fake_host(tmp_path, "", {}, memory=8 * GiB)
+    assert (host.memory, host.cpus) == (8 * GiB, HOST_CPUS)
+
+
+def test_detect_v2_unlimited(tmp_path):
+    host = fake_host(tmp_path, "0::/system.slice/mc.service\n", {
+        "system.slice/mc.service/memory.max": "max",
+        "system.slice/mc.service/cpu.max": "max 100000",
+    })
+    assert (host.memory, host.cpus) == (16 * GiB, HOST_CPUS)
+
+
+def test_detect_v2_limits(tmp_path):
+    host = fake_host(tmp_path, "0::/system.slice/mc.service\n", {
+        "system.slice/mc.service/memory.max": str(3 * GiB),
+        "system.slice/mc.service/cpu.max": "100000 100000",
+    })
+    assert (host.memory, host.cpus) == (3 * GiB, 1)
+
+
+def test_detect_v2_limit_on_parent(tmp_path):
+    host = fake_host(tmp_path, "0::/machine.slice/mc.scope\n", {
+        "machine.slice/memory.max": str(2 * GiB),
+        "machine.slice/mc.scope/memory.max": "max",
+    })
+    assert host.memory == 2 * GiB
+
+
+def test_detect_v2_inside_namespace(tmp_path):
+    # the container's own cgroup is mounted at the root
+    host = fake_host(tmp_path, "0::/\n", {"memory.max": str(GiB)})
+    assert host.memory == GiB
+
+
+def test_detect_v1_unlimited(tmp_path):
+    host = fake_host(tmp_path, "5:memory:/docker/abc\n4:cpu,cpuacct:/docker/abc\n", {
+        "memory/docker/abc/memory.limit_in_bytes": UNLIMITED_V1,
+        "cpu,cpuacct/docker/abc/cpu.cfs_quota_us": "-1",
+        "cpu,cpuacct/docker/abc/cpu.cfs_period_us": "100000",
+    })
+    assert (host.memory, host.cpus) == (16 * GiB, HOST_CPUS)
+
+
+def test_detect_v1_limits_on_parent(tmp_path):
+    host = fake_host(tmp_path, "5:memory:/docker/abc\n4:cpu,cpuacct:/docker/abc\n", {
+        "memory/docker/abc/memory.limit_in_bytes": UNLIMITED_V1,
+        "memory/docker/memory.limit_in_bytes": str(4 * GiB),
+        # joined controllers are also linked under each name
+        "cpu/docker/cpu.cfs_quota_us": "50000",
+        "cpu/docker/cpu.cfs_period_us": "100000",
+    })
+    assert (host.memory, host.cpus) == (4 * GiB, 1)  # at least one CPU
@@ -0,0 +1,100 @@
+from __future__ import annotations
+
+import os
+from pathlib import Path
+
+import pytest
+
+from spec import speccache
+from spec.spec import Specification
+from spec.speccache import cache_path, load_compiled
+
+
+class Builder:
+    "Counts how often the file is built, returning its contents as the object"
+
+    def __init__(self):
+        self.calls = 0
+
+    def __call__(self, data: bytes) -> dict:
+        self.calls += 1
+        return {"data": data}
+
+
+@pytest.fixture
+def spec_file(tmp_path):
+    path = tmp_path / "spec.yml"
+    path.write_bytes(b"one")
+    return path
+
+
+def test_second_load_uses_the_cache(spec_file):
+    build = Builder()
+    assert load_compiled(spec_file, build) == {"data": b"one"}
+    assert cache_path(spec_file).exists()
+    assert load_compiled(spec_file, build) == {"data": b"one"}
+    assert build.calls == 1
+
+
+def test_changed_file_is_rebuilt(spec_file):
+    build = Builder()
+    load_compiled(spec_file, build)
+    spec_file.write_bytes(b"two")
+    assert load_compiled(spec_file, build) == {"data": b"two"}
+    assert build.calls == 2
+
+
+def test_touched_file_is_rebuilt(spec_file):
+    build = Builder()
+    load_compiled(spec_file, build)
+    st = spec_file.stat()
+    os.utime(spec_file, ns=(st.st_atime_ns, st.st_mtime_ns + 1_000_000_000))
+    load_compiled(spec_file, build)
+    assert build.calls == 2
+
+
+def test_changed_code_is_rebuilt(spec_file, monkeypatch):
+    build = Builder()
+    load_compiled(spec_file, build)
+    monkeypatch.setattr(speccache, "code_fingerprint", lambda: "other code")
+    load_compiled(spec_file, build)
+    assert build.calls == 2
+
+
+def test_cache_can_be_bypassed(spec_file):
+    build = Builder()
+    load_compiled(spec_file, build)
+    load_compiled(spec_file, build, use_cache=False)
+    assert build.calls == 2
+
+
+def test_unreadable_cache_is_rebuilt(spec_file, capsys):
+    build = Builder()
+    load_compiled(spec_file, build)
+    cache_path(spec_file).write_bytes(b"not a pickle")
+    assert load_compiled(spec_file, build) == {"data": b"one"}
+    assert build.calls == 2
+    assert "Ignoring unreadable specification cache" in capsys.readouterr().out
+    # and the cache was replaced by a good one
+    load_compiled(spec_file, build)
+    assert build.calls == 2
+
+
+def test_unpicklable_object_is_not_cached(spec_file, capsys):
+    load_compiled(spec_file, lambda data: (lambda: data))
+    assert not cache_path(spec_file).exists()
+    assert "Cannot cache the compiled specification" in capsys.readouterr().out
+
+
+def test_example_specification_round_trips(tmp_path, monkeypatch):
+    example = Path(__file__).parent.parent / "example-spec.yml"
+    path = tmp_path / "spec.yml"
+    path.write_bytes(example.read_bytes())
+    monkeypatch.chdir(tmp_path)
+    fresh = Specification.from_file(path)
+    assert cache_path(path).exists()
+    cached = Specification.from_file(path)
+    assert cached is not fresh
+    assert repr(cached.server) == repr(fresh.server)
+    assert [repr(p) for p in cached.plugins] == [repr(p) for p in fresh.plugins]
+    assert cached.folders.server == fresh.folders.server
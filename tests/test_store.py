@@ -0,0 +1,111 @@
+from __future__ import annotations
+
+import hashlib
+import os
+import time
+from pathlib import Path
+
+from spec.store import Store
+from spec.storeindex import encode_key
+
+DAY = 86400
+
+
+def put(store: Store, tmp_path: Path, name: str, data: bytes, used: float) -> Path:
+    "Store `data` under a key named `name`, last used at `used`"
+    src = tmp_path / "src" / name
+    src.parent.mkdir(exist_ok=True)
+    src.write_bytes(data)
+    key = ("FileJar", name)
+    path = store.put_file(key, src)
+    store.index.touch(encode_key(key), when=used)
+    return path
+
+
+def sha(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+def make_store(tmp_path: Path, **limits) -> Store:
+    return Store(tmp_path / "store", http_cache=False, **limits)
+
+
+def test_evicts_least_recently_used_until_within_max_size(tmp_path):
+    store = make_store(tmp_path, max_size=250)
+    now = time.time()
+    old = put(store, tmp_path, "old.jar", b"a" * 100, now - 30)
+    mid = put(store, tmp_path, "mid.jar", b"b" * 100, now - 20)
+    new = put(store, tmp_path, "new.jar", b"c" * 100, now - 10)
+
+    gc = store.collect_garbage()
+    assert set(gc.removed) == {old, store.get_blob(sha(b"a" * 100))}
+    assert (gc.freed, gc.kept) == (100, 200)
+    assert not old.exists() and mid.exists() and new.exists()
+    assert store.fetch(("FileJar", "old.jar")) is None
+    assert store.fetch_digest("sha256", sha(b"a" * 100)) is None
+
+
+def test_evicts_content_unused_for_max_age(tmp_path):
+    store = make_store(tmp_path, max_age=7)
+    now = time.time()
+    stale = put(store, tmp_path, "stale.jar", b"a", now - 8 * DAY)
+    recent = put(store, tmp_path, "recent.jar", b"b", now - 6 * DAY)
+
+    gc = store.collect_garbage()
+    assert stale in gc.removed
+    assert not stale.exists() and recent.exists()
+
+
+def test_keys_with_the_same_content_are_evicted_together(tmp_path):
+    store = make_store(tmp_path, max_size=0)
+    now = time.time()
+    a = put(store, tmp_path, "a.jar", b"same", now - 20)
+    b = put(store, tmp_path, "b.jar", b"same", now - 10)
+    assert a.samefile(b)
+
+    gc = store.collect_garbage()
+    assert set(gc.removed) == {a, b, store.get_blob(sha(b"same"))}
+    assert gc.freed == len(b"same")  # counted once
+
+
+def test_keeps_protected_digests_and_paths(tmp_path):
+    store = make_store(tmp_path, max_size=0)
+    now = time.time()
+    by_digest = put(store, tmp_path, "digest.jar", b"a", now - 30)
+    by_path = put(store, tmp_path, "path.jar", b"b", now - 20)
+    other = put(store, tmp_path, "other.jar", b"c", now - 10)
+
+    gc = store.collect_garbage(protect_paths=[by_path], protect_digests=[sha(b"a").upper()])
+    assert other in gc.removed
+    assert by_digest.exists() and by_path.exists() and not other.exists()
+
+
+def test_keeps_content_linked_from_outside_the_store(tmp_path):
+    store = make_store(tmp_path, max_size=0)
+    deployed = put(store, tmp_path, "deployed.jar", b"a", time.time() - 20)
+    unused = put(store, tmp_path, "unused.jar", b"b", time.time() - 10)
+    # as placed in a generation or a server folder
+    os.link(deployed, tmp_path / "server.jar")
+
+    gc = store.collect_garbage()
+    assert gc.removed == [unused, store.get_blob(sha(b"b"))]
+    assert deployed.exists()
+    assert gc.kept == 1
+
+
+def test_dry_run_removes_nothing(tmp_path):
+    store = make_store(tmp_path, max_size=0)
+    path = put(store, tmp_path, "a.jar", b"a", time.time())
+
+    gc = store.collect_garbage(dry=True)
+    assert path in gc.removed
+    assert path.exists()
+    assert store.fetch(("FileJar", "a.jar")) == path
+
+
+def test_no_limits_keeps_everything(tmp_path):
+    store = make_store(tmp_path)
+    path = put(store, tmp_path, "a.jar", b"a", time.time() - 365 * DAY)
+    gc = store.collect_garbage()
+    assert gc.removed == [] and gc.kept == 1
+    assert path.exists()
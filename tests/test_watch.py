@@ -0,0 +1,190 @@
+from __future__ import annotations
+
+from datetime import datetime, time
+import json
+from pathlib import Path
+from types import SimpleNamespace
+
+import pytest
+
+from spec.deploy import DeployMode
+from spec.jars.base import BaseLaunchableJar, JarInfo
+from spec.main import watch
+from spec.main.watch import Watcher, in_window, next_window
+from spec.spec import FolderSpecification, Specification
+from spec.store import Store
+
+NIGHT = (time(23, 0), time(2, 0))  # wraps past midnight
+MORNING = (time(4, 0), time(6, 30))
+
+
+def at(hour: int, minute: int = 0, day: int = 10) -> datetime:
+    return datetime(2024, 5, day, hour, minute)
+
+
+@pytest.mark.parametrize("when, inside", [
+    (at(4), True),
+    (at(6, 29), True),
+    (at(6, 30), False),  # the end is not in the window
+    (at(3, 59), False),
+    (at(12), False),
+])
+def test_in_window(when, inside):
+    assert in_window(when, [MORNING]) is inside
+
+
+@pytest.mark.parametrize("when, inside", [(at(23), True), (at(0, 30), True), (at(1, 59), True), (at(2), False), (at(22, 59), False)])
+def test_in_window_past_midnight(when, inside):
+    assert in_window(when, [NIGHT]) is inside
+
+
+def test_in_any_window():
+    assert in_window(at(5), [NIGHT, MORNING])
+    assert in_window(at(0), [NIGHT, MORNING])
+    assert not in_window(at(3), [NIGHT, MORNING])
+    assert not in_window(at(3), [])
+
+
+def test_next_window():
+    assert next_window(at(5), [MORNING]) == at(5)
+    assert next_window(at(3), [MORNING]) == at(4)
+    assert next_window(at(7), [MORNING]) == at(4, day=11)
+    assert next_window(at(3), [NIGHT, MORNING]) == at(4)
+    assert next_window(at(12), [NIGHT, MORNING]) == at(23)
+    assert next_window(at(12), []) is None
+
+
+class FakeJar(BaseLaunchableJar):
+    "A source whose latest build is `build`, counting how often it is checked"
+
+    def __init__(self, name: str, directory: Path):
+        self.name = name
+        self.directory = directory
+        self.build = 1
+        self.checks = 0
+
+    def __repr__(self) -> str:
+        return self.name
+
+    async def fetch_async(self, store, dry=False, http=None):
+        self.checks += 1
+        src = self.directory / f"{self.name}-{self.build}.jar"
+        src.write_bytes(f"{self.name} build {self.build}".encode())
+        key = ("FakeJar", self.name, self.build)
+        return [JarInfo(key, store.put_file(key, src), src.name, build=self.build)]
+
+    def run(self, path, cwd, dry=False, store=None, console=None):
+        raise NotImplementedError
+
+    def start(self, path, cwd, store=None, **popen_options):
+        raise NotImplementedError
+
+
+class Clock:
+    "Stands in for the `time` module and `datetime.now` of the watcher"
+
+    def __init__(self, when: datetime):
+        self.now = when.timestamp()
+
+    def time(self) -> float:
+        return self.now
+
+    def set(self, when: datetime):
+        self.now = when.timestamp()
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock(at(12))
+
+    class FakeDatetime(datetime):
+        @classmethod
+        def now(cls, tz=None):
+            return cls.fromtimestamp(clock.now, tz)
+
+    monkeypatch.setattr(watch, "time", clock)
+    monkeypatch.setattr(watch, "datetime", FakeDatetime)
+    return clock
+
+
+def make_watcher(tmp_path: Path, **options) -> tuple[Watcher, FakeJar, FakeJar]:
+    (tmp_path / "src").mkdir()
+    server, plugin = FakeJar("server", tmp_path / "src"), FakeJar("plugin", tmp_path / "src")
+    folders = FolderSpecification(tmp_path / "server", tmp_path / "server" / "plugins", generations=tmp_path / "generations")
+    spec = Specification(server, [plugin], Store(tmp_path / "store", http_cache=False), folders)
+    args = SimpleNamespace(jobs=2, locked=False, lockfile=None)
+    watcher = Watcher(spec, args, DeployMode.Hardlink, report=tmp_path / "pending.json", **options)
+    return watcher, server, plugin
+
+
+def intervals(watcher: Watcher) -> list[float]:
+    return [s.interval for s in watcher.sources]
+
+
+def test_watcher_backs_off_while_unchanged(tmp_path, clock):
+    watcher, server, plugin = make_watcher(tmp_path, interval=60, max_interval=300)
+    start = clock.now
+
+    watcher.step()
+    assert (server.checks, plugin.checks) == (1, 1)
+    assert watcher.generations.current() is not None  # no windows: deployed as soon as resolved
+
+    clock.now = start + 30
+    watcher.step()
+    assert server.checks == 1  # not due yet
+
+    for elapsed, interval in [(60, 120), (180, 240), (420, 300), (720, 300)]:
+        clock.now = start + elapsed
+        watcher.step()
+        assert intervals(watcher) == [interval, interval]
+    assert server.checks == 5
+
+    # a new build resets the interval of its source only
+    server.build = 2
+    clock.now = start + 1020
+    watcher.step()
+    assert intervals(watcher) == [60, 300]
+    assert watcher.generations.current().server == "server-2.jar"
+
+
+def test_watcher_reports_pending_updates_and_deploys_in_window(tmp_path, clock):
+    night = (time(2, 0), time(4, 0))
+    watcher, server, plugin = make_watcher(tmp_path, interval=3600, max_interval=3600, windows=[night])
+
+    watcher.step()
+    report = json.loads(watcher.report.read_text())
+    assert watcher.generations.current() is None
+    assert report["live_generation"] is None
+    assert [p["source"] for p in report["pending"]] == ["server server", "plugin plugin"]
+    assert report["pending"][1]["available"][0]["name"] == "plugin-1.jar"
+    assert datetime.fromisoformat(report["next_deploy"]).replace(tzinfo=None) == at(2, day=11)
+
+    clock.set(at(13, day=10))  # later that day, outside the window
+    watcher.step()
+    assert watcher.generations.current() is None
+
+    clock.set(at(2, 30, day=11))
+    watcher.step()
+    gen = watcher.generations.current()
+    assert gen is not None
+    assert (tmp_path / "server" / "plugins" / "plugin-1.jar").exists()
+    report = json.loads(watcher.report.read_text())
+    assert report["live_generation"] == gen.id
+    assert report["pending"] == [] and report["next_deploy"] is None
+
+    # found outside the window, and only reported until the next one
+    plugin.build = 2
+    clock.set(at(12, day=11))
+    watcher.step()
+    assert watcher.generations.current().id == gen.id
+    [pending] = json.loads(watcher.report.read_text())["pending"]
+    assert pending["source"] == "plugin plugin"
+    assert [j["name"] for j in pending["live"]] == ["plugin-1.jar"]
+    assert [j["name"] for j in pending["available"]] == ["plugin-2.jar"]
+    assert pending["builds"] == [2]
+
+    clock.set(at(2, day=12))
+    watcher.step()
+    assert watcher.generations.current().id != gen.id
+    assert (tmp_path / "server" / "plugins" / "plugin-2.jar").exists()
+    assert not (tmp_path / "server" / "plugins" / "plugin-1.jar").exists()